@@ -0,0 +1,225 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+import torch
+import matcher
+from define_esim import BACKENDS
+import blocking
+import instrumentation
+import retrieval
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_LINES = 1000
+MEMO_SIZE = 100000
+
+# 每个工作进程各自持有的模型与参考数据
+_worker = {}
+
+
+def init_worker(model_path, word_dict_path, reference_path, cache_dir, index_dir, use_index, candidate_k,
+                num_threads, backend='eager', instrument=False, use_blocking=True, store_dir=None, cascade_path=None):
+    if instrument:
+        instrumentation.enable()
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    _worker['matcher'] = matcher.AddressMatcher(model_path, word_dict_path, reference_path, cache_dir,
+                                                prefilter='bm25' if use_index else None, index_dir=index_dir,
+                                                candidate_k=candidate_k, device=torch.device('cpu'),
+                                                backend=backend, blocking=use_blocking,
+                                                store_dir=store_dir, cascade_path=cascade_path).warm_up()
+
+
+def prepare(model_path, word_dict_path, reference_path, cache_dir, index_dir, use_index, backend='eager',
+            use_blocking=True):
+    # 参考缓存和索引在主进程中预先构建，避免多个工作进程同时重建
+    cache_path = matcher.reference_cache_path(model_path, word_dict_path, reference_path, cache_dir, backend)
+    word_dict = matcher.load_word_dict(word_dict_path)
+    if not os.path.exists(cache_path):
+        model, device = matcher.load_model(model_path, torch.device('cpu'), backend)
+        matcher.load_reference_cache(model, word_dict, device, model_path, word_dict_path, reference_path,
+                                     cache_dir, backend)
+    if use_index:
+        retrieval.load_or_build_index(word_dict, matcher.load_reference_addresses(reference_path), word_dict_path,
+                                      reference_path, index_dir)
+    if use_blocking:
+        blocking.parse_references(matcher.load_reference_addresses(reference_path), reference_path, cache_dir,
+                                  word_dict_path)
+
+
+def match_queries(queries, top_k):
+    address_matcher = _worker['matcher']
+    address_matcher.wait_ready()
+    # 整块查询一次送入 match_batch，共用批量编码与交互
+    results = address_matcher.match_batch(queries, top_k) if queries else []
+    # 工作进程的阶段统计随结果一起返回，由主进程汇总
+    stats = instrumentation.collect() if instrumentation.enabled() else None
+    return queries, results, address_matcher.threshold, stats
+
+
+def read_chunks(input_path, offset, column, chunk_lines=CHUNK_LINES):
+    # 流式读取查询文件，每个块附带读完后的字节偏移，用于断点续跑
+    with open(input_path, 'rb') as f:
+        f.seek(offset)
+        queries = []
+        for raw in iter(f.readline, b''):
+            line = raw.decode('utf-8').rstrip('\r\n')
+            columns = line.split('\t')
+            queries.append(columns[column].strip() if column < len(columns) else '')
+            if len(queries) >= chunk_lines:
+                yield queries, f.tell()
+                queries = []
+        if queries:
+            yield queries, f.tell()
+
+
+def load_progress(progress_path):
+    if not os.path.exists(progress_path):
+        return 0, 0
+    with open(progress_path, 'r', encoding='utf-8') as f:
+        input_offset, output_offset = f.read().split()
+    return int(input_offset), int(output_offset)
+
+
+def save_progress(progress_path, input_offset, output_offset):
+    with open(progress_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(f'{input_offset} {output_offset}\n')
+    os.replace(progress_path + '.tmp', progress_path)
+
+
+def format_row(query, results, top_k, threshold=matcher.DEFAULT_THRESHOLD):
+    best_match, score = results[0] if results else ('', 0.0)
+    row = [query, best_match, f'{score:.6f}', '1' if results and score > threshold else '0']
+    if top_k > 1:
+        row.append('|'.join(f'{address}:{s:.6f}' for address, s in results))
+    return '\t'.join(row) + '\n'
+
+
+def run(input_path, output_path, model_path=matcher.MODEL_PATH, word_dict_path=matcher.WORD_DICT_PATH,
+        reference_path=matcher.REFERENCE_PATH, cache_dir=matcher.CACHE_DIR, index_dir=retrieval.INDEX_DIR,
+        use_index=True, candidate_k=retrieval.TOP_K, top_k=1, workers=1, threads_per_worker=1, column=0,
+        chunk_lines=CHUNK_LINES, resume=False, backend='eager', instrument_path=None, trace_path=None,
+        use_blocking=True, store_dir=None, cascade_path=None):
+    progress_path = output_path + '.progress'
+    input_offset, output_offset = load_progress(progress_path) if resume else (0, 0)
+    output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+    if output_size < output_offset:
+        # 输出文件缺失或比记录的偏移短时，seek 过去会在文件中留下零字节；进度不可信，从头开始
+        logger.warning(f'{output_path} has {output_size} bytes but progress records {output_offset}, starting over')
+        input_offset, output_offset = 0, 0
+    if trace_path:
+        # torch.profiler 只能跟踪当前进程，剖析时在主进程内匹配
+        workers = 0
+    instrument = bool(instrument_path)
+    if instrument:
+        instrumentation.enable()
+    init_args = (model_path, word_dict_path, reference_path, cache_dir, index_dir, use_index, candidate_k,
+                 threads_per_worker, backend, instrument, use_blocking, store_dir, cascade_path)
+
+    if not store_dir:
+        # 参考库已经持久化了全部派生数据，无需预先构建
+        prepare(model_path, word_dict_path, reference_path, cache_dir, index_dir, use_index, backend, use_blocking)
+
+    pool = None
+    if workers > 0:
+        pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker, initargs=init_args)
+    else:
+        init_worker(*init_args)
+
+    memo = OrderedDict()
+    num_queries = 0
+    num_scored = 0
+    start = time.perf_counter()
+    mode = 'r+b' if resume and os.path.exists(output_path) else 'wb'
+    with instrumentation.profile(trace_path), open(output_path, mode) as out:
+        # 丢弃上次中断时写了一半的输出
+        out.seek(output_offset)
+        out.truncate()
+        pending = []
+
+        def flush(entry):
+            queries, end_offset, known, result = entry
+            if pool is not None:
+                result = result.get()
+            unique, results, threshold, stats = result
+            if stats is not None:
+                instrumentation.merge(stats)
+            known.update(zip(unique, results))
+            for query in queries:
+                out.write(format_row(query, known.get(query, []), top_k, threshold).encode('utf-8'))
+            memo.update(known)
+            while len(memo) > MEMO_SIZE:
+                memo.popitem(last=False)
+            out.flush()
+            save_progress(progress_path, end_offset, out.tell())
+            return len(queries)
+
+        for queries, end_offset in read_chunks(input_path, input_offset, column, chunk_lines):
+            # 相同查询只打分一次：块内去重，并跳过最近已打分的查询
+            known = {query: memo[query] for query in queries if query in memo}
+            unique = list(OrderedDict.fromkeys(query for query in queries if query and query not in known))
+            num_scored += len(unique)
+            if pool is not None:
+                result = pool.apply_async(match_queries, (unique, top_k))
+            else:
+                result = match_queries(unique, top_k)
+            pending.append((queries, end_offset, known, result))
+            # Keep a bounded number of chunks in flight so memory does not grow with the input
+            if len(pending) > max(workers, 1) * 2:
+                num_queries += flush(pending.pop(0))
+        while pending:
+            num_queries += flush(pending.pop(0))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f'Matched {num_queries} queries ({num_scored} scored) in {elapsed:.2f}s, '
+                f'{num_queries / max(elapsed, 1e-9):.1f} queries/s')
+    if instrument:
+        instrumentation.write_report(instrument_path)
+        logger.info(f'Stage timings written to {instrument_path}')
+    if trace_path:
+        logger.info(f'Profiler trace written to {trace_path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Match a file of addresses against the reference set')
+    parser.add_argument('input', help='one address per line, or TSV with --column')
+    parser.add_argument('output', help='output TSV: query, best match, score, matched[, top-K]')
+    parser.add_argument('--column', type=int, default=0)
+    parser.add_argument('--model', default=matcher.MODEL_PATH)
+    parser.add_argument('--word-dict', default=matcher.WORD_DICT_PATH)
+    parser.add_argument('--reference', default=matcher.REFERENCE_PATH)
+    parser.add_argument('--cache-dir', default=matcher.CACHE_DIR)
+    parser.add_argument('--index-dir', default=retrieval.INDEX_DIR)
+    parser.add_argument('--no-index', action='store_true', help='score against the whole reference set')
+    parser.add_argument('--candidate-k', type=int, default=retrieval.TOP_K)
+    parser.add_argument('--store-dir', help='match against a reference_store directory instead of --reference')
+    parser.add_argument('--cascade', help='lexical early-exit cascade fitted by cascade.py (e.g. result/cascade.json)')
+    parser.add_argument('--no-blocking', action='store_true', help='do not restrict candidates to the district/street')
+    parser.add_argument('--top-k', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=max(os.cpu_count() or 1, 1))
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--chunk-lines', type=int, default=CHUNK_LINES)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--backend', choices=BACKENDS, default='eager')
+    parser.add_argument('--instrument', metavar='PATH',
+                        help='write per-stage timings (JSON, or Prometheus text if PATH ends in .prom)')
+    parser.add_argument('--profile', metavar='TRACE', help='run in-process under torch.profiler, write a trace')
+    args = parser.parse_args()
+
+    run(args.input, args.output, args.model, args.word_dict, args.reference, args.cache_dir, args.index_dir,
+        use_index=not args.no_index, candidate_k=args.candidate_k, top_k=args.top_k, workers=args.workers,
+        threads_per_worker=args.threads_per_worker, column=args.column, chunk_lines=args.chunk_lines,
+        resume=args.resume, backend=args.backend, instrument_path=args.instrument, trace_path=args.profile,
+        use_blocking=not args.no_blocking, store_dir=args.store_dir, cascade_path=args.cascade)
+
+
+if __name__ == '__main__':
+    main()
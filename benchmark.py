@@ -0,0 +1,280 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import jieba
+import torch
+from define_esim import ESIM
+from matcher import address_to_index, load_word_dict, load_model, score_candidates, MODEL_PATH, \
+    WORD_DICT_PATH
+from generate_synthetic_addresses import load_or_generate
+import retrieval
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTPUT_PATH = 'result/benchmark.json'
+QUERY_PATH = 'data/dataset/test/address.txt'
+SUITES = ('tokenize', 'dataset', 'forward', 'packed', 'e2e')
+FORWARD_BATCH_SIZES = (1, 32, 128)
+FORWARD_SEQ_LENS = (16, 32, 64, 128)
+REFERENCE_SIZES = (10000, 100000, 1000000)
+TOLERANCE = 0.10
+
+
+def measure(fn, repeats=20, warmup=2):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def result(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def latency_results(name, latencies):
+    ordered = sorted(latencies)
+    return {
+        f'{name}.p50_ms': result(statistics.median(ordered) * 1000, 'ms', 'lower'),
+        f'{name}.p95_ms': result(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] * 1000,
+                                 'ms', 'lower'),
+    }
+
+
+def load_queries(query_path=QUERY_PATH, count=None):
+    # 查询取测试集第一列（带噪声的真实地址）
+    with open(query_path, 'r', encoding='utf-8') as f:
+        queries = [line.split('\t')[0].strip() for line in f if line.strip()]
+    return queries[:count] if count else queries
+
+
+def bench_tokenize(word_dict, queries):
+    jieba.initialize()
+    results = {}
+    start = time.perf_counter()
+    for query in queries:
+        jieba.lcut(query)
+    results['tokenize.jieba.addr_per_s'] = result(len(queries) / (time.perf_counter() - start), 'addr/s', 'higher')
+    start = time.perf_counter()
+    for query in queries:
+        address_to_index(query, word_dict)
+    results['tokenize.address_to_index.addr_per_s'] = result(len(queries) / (time.perf_counter() - start),
+                                                             'addr/s', 'higher')
+    start = time.perf_counter()
+    word_dict.encode_batch(queries)
+    results['tokenize.encode_batch.addr_per_s'] = result(len(queries) / (time.perf_counter() - start),
+                                                         'addr/s', 'higher')
+    return results
+
+
+def bench_dataset(split_dir='data/dataset/train'):
+    from train_esim import TextMatchDataset, load_dataset
+    from binary_dataset import has_binary
+    results = {}
+    start = time.perf_counter()
+    TextMatchDataset(os.path.join(split_dir, 'addr1_tokenized.txt'), os.path.join(split_dir, 'addr2_tokenized.txt'),
+                     os.path.join(split_dir, 'labels.txt'))
+    results['dataset.load_text_s'] = result(time.perf_counter() - start, 's', 'lower')
+    if has_binary(split_dir):
+        start = time.perf_counter()
+        load_dataset(split_dir)
+        results['dataset.load_binary_s'] = result(time.perf_counter() - start, 's', 'lower')
+    return results
+
+
+def bench_forward(model, vocab_size, batch_sizes=FORWARD_BATCH_SIZES, seq_lens=FORWARD_SEQ_LENS, repeats=10):
+    generator = torch.Generator().manual_seed(0)
+    results = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            for seq_len in seq_lens:
+                premise = torch.randint(1, vocab_size, (batch_size, seq_len), generator=generator)
+                hypothesis = torch.randint(1, vocab_size, (batch_size, seq_len), generator=generator)
+                latencies = measure(lambda: model(premise, hypothesis), repeats)
+                results.update(latency_results(f'forward.b{batch_size}.l{seq_len}', latencies))
+                logger.info(f'forward batch {batch_size:4d} len {seq_len:4d}: '
+                            f'{statistics.median(latencies) * 1000:8.2f} ms')
+    return results
+
+
+def bench_packed(model, vocab_size, batch_sizes=FORWARD_BATCH_SIZES, seq_lens=FORWARD_SEQ_LENS, repeats=10):
+    # 原始前向与 packed/masked 前向对比：每条序列的真实长度在 [1, seq_len] 内随机，其余位置为填充
+    generator = torch.Generator().manual_seed(0)
+    positions = {seq_len: torch.arange(seq_len) for seq_len in seq_lens}
+
+    def padded(batch_size, seq_len):
+        x = torch.randint(1, vocab_size, (batch_size, seq_len), generator=generator)
+        lengths = torch.randint(1, seq_len + 1, (batch_size, 1), generator=generator)
+        return x.masked_fill(positions[seq_len] >= lengths, 0)
+
+    results = {}
+    original = model.masked
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            for seq_len in seq_lens:
+                premise = padded(batch_size, seq_len)
+                hypothesis = padded(batch_size, seq_len)
+                medians = {}
+                for mode, masked in (('original', False), ('masked', True)):
+                    model.masked = masked
+                    latencies = measure(lambda: model(premise, hypothesis), repeats)
+                    results.update(latency_results(f'packed.{mode}.b{batch_size}.l{seq_len}', latencies))
+                    medians[mode] = statistics.median(latencies)
+                logger.info(f"packed batch {batch_size:4d} len {seq_len:4d}: "
+                            f"original {medians['original'] * 1000:8.2f} ms, masked {medians['masked'] * 1000:8.2f} ms "
+                            f"({medians['original'] / medians['masked']:.2f}x)")
+    model.masked = original
+    return results
+
+
+def bench_e2e(model, word_dict, queries, reference_sizes=REFERENCE_SIZES, candidate_k=retrieval.TOP_K, seed=0):
+    # 端到端：BM25 召回 candidate_k 个候选，ESIM 重排序（候选即时编码，不依赖参考编码缓存）
+    results = {}
+    device = torch.device('cpu')
+    for size in reference_sizes:
+        addresses = load_or_generate(size, seed)
+        start = time.perf_counter()
+        index = retrieval.InvertedIndex.build(addresses, word_dict)
+        # 保持为 ndarray 并只填充到最长序列，百万级参考集不展开成 Python 列表
+        reference_indices = word_dict.encode_batch(addresses, trim=True)
+        results[f'e2e.{size}.setup_s'] = result(time.perf_counter() - start, 's', 'lower')
+
+        def find_match(query):
+            candidate_ids = index.search_address(query, word_dict, k=candidate_k)[0]
+            scores = score_candidates(model, address_to_index(query, word_dict),
+                                      reference_indices[candidate_ids], device)
+            return addresses[candidate_ids[int(torch.argmax(scores))]] if len(scores) else None
+
+        find_match(queries[0])
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            find_match(query)
+            latencies.append(time.perf_counter() - start)
+        results.update(latency_results(f'e2e.{size}.query', latencies))
+        logger.info(f'e2e {size:8d} references: setup {results[f"e2e.{size}.setup_s"]["value"]:.1f}s, '
+                    f'p50 {results[f"e2e.{size}.query.p50_ms"]["value"]:.1f} ms')
+    return results
+
+
+def benchmark_model(model_path, vocab_size):
+    # 没有训练好的模型时使用随机初始化的 ESIM，延迟与权重无关
+    if os.path.exists(model_path):
+        model, _ = load_model(model_path, torch.device('cpu'))
+        return model, model.embedding.weight.shape[0], model_path
+    logger.warning(f'{model_path} not found, benchmarking a randomly initialised ESIM')
+    torch.manual_seed(0)
+    model = ESIM(vocab_size=vocab_size, embedding_dim=300, embedding_matrix=None, max_sequence_length=128).eval()
+    return model, vocab_size, None
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run(suites=SUITES, output_path=OUTPUT_PATH, model_path=MODEL_PATH, word_dict_path=WORD_DICT_PATH,
+        reference_sizes=REFERENCE_SIZES, num_queries=20, seed=0):
+    word_dict = load_word_dict(word_dict_path)
+    queries = load_queries()
+    model, vocab_size, model_used = benchmark_model(model_path, word_dict.size)
+
+    results = {}
+    if 'tokenize' in suites:
+        results.update(bench_tokenize(word_dict, queries[:10000]))
+    if 'dataset' in suites:
+        results.update(bench_dataset())
+    if 'forward' in suites:
+        results.update(bench_forward(model, vocab_size))
+    if 'packed' in suites:
+        results.update(bench_packed(model, vocab_size))
+    if 'e2e' in suites:
+        results.update(bench_e2e(model, word_dict, queries[:num_queries], reference_sizes, seed=seed))
+
+    report = {'environment': environment(), 'model': model_used, 'seed': seed, 'results': results}
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f'Wrote {len(results)} results to {output_path}')
+    return report
+
+
+def compare(baseline_path, current_path, tolerance=TOLERANCE):
+    # 与基线对比：指标变差超过 tolerance（相对值）即视为回归
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    for key in ('cpu_count', 'torch_threads', 'torch', 'processor'):
+        if baseline['environment'].get(key) != current['environment'].get(key):
+            logger.warning(f"environment differs on {key}: {baseline['environment'].get(key)} -> "
+                           f"{current['environment'].get(key)}")
+
+    regressions = []
+    for name, old in sorted(baseline['results'].items()):
+        new = current['results'].get(name)
+        if new is None:
+            # 基线中有而本次没有的指标说明对应测试没有跑完，按回归处理
+            regressions.append(name)
+            print(f"{name:45s} {old['value']:12.3f} -> {'missing':>12s} {old['unit']:7s} {'':8s}  REGRESSION")
+            continue
+        change = (new['value'] - old['value']) / max(abs(old['value']), 1e-12)
+        worse = -change if old['better'] == 'higher' else change
+        status = 'REGRESSION' if worse > tolerance else ('improved' if worse < -tolerance else 'ok')
+        if status == 'REGRESSION':
+            regressions.append(name)
+        print(f"{name:45s} {old['value']:12.3f} -> {new['value']:12.3f} {old['unit']:7s} {change:+8.1%}  {status}")
+    print(f"{len(regressions)} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Matching benchmarks and regression comparison')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark suite and write a JSON report')
+    run_parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    run_parser.add_argument('--output', default=OUTPUT_PATH)
+    run_parser.add_argument('--model', default=MODEL_PATH)
+    run_parser.add_argument('--word-dict', default=WORD_DICT_PATH)
+    run_parser.add_argument('--reference-sizes', type=int, nargs='+', default=list(REFERENCE_SIZES))
+    run_parser.add_argument('--queries', type=int, default=20, help='queries per reference size')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--threads', type=int, default=1, help='torch intra-op threads')
+    run_parser.add_argument('--baseline', help='compare against this report after running')
+    run_parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+
+    compare_parser = subparsers.add_parser('compare', help='compare a report against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        torch.set_num_threads(args.threads)
+        run(args.suites, args.output, args.model, args.word_dict, args.reference_sizes, args.queries, args.seed)
+        if args.baseline:
+            sys.exit(1 if compare(args.baseline, args.output, args.tolerance) else 0)
+    else:
+        sys.exit(1 if compare(args.baseline, args.current, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+
+# 二进制数据格式：每侧一个 int32 扁平 token 数组和一个 int64 偏移数组，标签为 uint8
+SIDES = ('addr1', 'addr2')
+
+
+def split_paths(split_dir):
+    paths = {}
+    for side in SIDES:
+        paths[f'{side}_tokens'] = os.path.join(split_dir, f'{side}_tokens.npy')
+        paths[f'{side}_offsets'] = os.path.join(split_dir, f'{side}_offsets.npy')
+    paths['labels'] = os.path.join(split_dir, 'labels.npy')
+    return paths
+
+
+def has_binary(split_dir):
+    return all(os.path.exists(path) for path in split_paths(split_dir).values())
+
+
+def flatten(sequences):
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum([len(seq) for seq in sequences], out=offsets[1:])
+    tokens = np.fromiter((token for seq in sequences for token in seq), dtype=np.int32, count=int(offsets[-1]))
+    return tokens, offsets
+
+
+def write_split(split_dir, addr1_sequences, addr2_sequences, labels):
+    paths = split_paths(split_dir)
+    arrays = {}
+    for side, sequences in zip(SIDES, (addr1_sequences, addr2_sequences)):
+        arrays[f'{side}_tokens'], arrays[f'{side}_offsets'] = flatten(sequences)
+    arrays['labels'] = np.asarray([int(float(label)) for label in labels], dtype=np.uint8)
+    for name, array in arrays.items():
+        # 先写临时文件再替换，避免读到写了一半的数组
+        tmp_path = paths[name][:-len('.npy')] + '.tmp.npy'
+        np.save(tmp_path, array)
+        os.replace(tmp_path, paths[name])
+
+
+def load_split(split_dir, mmap=True):
+    mode = 'r' if mmap else None
+    return {name: np.load(path, mmap_mode=mode) for name, path in split_paths(split_dir).items()}
+
+
+def read_tokenized(file_path):
+    with open(file_path, 'r') as f:
+        return [[int(x) for x in line.split()] for line in f]
+
+
+def convert_text_split(split_dir):
+    # 将已有的文本格式数据集转换为二进制格式，无需重新分词
+    addr1 = read_tokenized(os.path.join(split_dir, 'addr1_tokenized.txt'))
+    addr2 = read_tokenized(os.path.join(split_dir, 'addr2_tokenized.txt'))
+    with open(os.path.join(split_dir, 'labels.txt'), 'r') as f:
+        labels = [line.strip() for line in f if line.strip()]
+    write_split(split_dir, addr1, addr2, labels)
+    return len(labels)
+
+
+if __name__ == '__main__':
+    for split in ['train', 'test', 'valid']:
+        count = convert_text_split('data/dataset/' + split)
+        print(f"Converted {count} pairs in data/dataset/{split}")
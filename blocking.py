@@ -0,0 +1,224 @@
+import argparse
+import copy
+import hashlib
+import json
+import os
+import time
+import jieba
+import numpy as np
+from matcher import load_reference_addresses, load_word_dict, file_hash, vocab_hash, REFERENCE_PATH, WORD_DICT_PATH, \
+    CACHE_DIR
+
+# 行政层级及其后缀，按从粗到细的顺序
+LEVELS = (
+    ('district', ('区',)),
+    ('street', ('街道', '镇')),
+    ('community', ('社区',)),
+    ('road', ('大道', '路', '街', '巷')),
+)
+MAX_PREFIX_TOKENS = 4
+MAX_LEVEL = 2
+MIN_BLOCK_SIZE = 50
+
+
+def parse_admin(address_text):
+    # 从 jieba 分词结果的开头依次拼出 区/街道/社区/道路 前缀，遇到数字或超过 MAX_PREFIX_TOKENS 个词仍未成段即停止
+    parsed = {}
+    buffer = ''
+    buffer_tokens = 0
+    next_level = 0
+    for token in jieba.cut(address_text.strip()):
+        if any(ch.isdigit() for ch in token):
+            break
+        buffer += token
+        buffer_tokens += 1
+        for level in range(next_level, len(LEVELS)):
+            name, suffixes = LEVELS[level]
+            if buffer.endswith(suffixes) and len(buffer) > 1 and buffer not in suffixes:
+                parsed[name] = buffer
+                buffer = ''
+                buffer_tokens = 0
+                next_level = level + 1
+                break
+        if buffer_tokens >= MAX_PREFIX_TOKENS or next_level == len(LEVELS):
+            break
+    return parsed
+
+
+def admin_path(parsed, max_level=len(LEVELS)):
+    # 块的键为连续的层级前缀，在第一个缺失的层级处截断
+    path = []
+    for name, _ in LEVELS[:max_level]:
+        if name not in parsed:
+            break
+        path.append(parsed[name])
+    return tuple(path)
+
+
+class BlockIndex:
+    def __init__(self, paths, max_level=MAX_LEVEL, min_block_size=MIN_BLOCK_SIZE):
+        self.max_level = max_level
+        self.min_block_size = min_block_size
+        self.num_docs = len(paths)
+        exact = {}
+        for row, path in enumerate(paths):
+            exact.setdefault(tuple(path[:max_level]), []).append(row)
+        self.exact = exact
+
+        blocks = {}
+        for path, rows in exact.items():
+            for level in range(1, len(path) + 1):
+                blocks.setdefault(path[:level], []).extend(rows)
+        # 层级不完整的参考地址（如只有区）可能属于其下任意子块，一并放入
+        for key, rows in blocks.items():
+            for level in range(1, len(key)):
+                rows.extend(exact.get(key[:level], []))
+        self.blocks = {key: np.unique(np.asarray(rows, dtype=np.int64)) for key, rows in blocks.items()}
+        self.descendants = {}
+        for key in self.blocks:
+            for level in range(1, len(key)):
+                self.descendants.setdefault(key[:level], []).append(key)
+        # 增量追加的行放在覆盖层里，与基础分块分开存放，压缩后重新构建时才并入
+        self.added = {}
+        self.added_exact = {}
+        self.added_descendants = {}
+
+    def exact_rows(self, path):
+        return self.exact.get(path, []) + self.added_exact.get(path, [])
+
+    def extended(self, paths, start):
+        # 返回追加了从 start 开始的新行的分块；基础分块与原索引共用，只复制覆盖层，开销与压缩以来追加的行数成正比
+        index = copy.copy(self)
+        index.num_docs = self.num_docs + len(paths)
+        index.added_exact = {path: list(rows) for path, rows in self.added_exact.items()}
+        index.added_descendants = {path: list(keys) for path, keys in self.added_descendants.items()}
+        added = {}
+        for row, path in enumerate(paths, start):
+            added.setdefault(tuple(path[:self.max_level]), []).append(row)
+        changed = {}
+        for path, rows in added.items():
+            index.added_exact.setdefault(path, []).extend(rows)
+            for level in range(1, len(path) + 1):
+                changed.setdefault(path[:level], []).extend(rows)
+            # 层级不完整的新行属于其下已有的子块
+            for key in self.descendants.get(path, []) + self.added_descendants.get(path, []):
+                changed.setdefault(key, []).extend(rows)
+        # 新出现的块包含其各级前缀上层级不完整的行
+        for key, rows in changed.items():
+            if key not in self.blocks and key not in self.added:
+                for level in range(1, len(key)):
+                    rows.extend(index.exact_rows(key[:level]))
+                    index.added_descendants.setdefault(key[:level], []).append(key)
+        index.added = dict(self.added)
+        for key, rows in changed.items():
+            index.added[key] = np.union1d(self.added.get(key, np.zeros(0, dtype=np.int64)),
+                                          np.asarray(rows, dtype=np.int64))
+        return index
+
+    def block(self, key):
+        # 覆盖层里的行号都大于基础块里的行号（新块只有覆盖层），拼接后仍然有序
+        rows, added = self.blocks.get(key), self.added.get(key)
+        if added is None or rows is None:
+            return rows if added is None else added
+        return np.concatenate([rows, added])
+
+    def candidates(self, path):
+        # 从最细的层级向上回退，块太小时用父级；没有任何前缀时返回 None 表示不分块
+        for level in range(min(len(path), self.max_level), 0, -1):
+            rows = self.block(tuple(path[:level]))
+            if rows is not None and len(rows) >= self.min_block_size:
+                return rows
+        return None
+
+    def candidates_for(self, address_text):
+        return self.candidates(admin_path(parse_admin(address_text), self.max_level))
+
+    def level_sizes(self):
+        sizes = {}
+        for key in self.blocks.keys() | self.added.keys():
+            sizes.setdefault(len(key), []).append(len(self.block(key)))
+        return sizes
+
+
+def parse_references(addresses, reference_path=REFERENCE_PATH, cache_dir=CACHE_DIR, word_dict_path=WORD_DICT_PATH):
+    # 参考地址的解析结果按参考文件哈希和词表（决定 jieba 切分）缓存；调用方需已注册词表
+    key = hashlib.sha1(f'{file_hash(reference_path)}:{vocab_hash(word_dict_path)}'.encode('utf-8')).hexdigest()
+    path = os.path.join(cache_dir, f'admin_paths_{key[:16]}.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            paths = json.load(f)
+        if len(paths) == len(addresses):
+            return [tuple(p) for p in paths]
+    paths = [admin_path(parse_admin(address)) for address in addresses]
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(paths, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    return paths
+
+
+def load_block_index(addresses, reference_path=REFERENCE_PATH, cache_dir=CACHE_DIR, max_level=MAX_LEVEL,
+                     min_block_size=MIN_BLOCK_SIZE, word_dict_path=WORD_DICT_PATH):
+    return BlockIndex(parse_references(addresses, reference_path, cache_dir, word_dict_path), max_level,
+                      min_block_size)
+
+
+def block_report(block_index, addresses, pairs_path):
+    names = [name for name, _ in LEVELS]
+    for level, sizes in sorted(block_index.level_sizes().items()):
+        sizes = np.asarray(sizes)
+        print(f"Level {level} ({names[level - 1]}): {len(sizes)} blocks, size mean {sizes.mean():.0f}, "
+              f"p50 {np.percentile(sizes, 50):.0f}, p95 {np.percentile(sizes, 95):.0f}, max {sizes.max()}")
+
+    position = {address: i for i, address in enumerate(addresses)}
+    queries = []
+    with open(pairs_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            columns = line.strip().split('\t')
+            if len(columns) == 3 and columns[2] == '1' and columns[1] in position:
+                queries.append((columns[0], position[columns[1]]))
+
+    hits = 0
+    unblocked = 0
+    candidates = 0
+    start = time.perf_counter()
+    for query, target in queries:
+        rows = block_index.candidates_for(query)
+        if rows is None:
+            unblocked += 1
+            hits += 1
+            candidates += block_index.num_docs
+            continue
+        candidates += len(rows)
+        hits += bool(np.searchsorted(rows, target) < len(rows) and rows[np.searchsorted(rows, target)] == target)
+    elapsed = time.perf_counter() - start
+
+    mean_candidates = candidates / max(len(queries), 1)
+    print(f"Queries: {len(queries)}, reference addresses: {block_index.num_docs}, unblocked queries: {unblocked}")
+    print(f"Mean parse+lookup latency: {elapsed / max(len(queries), 1) * 1000:.2f} ms")
+    print(f"Mean candidates: {mean_candidates:.0f} ({block_index.num_docs / max(mean_candidates, 1):.1f}x fewer)")
+    print(f"Block recall: {hits / max(len(queries), 1):.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Partition the reference set by district/street and report recall')
+    parser.add_argument('--reference', default=REFERENCE_PATH)
+    parser.add_argument('--word-dict', default=WORD_DICT_PATH)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--max-level', type=int, default=MAX_LEVEL, choices=range(1, len(LEVELS) + 1))
+    parser.add_argument('--min-block-size', type=int, default=MIN_BLOCK_SIZE)
+    parser.add_argument('--pairs', default='data/dataset/test/address.txt')
+    args = parser.parse_args()
+
+    # 与匹配服务相同，先把词表注册进 jieba，否则解析出的行政区划与线上不一致
+    load_word_dict(args.word_dict, args.cache_dir)
+    addresses = load_reference_addresses(args.reference)
+    start = time.perf_counter()
+    block_index = load_block_index(addresses, args.reference, args.cache_dir, args.max_level, args.min_block_size,
+                                   args.word_dict)
+    print(f"Built blocks over {block_index.num_docs} addresses in {time.perf_counter() - start:.2f}s")
+    block_report(block_index, addresses, args.pairs)
+
+
+if __name__ == '__main__':
+    main()
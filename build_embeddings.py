@@ -0,0 +1,12 @@
+from stage_report import report
+from train_esim import build_combined_embeddings, EMBEDDING_PATH
+
+
+with report('build_embeddings'):
+    manifest = build_combined_embeddings(
+        'model/word2vec.model',
+        'GloVe/vectors.txt',
+        'data/vocab/intersection_vocab.txt',
+        EMBEDDING_PATH
+    )
+print(f"Embedding matrix {manifest['shape']} saved to {EMBEDDING_PATH}, {len(manifest['missing'])} words missing")
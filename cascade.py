@@ -0,0 +1,280 @@
+import argparse
+import json
+import logging
+import os
+import time
+import numpy as np
+import torch
+import matcher
+
+logger = logging.getLogger(__name__)
+
+CASCADE_PATH = 'result/cascade.json'
+FEATURES = ('jaccard', 'edit_similarity', 'prefix', 'number_jaccard', 'number_conflict', 'number_missing',
+            'length_ratio')
+# 验证集上允许提前拒绝的正样本比例，以及提前接受部分须达到的精确率
+MAX_REJECTED_POSITIVES = 0.001
+MIN_ACCEPT_PRECISION = 0.999
+CHUNK_PAIRS = 8192
+
+
+def numeric_tokens(word_dict):
+    # 词表 id -> 是否含数字（门牌号、栋号等）
+    is_numeric = torch.zeros(word_dict.size, dtype=torch.bool)
+    for word, index in word_dict.items():
+        if any(ch.isdigit() for ch in word):
+            is_numeric[index] = True
+    return is_numeric
+
+
+def sequence_lengths(x):
+    # 与 real_length 一致：末尾的 0 为填充，中间的 0 是未登录词
+    positions = torch.arange(1, x.size(1) + 1)
+    return (positions * (x != 0).long()).max(dim=1)[0]
+
+
+def distinct(x, valid):
+    # 每个词 id 只在第一次出现的位置计数
+    earlier = torch.ones(x.size(1), x.size(1), dtype=torch.bool).tril(-1)
+    repeated = ((x.unsqueeze(2) == x.unsqueeze(1)) & earlier & valid.unsqueeze(1)).any(dim=2)
+    return valid & ~repeated
+
+
+def set_overlap(a, b, a_valid, b_valid):
+    # 返回 |A∩B|, |A|, |B|（按去重后的词 id 集合计）
+    a_first = distinct(a, a_valid)
+    b_first = distinct(b, b_valid)
+    shared = ((a.unsqueeze(2) == b.unsqueeze(1)) & b_valid.unsqueeze(1)).any(dim=2) & a_first
+    return shared.sum(dim=1).float(), a_first.sum(dim=1).float(), b_first.sum(dim=1).float()
+
+
+def edit_distance(a, b, a_lengths, b_lengths):
+    # 词序列上的 Levenshtein 距离，整批向量化；行内的插入依赖用 cummin 一次求出
+    n, b_len = b.size(0), b.size(1)
+    columns = torch.arange(b_len + 1, dtype=torch.float32)
+    row = columns.expand(n, -1).clone()
+    distance = torch.where(a_lengths == 0, b_lengths.float(), torch.zeros(n))
+    for i in range(a.size(1)):
+        # 未登录词（id 0）与任何词都视为不同
+        cost = ((a[:, i:i + 1] != b) | (a[:, i:i + 1] == 0)).float()
+        step = torch.minimum(row[:, 1:] + 1, row[:, :-1] + cost)
+        step = torch.cat([torch.full((n, 1), float(i + 1)), step], dim=1)
+        row = torch.cummin(step - columns, dim=1)[0] + columns
+        done = a_lengths == i + 1
+        distance[done] = row[done, b_lengths[done]]
+    return distance
+
+
+def pair_features(a, b, is_numeric):
+    # a, b: (N, La), (N, Lb) 的词 id 矩阵，末尾补 0；返回 (N, len(FEATURES))
+    a_lengths, b_lengths = sequence_lengths(a), sequence_lengths(b)
+    a_valid = (torch.arange(a.size(1)) < a_lengths.unsqueeze(1)) & (a != 0)
+    b_valid = (torch.arange(b.size(1)) < b_lengths.unsqueeze(1)) & (b != 0)
+
+    shared, a_size, b_size = set_overlap(a, b, a_valid, b_valid)
+    jaccard = shared / (a_size + b_size - shared).clamp(min=1)
+
+    longest = torch.maximum(a_lengths, b_lengths).clamp(min=1).float()
+    edit_similarity = 1 - edit_distance(a, b, a_lengths, b_lengths) / longest
+
+    common = min(a.size(1), b.size(1))
+    same = (a[:, :common] == b[:, :common]) & a_valid[:, :common]
+    prefix = same.long().cumprod(dim=1).sum(dim=1) / torch.minimum(a_lengths, b_lengths).clamp(min=1)
+
+    a_numbers = a_valid & is_numeric[a]
+    b_numbers = b_valid & is_numeric[b]
+    shared_numbers, a_count, b_count = set_overlap(a, b, a_numbers, b_numbers)
+    number_jaccard = shared_numbers / (a_count + b_count - shared_numbers).clamp(min=1)
+    number_conflict = ((a_count > 0) & (b_count > 0) & (shared_numbers == 0)).float()
+    number_missing = ((a_count > 0) != (b_count > 0)).float()
+
+    length_ratio = torch.minimum(a_lengths, b_lengths).float() / longest
+    return torch.stack([jaccard, edit_similarity, prefix.float(), number_jaccard, number_conflict, number_missing,
+                        length_ratio], dim=1)
+
+
+class Cascade:
+    # 词法特征 + 逻辑回归：概率低于 low 直接拒绝、高于 high 直接接受，只有中间的不确定区间交给 ESIM
+    def __init__(self, weights, bias, low, high, is_numeric):
+        self.weights = torch.as_tensor(weights, dtype=torch.float32)
+        self.bias = float(bias)
+        self.low = low
+        self.high = high
+        self.is_numeric = is_numeric
+        self.exits = 0
+        self.pairs = 0
+
+    @classmethod
+    def load(cls, word_dict, path=CASCADE_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            params = json.load(f)
+        if tuple(params['features']) != FEATURES:
+            raise ValueError(f'{path} was fitted on features {params["features"]}, expected {list(FEATURES)}')
+        return cls(params['weights'], params['bias'], params['low'], params['high'], numeric_tokens(word_dict))
+
+    def save(self, path=CASCADE_PATH, **extra):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'features': list(FEATURES), 'weights': self.weights.tolist(), 'bias': self.bias,
+                       'low': self.low, 'high': self.high, **extra}, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def probability(self, a, b):
+        # 分块计算，编辑距离的中间矩阵不随批大小无限增长
+        chunks = []
+        for start in range(0, len(a), CHUNK_PAIRS):
+            features = pair_features(a[start:start + CHUNK_PAIRS], b[start:start + CHUNK_PAIRS], self.is_numeric)
+            chunks.append(torch.sigmoid(features @ self.weights + self.bias))
+        return torch.cat(chunks) if chunks else torch.empty(0)
+
+    def uncertain(self, probabilities):
+        uncertain = (probabilities >= self.low) & (probabilities <= self.high)
+        self.pairs += len(probabilities)
+        self.exits += int((~uncertain).sum())
+        return uncertain
+
+    def filter(self, query_indices, candidate_lists, reference_indices, top_k):
+        # 返回只含不确定候选的 candidate_lists，以及每个查询提前退出部分的 (接受, 拒绝) 两组 top_k (行号, 概率)
+        query_tensor = torch.as_tensor(query_indices, dtype=torch.long)
+        rows = torch.cat([torch.full((len(ids),), row, dtype=torch.long) for row, ids in enumerate(candidate_lists)])
+        ids = torch.cat(candidate_lists)
+        probabilities = self.probability(query_tensor[rows], reference_indices[ids])
+        uncertain = self.uncertain(probabilities)
+
+        remaining = []
+        exits = []
+        offset = 0
+        for candidate_ids in candidate_lists:
+            query_uncertain = uncertain[offset:offset + len(candidate_ids)]
+            query_probabilities = probabilities[offset:offset + len(candidate_ids)]
+            offset += len(candidate_ids)
+            remaining.append(candidate_ids[query_uncertain])
+            accepted = query_probabilities > self.high
+            rejected = ~query_uncertain & ~accepted
+            exits.append((top_rows(candidate_ids[accepted], query_probabilities[accepted], top_k),
+                          top_rows(candidate_ids[rejected], query_probabilities[rejected], top_k)))
+        return remaining, exits
+
+    def stats(self):
+        return {'pairs': self.pairs, 'early_exits': self.exits, 'exit_rate': self.exits / max(self.pairs, 1)}
+
+
+def top_rows(candidate_ids, probabilities, top_k):
+    top_probabilities, positions = torch.topk(probabilities, min(top_k, len(probabilities)))
+    return candidate_ids[positions].tolist(), top_probabilities.tolist()
+
+
+def fit_logistic(features, labels, iterations=200):
+    weights = torch.zeros(features.size(1), requires_grad=True)
+    bias = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([weights, bias], max_iter=iterations, line_search_fn='strong_wolfe')
+    loss_fn = torch.nn.BCEWithLogitsLoss()
+
+    def closure():
+        optimizer.zero_grad()
+        loss = loss_fn(features @ weights + bias, labels) + 1e-4 * weights.pow(2).sum()
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return weights.detach(), bias.item()
+
+
+def choose_band(probabilities, labels, threshold, max_rejected_positives=MAX_REJECTED_POSITIVES,
+                min_accept_precision=MIN_ACCEPT_PRECISION):
+    # low：拒绝区间内的正样本不超过 max_rejected_positives；high：接受区间的精确率不低于 min_accept_precision。
+    # 两者分居 ESIM 阈值两侧，提前退出的判定与阈值判定一致
+    order = torch.argsort(probabilities)
+    sorted_probabilities = probabilities[order]
+    sorted_labels = labels[order]
+    rejected_positives = sorted_labels.cumsum(0) / sorted_labels.sum().clamp(min=1)
+    allowed = int((rejected_positives <= max_rejected_positives).sum())
+    low = float(sorted_probabilities[allowed - 1]) if allowed else 0.0
+    low = min(low, threshold)
+
+    positives_above = sorted_labels.flip(0).cumsum(0)
+    precision_above = positives_above / torch.arange(1, len(labels) + 1)
+    # 从高到低扫描，取精确率仍满足要求的最大接受区间
+    meets = precision_above >= min_accept_precision
+    accepted = int(meets.long().cumprod(0).sum())
+    high = float(sorted_probabilities.flip(0)[accepted - 1]) if accepted else 1.0
+    high = max(high, threshold)
+    # 区间端点本身属于不确定区间
+    return float(np.nextafter(low, -1.0)), float(np.nextafter(high, 2.0)) if accepted else 1.0
+
+
+def split_tensors(split_dir):
+    from train_esim import load_dataset, collate_batch
+    dataset = load_dataset(split_dir)
+    batch = collate_batch([dataset[i] for i in range(len(dataset))])
+    return batch['addr1'], batch['addr2'], batch['label'].view(-1)
+
+
+def fit(word_dict, train_dir='data/dataset/train', valid_dir='data/dataset/valid', threshold=matcher.DEFAULT_THRESHOLD,
+        path=CASCADE_PATH):
+    # 逻辑回归在训练集上拟合，提前退出区间在验证集上标定
+    is_numeric = numeric_tokens(word_dict)
+    a, b, labels = split_tensors(train_dir)
+    weights, bias = fit_logistic(pair_features(a, b, is_numeric), labels)
+    cascade = Cascade(weights, bias, 0.0, 1.0, is_numeric)
+
+    a, b, labels = split_tensors(valid_dir)
+    probabilities = cascade.probability(a, b)
+    cascade.low, cascade.high = choose_band(probabilities, labels, threshold)
+    exits = (probabilities < cascade.low) | (probabilities > cascade.high)
+    logger.info(f'Band [{cascade.low:.4f}, {cascade.high:.4f}] around threshold {threshold:.2f}: '
+                f'{float(exits.float().mean()):.1%} of validation pairs exit early')
+    cascade.save(path, threshold=threshold)
+    return cascade
+
+
+def evaluate(model, device, cascade, threshold, split_dir='data/dataset/test'):
+    from train_esim import threshold_metrics
+    a, b, labels = split_tensors(split_dir)
+    pairs = [(a[i].tolist(), b[i].tolist()) for i in range(len(labels))]
+    thresholds = torch.tensor([threshold], dtype=torch.float64)
+
+    report = {}
+    for name, stage in (('esim', None), ('cascade', cascade)):
+        start = time.perf_counter()
+        scores = matcher.score_pairs(model, pairs, device, cascade=stage)
+        elapsed = time.perf_counter() - start
+        _, precision, recall, f1 = threshold_metrics(scores, labels, thresholds)
+        report[name] = {'precision': float(precision[0]), 'recall': float(recall[0]), 'f1': float(f1[0]),
+                        'seconds': elapsed}
+    probabilities = cascade.probability(a, b)
+    report['rejected'] = float((probabilities < cascade.low).float().mean())
+    report['accepted'] = float((probabilities > cascade.high).float().mean())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit and evaluate the lexical early-exit cascade in front of ESIM')
+    parser.add_argument('command', choices=['fit', 'evaluate'])
+    parser.add_argument('--model', default=matcher.MODEL_PATH)
+    parser.add_argument('--word-dict', default=matcher.WORD_DICT_PATH)
+    parser.add_argument('--output', default=CASCADE_PATH)
+    parser.add_argument('--split', default='data/dataset/test', help='split to evaluate on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    word_dict = matcher.load_word_dict(args.word_dict)
+    threshold = matcher.read_threshold(args.model)
+    if args.command == 'fit':
+        fit(word_dict, threshold=threshold, path=args.output)
+        return
+
+    cascade = Cascade.load(word_dict, args.output)
+    model, device = matcher.load_model(args.model)
+    report = evaluate(model, device, cascade, threshold, args.split)
+    esim, cascaded = report['esim'], report['cascade']
+    print(f"Early exits: {report['rejected']:.1%} rejected, {report['accepted']:.1%} accepted "
+          f"({report['rejected'] + report['accepted']:.1%} of pairs skip ESIM)")
+    print(f"ESIM only: P {esim['precision']:.4f} R {esim['recall']:.4f} F1 {esim['f1']:.4f} "
+          f"in {esim['seconds']:.1f}s")
+    print(f"Cascade:   P {cascaded['precision']:.4f} R {cascaded['recall']:.4f} F1 {cascaded['f1']:.4f} "
+          f"in {cascaded['seconds']:.1f}s (F1 {cascaded['f1'] - esim['f1']:+.4f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,21 @@
 import torch
 from torch import nn
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 
 
 class ESIM(nn.Module):
-    def __init__(self, vocab_size, embedding_dim, embedding_matrix, max_sequence_length, hidden_dim=128):
+    def __init__(self, vocab_size, embedding_dim, embedding_matrix, max_sequence_length, hidden_dim=128,
+                 masked=False):
         super(ESIM, self).__init__()
+        # masked=False 为原始前向，与现有 checkpoint 的分数和阈值一致；masked=True 时 LSTM 用 packed sequence
+        # 跳过填充位置，注意力 softmax 和池化排除填充。两种模式参数完全相同，模式记录在 checkpoint 的 'masked' 中
+        self.masked = masked
 
         # Embedding layer
         self.embedding = nn.Embedding(vocab_size, embedding_dim)
-        self.embedding.weight.data.copy_(torch.from_numpy(embedding_matrix))
+        # embedding_matrix 为 None 时权重由 checkpoint 提供
+        if embedding_matrix is not None:
+            self.embedding.weight.data.copy_(torch.tensor(embedding_matrix, dtype=torch.float32))
         self.embedding.weight.requires_grad = False
 
         # BiLSTM encoder
@@ -31,6 +38,12 @@ class ESIM(nn.Module):
 
     def soft_attention_align(self, x1, x2, mask1, mask2):
         attention = torch.matmul(x1, x2.transpose(1, 2))
+        if self.masked:
+            # Masked softmax: padded positions get zero weight
+            weight1 = torch.softmax(attention.masked_fill(~mask2.unsqueeze(1), float('-inf')), dim=-1)
+            weight2 = torch.softmax(attention.transpose(1, 2).masked_fill(~mask1.unsqueeze(1), float('-inf')), dim=-1)
+            return torch.matmul(weight1, x2), torch.matmul(weight2, x1)
+
         mask1 = mask1.float().unsqueeze(-1)
         mask2 = mask2.float().unsqueeze(1)
         attention = attention * mask1 * mask2
@@ -43,18 +56,56 @@ class ESIM(nn.Module):
 
         return x1_align, x2_align
 
-    def forward(self, premise, hypothesis):
-        # Create masks
-        premise_mask = premise != 0
-        hypothesis_mask = hypothesis != 0
-
-        # Embedding
-        premise_embed = self.embedding(premise)
-        hypothesis_embed = self.embedding(hypothesis)
-
-        # BiLSTM encoding
-        premise_encoded, _ = self.lstm(premise_embed)
-        hypothesis_encoded, _ = self.lstm(hypothesis_embed)
+    def lengths(self, mask):
+        # 序列长度取到最后一个非填充位置（中间的未登录词 0 仍算序列内），空序列按长度 1 处理
+        positions = torch.arange(1, mask.size(1) + 1, device=mask.device)
+        return (positions * mask.long()).max(dim=1)[0].clamp(min=1)
+
+    def length_mask(self, lengths, max_len: int):
+        return torch.arange(max_len, device=lengths.device).unsqueeze(0) < lengths.unsqueeze(1)
+
+    def run_lstm(self, x, lengths, composition: bool = False):
+        # composition 选择编码层或组合层的 BiLSTM（TorchScript 不支持把子模块当参数传递）
+        if not self.masked:
+            if composition:
+                output, _ = self.composition(x)
+            else:
+                output, _ = self.lstm(x)
+            return output
+        packed = pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        if composition:
+            packed_output, _ = self.composition(packed)
+        else:
+            packed_output, _ = self.lstm(packed)
+        return pad_packed_sequence(packed_output, batch_first=True, total_length=x.size(1))[0]
+
+    def run_pair(self, x1, x2, lengths1, lengths2, composition: bool = False):
+        # Both sides in one LSTM call. Padding x1 and x2 to a common length changes the
+        # unpacked (original) output, so that path only fuses equal-length inputs
+        if not self.masked and x1.size(1) != x2.size(1):
+            return self.run_lstm(x1, lengths1, composition), self.run_lstm(x2, lengths2, composition)
+        max_len = max(x1.size(1), x2.size(1))
+        fused = torch.cat([
+            nn.functional.pad(x1, (0, 0, 0, max_len - x1.size(1))),
+            nn.functional.pad(x2, (0, 0, 0, max_len - x2.size(1)))
+        ], dim=0)
+        output = self.run_lstm(fused, torch.cat([lengths1, lengths2]), composition)
+        return output[:x1.size(0), :x1.size(1)], output[x1.size(0):, :x2.size(1)]
+
+    @torch.jit.export
+    def encode(self, x):
+        # Embedding + BiLSTM encoding, reusable for precomputed reference states
+        mask = x != 0
+        lengths = self.lengths(mask)
+        return self.run_lstm(self.embedding(x), lengths), mask
+
+    @torch.jit.export
+    def interact(self, premise_encoded, premise_mask, hypothesis_encoded, hypothesis_mask):
+        premise_lengths = self.lengths(premise_mask)
+        hypothesis_lengths = self.lengths(hypothesis_mask)
+        if self.masked:
+            premise_mask = self.length_mask(premise_lengths, premise_mask.size(1))
+            hypothesis_mask = self.length_mask(hypothesis_lengths, hypothesis_mask.size(1))
 
         # Local inference
         premise_align, hypothesis_align = self.soft_attention_align(
@@ -77,21 +128,96 @@ class ESIM(nn.Module):
         ], dim=-1)
 
         # Inference composition
-        premise_composed, _ = self.composition(premise_enhanced)
-        hypothesis_composed, _ = self.composition(hypothesis_enhanced)
+        premise_composed, hypothesis_composed = self.run_pair(premise_enhanced, hypothesis_enhanced,
+                                                              premise_lengths, hypothesis_lengths, composition=True)
 
         # Pooling
-        premise_avg_pool = torch.mean(premise_composed, dim=1)
-        premise_max_pool = torch.max(premise_composed, dim=1)[0]
-        hypothesis_avg_pool = torch.mean(hypothesis_composed, dim=1)
-        hypothesis_max_pool = torch.max(hypothesis_composed, dim=1)[0]
-
-        # Classification
         pooled = torch.cat([
-            premise_avg_pool,
-            premise_max_pool,
-            hypothesis_avg_pool,
-            hypothesis_max_pool
+            self.pooling(premise_composed, premise_mask),
+            self.pooling(hypothesis_composed, hypothesis_mask)
         ], dim=-1)
 
-        return self.classification(pooled)
\ No newline at end of file
+        # Classification
+        return self.classification(pooled)
+
+    def pooling(self, composed, mask):
+        if self.masked:
+            # Masked mean/max pooling over real positions only
+            mask = mask.unsqueeze(-1)
+            avg_pool = (composed * mask).sum(dim=1) / mask.sum(dim=1)
+            max_pool = composed.masked_fill(~mask, float('-inf')).max(dim=1)[0]
+            return torch.cat([avg_pool, max_pool], dim=-1)
+        avg_pool = torch.mean(composed, dim=1)
+        max_pool = torch.max(composed, dim=1)[0]
+        return torch.cat([avg_pool, max_pool], dim=-1)
+
+    def forward(self, premise, hypothesis):
+        # BiLSTM encoding, premise and hypothesis batched into one LSTM call
+        premise_mask = premise != 0
+        hypothesis_mask = hypothesis != 0
+        premise_encoded, hypothesis_encoded = self.run_pair(
+            self.embedding(premise), self.embedding(hypothesis),
+            self.lengths(premise_mask), self.lengths(hypothesis_mask)
+        )
+
+        return self.interact(premise_encoded, premise_mask, hypothesis_encoded, hypothesis_mask)
+
+
+class BiEncoder(nn.Module):
+    # 蒸馏学生模型：单层 BiLSTM + masked mean/max 池化得到定长地址向量。两侧地址互不交互，
+    # 参考地址的向量可以一次性预计算并建索引，查询只需编码自身再做一次矩阵乘法
+    def __init__(self, vocab_size, embedding_dim, embedding_matrix=None, hidden_dim=128, output_dim=256):
+        super(BiEncoder, self).__init__()
+        self.embedding = nn.Embedding(vocab_size, embedding_dim)
+        if embedding_matrix is not None:
+            self.embedding.weight.data.copy_(torch.tensor(embedding_matrix, dtype=torch.float32))
+        self.embedding.weight.requires_grad = False
+
+        self.lstm = nn.LSTM(embedding_dim, hidden_dim, batch_first=True, bidirectional=True)
+        self.projection = nn.Linear(hidden_dim * 4, output_dim)
+        # Calibrates cosine similarity into a match probability: sigmoid(scale * cos + bias)
+        self.scale = nn.Parameter(torch.tensor(10.0))
+        self.bias = nn.Parameter(torch.tensor(-5.0))
+
+    def embed(self, x):
+        # (batch, seq_len) token ids -> (batch, output_dim) L2-normalised address vectors
+        mask = x != 0
+        positions = torch.arange(1, x.size(1) + 1, device=x.device)
+        lengths = (positions * mask.long()).max(dim=1)[0].clamp(min=1)
+        packed = pack_padded_sequence(self.embedding(x), lengths.cpu(), batch_first=True, enforce_sorted=False)
+        encoded, _ = self.lstm(packed)
+        encoded = pad_packed_sequence(encoded, batch_first=True, total_length=x.size(1))[0]
+
+        # Masked mean/max pooling over real positions only
+        valid = (positions.unsqueeze(0) <= lengths.unsqueeze(1)).unsqueeze(-1)
+        avg_pool = (encoded * valid).sum(dim=1) / valid.sum(dim=1)
+        max_pool = encoded.masked_fill(~valid, float('-inf')).max(dim=1)[0]
+        vectors = self.projection(torch.cat([avg_pool, max_pool], dim=-1))
+        return nn.functional.normalize(vectors, dim=-1)
+
+    def similarity(self, vectors1, vectors2):
+        # Row-wise pairs: (batch, dim) x (batch, dim) -> (batch, 1) probabilities
+        return torch.sigmoid(self.scale * (vectors1 * vectors2).sum(dim=-1, keepdim=True) + self.bias)
+
+    def score_matrix(self, query_vectors, reference_vectors):
+        # All queries against all references: (queries, dim) x (references, dim) -> (queries, references)
+        return torch.sigmoid(self.scale * query_vectors @ reference_vectors.T + self.bias)
+
+    def forward(self, premise, hypothesis):
+        # Same call signature and output as ESIM, so training and evaluation code is shared
+        return self.similarity(self.embed(premise), self.embed(hypothesis))
+
+
+BACKENDS = ('eager', 'torchscript', 'int8')
+
+
+def convert_model(model, backend='eager'):
+    # 推理后端：eager 为原始 fp32 模型；torchscript 为脚本化模型；int8 为 LSTM/Linear 动态量化后再脚本化（仅CPU）
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown backend {backend!r}, expected one of {BACKENDS}')
+    model.eval()
+    if backend == 'eager':
+        return model
+    if backend == 'int8':
+        model = torch.ao.quantization.quantize_dynamic(model.cpu(), {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    return torch.jit.script(model)
@@ -1,11 +1,14 @@
 import threading
-import json
+import time
 import tkinter as tk
 from tkinter import ttk
-import jieba
-import torch
-import torch.nn.functional as F
-from define_esim import ESIM
+
+# 候选召回方式: 'bm25' 倒排索引、'dense' 词向量 或 'student' 蒸馏双塔模型的地址向量
+PREFILTER = 'bm25'
+# 推理后端: 'eager'、'torchscript' 或 'int8'
+BACKEND = 'eager'
+# 打分进程数: 0 在界面进程内打分，>0 时参考集切片到多个进程并行打分
+SHARDS = 0
 
 
 class AddressMatcherGUI:
@@ -35,40 +38,29 @@ class AddressMatcherGUI:
         self.result_text = tk.Text(self.main_frame, height=4, width=50)
         self.result_text.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
 
-        # 加载模型和词典
+        # 窗口先显示，torch 等重量级模块和模型在后台线程中加载
+        self.matcher = None
+        self.search_button.state(['disabled'])
         self.result_text.insert(tk.END, "正在加载模型，请稍候...\n")
-        threading.Thread(target=self.load_resources).start()
+        threading.Thread(target=self.load_resources, daemon=True).start()
 
     def load_resources(self):
-        self.model, self.device = self.load_model()
-        self.word_dict = self.load_word_dict()
-        self.result_text.insert(tk.END, "模型加载完成！\n")
-
-    def load_word_dict(self):
-        return json.load(open('data/dict/word_dict.json', 'r', encoding='utf-8'))
-
-    def load_model(self):
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        embedding_matrix = torch.randn(44018, 200).numpy()
-        max_sequence_length = 128
-
-        model = ESIM(
-            vocab_size=44018,
-            embedding_dim=200,
-            embedding_matrix=embedding_matrix,
-            max_sequence_length=max_sequence_length,
-            hidden_dim=128
-        )
-
-        checkpoint = torch.load('result/best_esim_model.pth', map_location=device)
-        if isinstance(checkpoint, dict):
-            model.load_state_dict(checkpoint['model_state_dict'])
+        start = time.perf_counter()
+        import matcher
+        import_time = time.perf_counter() - start
+
+        self.matcher = matcher.AddressMatcher(prefilter=PREFILTER, backend=BACKEND, shards=SHARDS)
+        self.matcher.warm_up()
+        if self.matcher.ready:
+            timings = ', '.join(f'{name} {t:.2f}s' for name, t in self.matcher.timings.items())
+            self.root.after(0, self.on_ready, f"模型加载完成！(import {import_time:.2f}s, {timings})\n")
         else:
-            model.load_state_dict(checkpoint)
+            self.root.after(0, self.on_ready, f"模型加载失败: {self.matcher.error}\n")
 
-        model.to(device)
-        model.eval()
-        return model, device
+    def on_ready(self, message):
+        self.result_text.insert(tk.END, message)
+        if self.matcher.ready:
+            self.search_button.state(['!disabled'])
 
     def start_find_match(self):
         # 启动一个线程来执行查找匹配
@@ -81,48 +73,28 @@ class AddressMatcherGUI:
             self.result_text.insert(tk.END, "请输入地址")
             return
 
-        query_indices = address_to_index(query, self.word_dict)
+        if self.matcher is None or not self.matcher.ready:
+            self.result_text.delete(1.0, tk.END)
+            self.result_text.insert(tk.END, "模型正在加载，请稍候")
+            return
+
+        # 召回TOP_K个候选地址，再由ESIM重排序
+        results = self.matcher.match(query)
         best_match = None
         highest_score = -1
-
-        with torch.no_grad():
-            query_tensor = torch.LongTensor(query_indices).unsqueeze(0).to(self.device)
-
-            with open('data/dataset/demo/unique_addresses.txt', 'r', encoding='utf-8') as f:
-                for address in f:
-                    address = address.strip()
-                    if address:
-                        addr_indices = address_to_index(address, self.word_dict)
-                        addr_tensor = torch.LongTensor(addr_indices).unsqueeze(0).to(self.device)
-
-                        output = self.model(query_tensor, addr_tensor)
-                        score = output.cpu().item()
-
-                        if score > highest_score:
-                            highest_score = score
-                            best_match = address
+        if results:
+            best_match, highest_score = results[0]
 
         self.result_text.delete(1.0, tk.END)
-        if best_match:
+        if best_match and highest_score > self.matcher.threshold:
             self.result_text.insert(tk.END, f"最佳匹配: {best_match}\n相似度: {highest_score:.4f}")
+        elif best_match:
+            self.result_text.insert(tk.END, f"未找到匹配结果\n最接近: {best_match}\n相似度: {highest_score:.4f} "
+                                            f"(阈值 {self.matcher.threshold:.2f})")
         else:
             self.result_text.insert(tk.END, "未找到匹配结果")
 
 
-def address_to_index(address_text, word_dict):
-    indices = []
-    words = jieba.cut(address_text)
-    for word in words:
-        index = word_dict.get(word, 0)
-        indices.append(index)
-    max_len = 128
-    if len(indices) > max_len:
-        indices = indices[:max_len]
-    else:
-        indices.extend([0] * (max_len - len(indices)))
-    return indices
-
-
 def main():
     root = tk.Tk()
     app = AddressMatcherGUI(root)
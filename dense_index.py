@@ -0,0 +1,280 @@
+import argparse
+import copy
+import os
+import time
+import numpy as np
+from matcher import load_word_dict, load_reference_addresses, file_hash, vocab_hash, \
+    MODEL_PATH, WORD_DICT_PATH, REFERENCE_PATH, STUDENT_PATH
+from retrieval import TOP_K, recall_report, top_k
+
+DENSE_DIR = 'data/dense'
+STUDENT_DIR = 'data/dense_student'
+BLOCK_ROWS = 1 << 20
+SIF_A = 1e-3
+
+
+class DenseIndex:
+    def __init__(self, vectors, embeddings, token_weights, component, key=''):
+        self.vectors = vectors
+        self.embeddings = embeddings
+        self.token_weights = token_weights
+        self.component = component
+        self.key = key
+        self.num_docs = len(vectors)
+        # 增量追加的向量单独存放，接在基础向量之后参与打分，压缩后重新构建时才并入
+        self.added = np.zeros((0, vectors.shape[1]), dtype=vectors.dtype)
+
+    @classmethod
+    def build(cls, addresses, word_dict, embedding_matrix, pooling='sif', dtype=np.float32):
+        embeddings = np.asarray(embedding_matrix, dtype=np.float32)
+        ids, offsets = word_dict.encode_ragged(addresses, max_len=128)
+        sequences = [seq[seq != 0] for seq in np.split(ids, offsets[1:-1])] if addresses else []
+
+        if pooling == 'sif':
+            # SIF 权重 a / (a + p(w))，词频取自参考地址集本身
+            counts = np.bincount(np.concatenate(sequences + [np.zeros(0, dtype=np.int64)]),
+                                 minlength=len(embeddings)).astype(np.float64)
+            token_weights = (SIF_A / (SIF_A + counts / max(counts.sum(), 1))).astype(np.float32)
+        else:
+            token_weights = np.ones(len(embeddings), dtype=np.float32)
+        token_weights[0] = 0
+
+        vectors = np.stack([pool(seq, embeddings, token_weights) for seq in sequences]) if sequences \
+            else np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        component = np.zeros(embeddings.shape[1], dtype=np.float32)
+        if pooling == 'sif' and len(vectors):
+            # Remove the common component shared by all addresses
+            sample = vectors[np.random.default_rng(0).permutation(len(vectors))[:100000]]
+            component = np.linalg.svd(sample, full_matrices=False)[2][0].astype(np.float32)
+            vectors -= np.outer(vectors @ component, component)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-8)
+        return cls(vectors.astype(dtype), embeddings, token_weights, component)
+
+    def extended(self, addresses, word_dict):
+        # 追加的地址沿用构建时的 SIF 词权重和公共分量，参考库压缩后重新构建；基础向量与原索引共用，只复制追加部分
+        vectors = np.stack([self.encode_address(address, word_dict) for address in addresses]) if addresses \
+            else np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+        index = copy.copy(self)
+        index.added = np.concatenate([self.added, vectors.astype(self.vectors.dtype)])
+        index.num_docs = len(self.vectors) + len(index.added)
+        return index
+
+    def save(self, dense_dir=DENSE_DIR):
+        os.makedirs(dense_dir, exist_ok=True)
+        for name in ('vectors', 'embeddings', 'token_weights', 'component'):
+            tmp_path = os.path.join(dense_dir, f'{name}.tmp.npy')
+            np.save(tmp_path, getattr(self, name))
+            os.replace(tmp_path, os.path.join(dense_dir, f'{name}.npy'))
+        with open(os.path.join(dense_dir, 'key.txt'), 'w', encoding='utf-8') as f:
+            f.write(self.key)
+
+    @classmethod
+    def load(cls, dense_dir=DENSE_DIR):
+        # 参考向量矩阵以内存映射方式打开，不整体读入内存
+        arrays = [np.load(os.path.join(dense_dir, f'{name}.npy'), mmap_mode='r')
+                  for name in ('vectors', 'embeddings')]
+        token_weights = np.load(os.path.join(dense_dir, 'token_weights.npy'))
+        component = np.load(os.path.join(dense_dir, 'component.npy'))
+        with open(os.path.join(dense_dir, 'key.txt'), 'r', encoding='utf-8') as f:
+            key = f.read()
+        return cls(arrays[0], arrays[1], token_weights, component, key)
+
+    def encode_address(self, address, word_dict):
+        vector = pool(token_ids(address, word_dict), self.embeddings, self.token_weights)
+        vector -= (vector @ self.component) * self.component
+        return vector / max(np.linalg.norm(vector), 1e-8)
+
+    def search(self, query_vector, k=TOP_K, rows=None):
+        scores = block_scores(self.vectors, self.added, query_vector.astype(np.float32))
+        return top_k(scores, k, rows)
+
+    def search_address(self, address, word_dict, k=TOP_K, rows=None):
+        return self.search(self.encode_address(address, word_dict), k, rows)
+
+
+class StudentIndex:
+    # 蒸馏学生模型（BiEncoder）的参考地址向量只计算一次；查询编码后与全部参考向量做一次矩阵乘法
+    def __init__(self, vectors, model, key=''):
+        self.vectors = vectors
+        self.model = model
+        self.key = key
+        self.num_docs = len(vectors)
+        self.added = np.zeros((0, vectors.shape[1]), dtype=vectors.dtype)
+
+    @classmethod
+    def build(cls, addresses, word_dict, model, batch_size=1024, dtype=np.float32):
+        import torch
+        chunks = []
+        with torch.inference_mode():
+            for start in range(0, len(addresses), batch_size):
+                batch = word_dict.encode_batch(addresses[start:start + batch_size], trim=True)
+                chunks.append(model.embed(torch.from_numpy(batch)).numpy())
+        vectors = np.concatenate(chunks) if chunks else np.zeros((0, model.projection.out_features), dtype=np.float32)
+        return cls(vectors.astype(dtype), model)
+
+    def extended(self, addresses, word_dict):
+        vectors = StudentIndex.build(addresses, word_dict, self.model, dtype=self.vectors.dtype).vectors
+        index = copy.copy(self)
+        index.added = np.concatenate([self.added, vectors])
+        index.num_docs = len(self.vectors) + len(index.added)
+        return index
+
+    def save(self, student_dir=STUDENT_DIR):
+        os.makedirs(student_dir, exist_ok=True)
+        np.save(os.path.join(student_dir, 'vectors.tmp.npy'), self.vectors)
+        os.replace(os.path.join(student_dir, 'vectors.tmp.npy'), os.path.join(student_dir, 'vectors.npy'))
+        with open(os.path.join(student_dir, 'key.txt'), 'w', encoding='utf-8') as f:
+            f.write(self.key)
+
+    @classmethod
+    def load(cls, model, student_dir=STUDENT_DIR):
+        vectors = np.load(os.path.join(student_dir, 'vectors.npy'), mmap_mode='r')
+        with open(os.path.join(student_dir, 'key.txt'), 'r', encoding='utf-8') as f:
+            key = f.read()
+        return cls(vectors, model, key)
+
+    def encode_address(self, address, word_dict):
+        import torch
+        with torch.inference_mode():
+            return self.model.embed(torch.from_numpy(word_dict.encode_batch([address], trim=True)))[0].numpy()
+
+    def search(self, query_vector, k=TOP_K, rows=None):
+        # 余弦相似度与学生模型输出的匹配概率单调一致，直接按内积排序
+        scores = block_scores(self.vectors, self.added, query_vector.astype(self.vectors.dtype))
+        return top_k(scores, k, rows)
+
+    def search_address(self, address, word_dict, k=TOP_K, rows=None):
+        return self.search(self.encode_address(address, word_dict), k, rows)
+
+
+def block_scores(vectors, added, query_vector):
+    scores = np.empty(len(vectors) + len(added), dtype=np.float32)
+    # Blocked matrix-vector product keeps the working set bounded for very large reference sets
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = vectors[start:start + BLOCK_ROWS]
+        scores[start:start + len(block)] = block @ query_vector
+    scores[len(vectors):] = added @ query_vector
+    return scores
+
+
+def token_ids(address_text, word_dict):
+    indices = np.asarray(word_dict.encode(address_text), dtype=np.int64)
+    return indices[indices != 0]
+
+
+def pool(indices, embeddings, token_weights):
+    weights = token_weights[indices]
+    if not len(indices) or weights.sum() == 0:
+        return np.zeros(embeddings.shape[1], dtype=np.float32)
+    return (weights @ embeddings[indices] / weights.sum()).astype(np.float32)
+
+
+def load_embedding_matrix(source='combined', model_path=MODEL_PATH):
+    if source == 'checkpoint':
+        import torch
+        checkpoint = torch.load(model_path, map_location='cpu')
+        state_dict = checkpoint['model_state_dict'] if 'model_state_dict' in checkpoint else checkpoint
+        return state_dict['embedding.weight'].numpy()
+
+    from train_esim import load_combined_embeddings
+    embedding_matrix, _ = load_combined_embeddings(
+        'model/word2vec.model',
+        'GloVe/vectors.txt',
+        'data/vocab/intersection_vocab.txt'
+    )
+    return embedding_matrix
+
+
+def embedding_artifact(source='combined', model_path=MODEL_PATH):
+    # 词向量所在的文件：checkpoint 的 embedding 层，或 build_embeddings 生成的组合矩阵
+    if source == 'checkpoint':
+        return model_path
+    from train_esim import EMBEDDING_PATH
+    return EMBEDDING_PATH
+
+
+def dense_key(word_dict_path, reference_path, pooling, embedding_path, embedding_dtype, dtype=np.float32):
+    # 词向量文件及其精度、索引向量精度都写入键，重建词向量或切换来源后不会沿用旧索引
+    return (f"{vocab_hash(word_dict_path)}:{file_hash(reference_path)}:{pooling}:"
+            f"{file_hash(embedding_path)}:{np.dtype(embedding_dtype).name}:{np.dtype(dtype).name}")
+
+
+def load_or_build_dense_index(word_dict, addresses, word_dict_path=WORD_DICT_PATH, reference_path=REFERENCE_PATH,
+                              dense_dir=DENSE_DIR, pooling='sif', source='combined', model_path=MODEL_PATH,
+                              dtype=None):
+    # 先加载词向量（组合矩阵过期时会在此重建），再按其文件哈希判断索引是否可用；
+    # dtype 为 None 时接受磁盘上索引的向量精度（如 dense_index.py --float16 构建的索引），需要重建时用 float32
+    embedding_matrix = load_embedding_matrix(source, model_path)
+    artifact = embedding_artifact(source, model_path)
+    if os.path.exists(os.path.join(dense_dir, 'key.txt')):
+        index = DenseIndex.load(dense_dir)
+        if dtype is None or np.dtype(dtype) == index.vectors.dtype:
+            key = dense_key(word_dict_path, reference_path, pooling, artifact, embedding_matrix.dtype,
+                            index.vectors.dtype)
+            if index.key == key:
+                return index
+    dtype = np.float32 if dtype is None else dtype
+    key = dense_key(word_dict_path, reference_path, pooling, artifact, embedding_matrix.dtype, dtype)
+    index = DenseIndex.build(addresses, word_dict, embedding_matrix, pooling, dtype=dtype)
+    index.key = key
+    index.save(dense_dir)
+    return DenseIndex.load(dense_dir)
+
+
+def student_key(student_path, word_dict_path, reference_path):
+    return f"{file_hash(student_path)}:{vocab_hash(word_dict_path)}:{file_hash(reference_path)}"
+
+
+def load_or_build_student_index(word_dict, addresses, student_model, student_path=STUDENT_PATH,
+                                word_dict_path=WORD_DICT_PATH, reference_path=REFERENCE_PATH, student_dir=STUDENT_DIR):
+    key = student_key(student_path, word_dict_path, reference_path)
+    if os.path.exists(os.path.join(student_dir, 'key.txt')):
+        index = StudentIndex.load(student_model, student_dir)
+        if index.key == key:
+            return index
+    index = StudentIndex.build(addresses, word_dict, student_model)
+    index.key = key
+    index.save(student_dir)
+    return StudentIndex.load(student_model, student_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the dense-vector prefilter and report recall@K')
+    parser.add_argument('--reference', default=REFERENCE_PATH)
+    parser.add_argument('--word-dict', default=WORD_DICT_PATH)
+    parser.add_argument('--dense-dir', default=DENSE_DIR)
+    parser.add_argument('--pooling', choices=['sif', 'mean'], default='sif')
+    parser.add_argument('--source', choices=['combined', 'checkpoint'], default='combined')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--float16', action='store_true')
+    parser.add_argument('--student', nargs='?', const=STUDENT_PATH,
+                        help='index vectors from the distilled bi-encoder instead of pooled word vectors')
+    parser.add_argument('--student-dir', default=STUDENT_DIR)
+    parser.add_argument('--pairs', default='data/dataset/test/address.txt')
+    args = parser.parse_args()
+
+    word_dict = load_word_dict(args.word_dict)
+    addresses = load_reference_addresses(args.reference)
+    start = time.perf_counter()
+    if args.student:
+        from matcher import load_student
+        import torch
+        student, _ = load_student(args.student, torch.device('cpu'))
+        index = StudentIndex.build(addresses, word_dict, student, dtype=np.float16 if args.float16 else np.float32)
+        index.key = student_key(args.student, args.word_dict, args.reference)
+        index.save(args.student_dir)
+        print(f"Built student index over {index.num_docs} addresses in {time.perf_counter() - start:.2f}s")
+        recall_report(StudentIndex.load(student, args.student_dir), word_dict, addresses, args.pairs)
+        return
+    embedding_matrix = load_embedding_matrix(args.source, args.model)
+    dtype = np.float16 if args.float16 else np.float32
+    index = DenseIndex.build(addresses, word_dict, embedding_matrix, args.pooling, dtype=dtype)
+    index.key = dense_key(args.word_dict, args.reference, args.pooling, embedding_artifact(args.source, args.model),
+                          embedding_matrix.dtype, dtype)
+    index.save(args.dense_dir)
+    print(f"Built dense index over {index.num_docs} addresses in {time.perf_counter() - start:.2f}s")
+    recall_report(DenseIndex.load(args.dense_dir), word_dict, addresses, args.pairs)
+
+
+if __name__ == '__main__':
+    main()
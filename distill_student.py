@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import logging
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import Dataset
+from define_esim import BiEncoder
+from matcher import load_model, file_hash, CACHE_DIR, MODEL_PATH, STUDENT_PATH
+from train_esim import load_dataset, collate_batch, BucketBatchSampler, make_loader, train_model
+from dense_index import load_embedding_matrix
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SOFT_WEIGHT = 0.9
+STUDENT_PLOT_PATH = 'result/student_diagram.png'
+
+
+class SoftLabelDataset(Dataset):
+    # 训练目标为教师概率与真实标签的加权：soft_weight * teacher + (1 - soft_weight) * label
+    def __init__(self, dataset, teacher_scores, soft_weight=SOFT_WEIGHT):
+        self.dataset = dataset
+        self.lengths = dataset.lengths
+        labels = np.asarray(dataset.labels, dtype=np.float32)
+        self.targets = soft_weight * teacher_scores + (1 - soft_weight) * labels
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        item = self.dataset[idx]
+        item['label'] = float(self.targets[idx])
+        return item
+
+
+def teacher_scores(teacher, dataset, device, batch_size=512):
+    # 按长度排序成批，分数按样本下标写回
+    scores = np.empty(len(dataset), dtype=np.float32)
+    teacher.eval()
+    with torch.inference_mode():
+        for indices in BucketBatchSampler(dataset.lengths, batch_size, shuffle=False):
+            batch = collate_batch([dataset[i] for i in indices])
+            outputs = teacher(batch['addr1'].to(device), batch['addr2'].to(device))
+            scores[indices] = outputs.view(-1).float().cpu().numpy()
+    return scores
+
+
+def load_teacher_scores(teacher_path, split_dir, dataset, device, cache_dir=CACHE_DIR):
+    # 教师分数只算一次，以教师 checkpoint 和数据集为键缓存
+    key = hashlib.sha1(f'{file_hash(teacher_path)}:{os.path.abspath(split_dir)}:{len(dataset)}'.encode('utf-8'))
+    path = os.path.join(cache_dir, f'teacher_scores_{key.hexdigest()[:16]}.npy')
+    if os.path.exists(path):
+        return np.load(path)
+    teacher, _ = load_model(teacher_path, device)
+    scores = teacher_scores(teacher, dataset, device)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(path + '.tmp.npy', scores)
+    os.replace(path + '.tmp.npy', path)
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distil the ESIM teacher into a bi-encoder student')
+    parser.add_argument('--teacher', default=MODEL_PATH)
+    parser.add_argument('--output', default=STUDENT_PATH)
+    parser.add_argument('--plot', default=STUDENT_PLOT_PATH, help='training curves of the student')
+    parser.add_argument('--soft-weight', type=float, default=SOFT_WEIGHT,
+                        help='weight of the teacher probability in the training target')
+    parser.add_argument('--embeddings', choices=['checkpoint', 'combined'], default='checkpoint',
+                        help="initial word vectors: the teacher's embedding layer or the word2vec+GloVe matrix")
+    parser.add_argument('--hidden-dim', type=int, default=128)
+    parser.add_argument('--output-dim', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads')
+    args = parser.parse_args()
+
+    MAX_LEN = 128
+    EVAL_BATCH_SIZE = 512
+    DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    train_dataset = load_dataset('data/dataset/train', max_len=MAX_LEN)
+    val_dataset = load_dataset('data/dataset/valid', max_len=MAX_LEN)
+    scores = load_teacher_scores(args.teacher, 'data/dataset/train', train_dataset, DEVICE)
+    logger.info(f'Teacher scores for {len(scores)} training pairs, mean {scores.mean():.4f}')
+
+    train_loader = make_loader(
+        SoftLabelDataset(train_dataset, scores, args.soft_weight),
+        BucketBatchSampler(train_dataset.lengths, args.batch_size, shuffle=True),
+        args.workers
+    )
+    val_loader = make_loader(
+        val_dataset,
+        BucketBatchSampler(val_dataset.lengths, EVAL_BATCH_SIZE, shuffle=False),
+        args.workers
+    )
+
+    embedding_matrix = load_embedding_matrix(args.embeddings, args.teacher)
+    student = BiEncoder(
+        vocab_size=embedding_matrix.shape[0],
+        embedding_dim=embedding_matrix.shape[1],
+        embedding_matrix=embedding_matrix,
+        hidden_dim=args.hidden_dim,
+        output_dim=args.output_dim
+    ).to(DEVICE)
+
+    # 验证集上仍按真实标签计算 F1 并保存最优 checkpoint 和阈值
+    train_model(
+        model=student,
+        train_loader=train_loader,
+        val_loader=val_loader,
+        criterion=nn.BCELoss(),
+        optimizer=optim.Adam([p for p in student.parameters() if p.requires_grad], lr=args.learning_rate),
+        num_epochs=args.epochs,
+        device=DEVICE,
+        save_path=args.output,
+        # 教师模型的训练曲线保留在 result/diagram.png，学生单独一张图
+        plot_path=args.plot
+    )
+    logger.info(f'Student saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
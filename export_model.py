@@ -0,0 +1,94 @@
+import argparse
+import logging
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from sklearn.metrics import precision_score, recall_score, f1_score
+from define_esim import BACKENDS
+from matcher import load_model, exported_model_path, read_threshold, MODEL_PATH
+from train_esim import load_dataset, BucketBatchSampler, collate_batch
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCH_BATCH_SIZES = (1, 8, 32, 128, 512)
+
+
+def export(model_path=MODEL_PATH, backends=('torchscript', 'int8')):
+    for backend in backends:
+        model, _ = load_model(model_path, torch.device('cpu'), backend)
+        path = exported_model_path(model_path, backend)
+        torch.jit.save(model, path)
+        logger.info(f'Exported {backend} model to {path}')
+
+
+def collect_scores(model, loader):
+    scores = []
+    labels = []
+    with torch.no_grad():
+        for batch in loader:
+            scores.append(model(batch['addr1'], batch['addr2']).squeeze(-1))
+            labels.append(batch['label'].squeeze(-1))
+    return torch.cat(scores).numpy(), torch.cat(labels).numpy()
+
+
+def benchmark(model, dataset, batch_size, repeats=20):
+    batch = collate_batch([dataset[i] for i in range(min(batch_size, len(dataset)))])
+    with torch.no_grad():
+        model(batch['addr1'], batch['addr2'])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(batch['addr1'], batch['addr2'])
+    latency = (time.perf_counter() - start) / repeats
+    return latency, len(batch['label']) / latency
+
+
+def parity_report(model_path=MODEL_PATH, backends=BACKENDS, split_dir='data/dataset/test', batch_size=256,
+                  bench_batch_sizes=BENCH_BATCH_SIZES):
+    dataset = load_dataset(split_dir)
+    loader = DataLoader(
+        dataset,
+        batch_sampler=BucketBatchSampler(dataset.lengths, batch_size, shuffle=False),
+        collate_fn=collate_batch
+    )
+
+    # 与线上一致，按训练时保存的判定阈值计算指标和判定一致率
+    threshold = read_threshold(model_path)
+    logger.info(f'Decision threshold: {threshold:.2f}')
+    reference = None
+    for backend in backends:
+        model, _ = load_model(model_path, torch.device('cpu'), backend)
+        scores, labels = collect_scores(model, loader)
+        predictions = (scores > threshold).astype(np.float32)
+        if reference is None:
+            reference = scores
+
+        logger.info('-' * 50)
+        logger.info(f'Backend: {backend}')
+        logger.info(f'Precision: {precision_score(labels, predictions):.4f}')
+        logger.info(f'Recall: {recall_score(labels, predictions):.4f}')
+        logger.info(f'F1 Score: {f1_score(labels, predictions):.4f}')
+        logger.info(f'Max |score - fp32|: {np.abs(scores - reference).max():.6f}')
+        logger.info(f'Decision agreement with fp32: {((scores > threshold) == (reference > threshold)).mean():.4%}')
+        for bench_batch_size in bench_batch_sizes:
+            latency, throughput = benchmark(model, dataset, bench_batch_size)
+            logger.info(f'Batch {bench_batch_size:4d}: {latency * 1000:8.2f} ms/batch, {throughput:9.1f} pairs/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export TorchScript/int8 models and report parity with fp32')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0 = default)')
+    parser.add_argument('--skip-report', action='store_true')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    export(args.model)
+    if not args.skip_report:
+        parity_report(args.model)
+
+
+if __name__ == '__main__':
+    main()
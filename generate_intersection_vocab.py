@@ -1,29 +1,59 @@
-import gensim
-import numpy as np
+import argparse
+import os
+from stage_report import report
+from train_word2vec import MODEL_FILE, vocab_path, write_vocab
 
 
-def generate_intersection_vocab(glove_vectors_file, word2vec_model_file, output_file):
-    # Load Word2Vec model
-    w2v_model = gensim.models.Word2Vec.load(word2vec_model_file)
-    w2v_vocab = set(w2v_model.wv.index_to_key)
-
-    # Load GloVe vectors
-    glove_vocab = set()
-    with open(glove_vectors_file, 'r', encoding='utf-8') as f:
+def read_vocab(vocab_file):
+    # 词表文件每行首列为词（word2vec 的 词\t频次，GloVe vocab_count 的 词 频次，或 vectors.txt 的 词 向量…），其余列不解析
+    with open(vocab_file, 'r', encoding='utf-8') as f:
         for line in f:
-            word = line.strip().split()[0]
-            glove_vocab.add(word)
+            word = line.split(None, 1)[0] if line.strip() else None
+            if word:
+                yield word
+
+
+def word2vec_vocab(model_file):
+    # 训练时已写出词表；旧模型没有词表文件时以 mmap 方式加载一次补写，大数组不读入内存
+    vocab_file = vocab_path(model_file)
+    if not os.path.exists(vocab_file):
+        import gensim
+        write_vocab(gensim.models.Word2Vec.load(model_file, mmap='r'), vocab_file)
+    return vocab_file
+
+
+def glove_vocab(glove_vectors_file):
+    # 优先使用 GloVe 的 vocab_count 输出（与 vectors.txt 同目录的 vocab.txt），否则流式读取向量文件首列
+    vocab_file = os.path.join(os.path.dirname(glove_vectors_file), 'vocab.txt')
+    return vocab_file if os.path.exists(vocab_file) else glove_vectors_file
 
-    # Find intersection
-    intersection_vocab = glove_vocab.intersection(w2v_vocab)
+
+def generate_intersection_vocab(glove_vectors_file, word2vec_model_file, output_file):
+    # 只把 word2vec 词表放进集合，GloVe 一侧逐行流式比对
+    w2v_vocab = set(read_vocab(word2vec_vocab(word2vec_model_file)))
+    intersection_vocab = {word for word in read_vocab(glove_vocab(glove_vectors_file)) if word in w2v_vocab}
 
     # Save intersection vocabulary
-    with open(output_file, 'w', encoding='utf-8') as f:
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
         for word in sorted(intersection_vocab):
             f.write(f"{word}\n")
+    os.replace(tmp_file, output_file)
 
     return len(intersection_vocab)
 
 
-vocab_size = generate_intersection_vocab('GloVe/vectors.txt', 'model/word2vec.model', 'data/vocab/intersection_vocab.txt')
-print(f"Intersection vocabulary size: {vocab_size}")
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description='Intersect the word2vec and GloVe vocabularies')
+    parser.add_argument('--glove', default='GloVe/vectors.txt')
+    parser.add_argument('--word2vec', default=MODEL_FILE)
+    parser.add_argument('--output', default='data/vocab/intersection_vocab.txt')
+    args = parser.parse_args()
+
+    with report('generate_intersection_vocab'):
+        vocab_size = generate_intersection_vocab(args.glove, args.word2vec, args.output)
+    print(f"Intersection vocabulary size: {vocab_size}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import os
+import random
+import re
+
+REFERENCE_PATH = 'data/dataset/demo/unique_addresses.txt'
+OUTPUT_DIR = 'data/dataset/synthetic'
+
+ADDRESS_PATTERN = re.compile(r'^(.{1,4}?区)(.{1,6}?街道)?(.*)$')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+
+def split_address(address):
+    # 区 / 街道 / 地点（第一个数字之前） / 门牌号之后的部分
+    match = ADDRESS_PATTERN.match(address)
+    if not match:
+        return None
+    district, street, rest = match.group(1), match.group(2) or '', match.group(3)
+    number = NUMBER_PATTERN.search(rest)
+    if number is None:
+        return district, street, rest, ''
+    tail = rest[number.end():]
+    if tail.startswith('号'):
+        tail = tail[1:]
+    return district, street, rest[:number.start()], tail
+
+
+class AddressGenerator:
+    # 以真实参考地址的 区-街道-地点 组合为骨架，随机门牌号和后缀生成大规模合成地址
+    def __init__(self, seed_addresses, seed=0):
+        self.rng = random.Random(seed)
+        self.places = {}
+        self.tails = []
+        for address in seed_addresses:
+            parts = split_address(address)
+            if parts is None:
+                continue
+            district, street, place, tail = parts
+            if place:
+                self.places.setdefault((district, street), []).append(place)
+            if tail:
+                self.tails.append(tail)
+        self.areas = sorted(self.places)
+        self.weights = [len(self.places[area]) for area in self.areas]
+
+    def random_digits(self, match):
+        return str(self.rng.randint(1, 10 ** len(match.group(0)) - 1))
+
+    def address(self):
+        district, street = self.rng.choices(self.areas, self.weights)[0]
+        place = self.rng.choice(self.places[(district, street)])
+        address = f'{district}{street}{place}{self.rng.randint(1, 999)}号'
+        if self.tails and self.rng.random() < 0.5:
+            address += NUMBER_PATTERN.sub(self.random_digits, self.rng.choice(self.tails))
+        return address
+
+    def generate(self, count, exclude=()):
+        # 去重，且不与种子地址重复；同一 seed 产出的序列完全一致
+        seen = set(exclude)
+        addresses = []
+        attempts = 0
+        while len(addresses) < count:
+            attempts += 1
+            if attempts > count * 20:
+                raise ValueError(f'could only generate {len(addresses)} unique addresses')
+            address = self.address()
+            if address not in seen:
+                seen.add(address)
+                addresses.append(address)
+        return addresses
+
+
+def load_seed_addresses(reference_path=REFERENCE_PATH):
+    with open(reference_path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def synthetic_path(count, seed=0, output_dir=OUTPUT_DIR):
+    return os.path.join(output_dir, f'addresses_{count}_seed{seed}.txt')
+
+
+def load_or_generate(count, seed=0, reference_path=REFERENCE_PATH, output_dir=OUTPUT_DIR):
+    # 参考集本身排在最前，不足部分由合成地址补齐
+    path = synthetic_path(count, seed, output_dir)
+    if os.path.exists(path):
+        return load_seed_addresses(path)
+    seed_addresses = load_seed_addresses(reference_path)
+    addresses = seed_addresses[:count]
+    if count > len(addresses):
+        addresses += AddressGenerator(seed_addresses, seed).generate(count - len(addresses), seed_addresses)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        for address in addresses:
+            f.write(address + '\n')
+    os.replace(path + '.tmp', path)
+    return addresses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic reference set from the demo addresses')
+    parser.add_argument('counts', type=int, nargs='+', help='number of addresses, e.g. 10000 100000 1000000')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reference', default=REFERENCE_PATH)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    for count in args.counts:
+        load_or_generate(count, args.seed, args.reference, args.output_dir)
+        print(f"Wrote {count} addresses to {synthetic_path(count, args.seed, args.output_dir)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import contextlib
+import json
+import threading
+import time
+from collections import deque
+
+# 默认关闭：stage() 返回共享的空上下文，热路径上只多一次函数调用
+WINDOW = 10000
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_synchronize = False
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_null = contextlib.nullcontext()
+
+
+class Histogram:
+    # 累计计数/总和/分桶用于 Prometheus，最近 WINDOW 个样本用于 p50/p95/p99
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.window = deque(maxlen=WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.window.append(value)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.window.extend(other.window)
+
+    def summary(self):
+        ordered = sorted(self.window)
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total / max(self.count, 1) * 1000,
+            'p50_ms': percentile(ordered, 50) * 1000,
+            'p95_ms': percentile(ordered, 95) * 1000,
+            'p99_ms': percentile(ordered, 99) * 1000,
+        }
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _synchronize:
+            _cuda_synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _synchronize:
+            _cuda_synchronize()
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def _cuda_synchronize():
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def enable(synchronize=False):
+    # synchronize=True 时在计时边界同步 CUDA，GPU 上的阶段耗时才准确
+    global _enabled, _synchronize
+    _enabled = True
+    _synchronize = synchronize
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def stage(name):
+    return _Timer(name) if _enabled else _null
+
+
+def observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def count(name, n=1):
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def timed(name, fn):
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return fn(*args, **kwargs)
+        with _Timer(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def instrument_model(model):
+    # 在实例上包装 ESIM 各阶段；脚本化模型（torchscript/int8）无法包装，只有匹配循环的阶段计时
+    import torch
+    if isinstance(model, torch.jit.ScriptModule):
+        return model
+    model.embedding.forward = timed('esim.embedding', model.embedding.forward)
+    model.lstm.forward = timed('esim.encoder_lstm', model.lstm.forward)
+    model.soft_attention_align = timed('esim.soft_attention_align', model.soft_attention_align)
+    model.composition.forward = timed('esim.composition_lstm', model.composition.forward)
+    model.pooling = timed('esim.pooling', model.pooling)
+    model.classification.forward = timed('esim.classification', model.classification.forward)
+    return model
+
+
+def collect():
+    # 取出并清空当前进程的统计，供多进程汇总（见 merge）
+    with _lock:
+        state = (dict(_histograms), dict(_counters))
+        _histograms.clear()
+        _counters.clear()
+    return state
+
+
+def merge(state):
+    histograms, counters = state
+    with _lock:
+        for name, histogram in histograms.items():
+            _histograms.setdefault(name, Histogram()).merge(histogram)
+        for name, value in counters.items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    with _lock:
+        return {
+            'stages': {name: histogram.summary() for name, histogram in sorted(_histograms.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def to_json():
+    return json.dumps(snapshot(), ensure_ascii=False, indent=2)
+
+
+def to_prometheus(prefix='address_matching'):
+    lines = [f'# TYPE {prefix}_stage_seconds histogram']
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram.buckets):
+                cumulative += n
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {histogram.total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        lines.append(f'# TYPE {prefix}_events_total counter')
+        for name, value in sorted(_counters.items()):
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(path):
+    # 按扩展名选择格式：.prom 为 Prometheus 文本，其余为 JSON
+    text = to_prometheus() if path.endswith('.prom') else to_json()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+@contextlib.contextmanager
+def profile(trace_path=None):
+    # 用 torch.profiler 包裹一段运行，结束后写出 Chrome trace 文件
+    if not trace_path:
+        yield None
+        return
+    from torch.profiler import profile as torch_profile, ProfilerActivity
+    import torch
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    with torch_profile(activities=activities, record_shapes=True) as profiler:
+        yield profiler
+    profiler.export_chrome_trace(trace_path)
@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import matcher
+from define_esim import BACKENDS
+import instrumentation
+import retrieval
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HOST = '127.0.0.1'
+PORT = 8000
+MAX_BATCH_SIZE = 32
+MAX_WAIT_MS = 5
+LATENCY_WINDOW = 10000
+MAX_BODY_BYTES = 1 << 20
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class Metrics:
+    def __init__(self):
+        self.start_time = time.time()
+        self.requests = {}
+        self.errors = 0
+        self.latencies = {}
+        self.batches = 0
+        self.batched_items = 0
+
+    def observe(self, endpoint, latency):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def snapshot(self):
+        uptime = time.time() - self.start_time
+        endpoints = {}
+        for endpoint, window in self.latencies.items():
+            ordered = sorted(window)
+            endpoints[endpoint] = {
+                'requests': self.requests[endpoint],
+                'p50_ms': percentile(ordered, 50) * 1000,
+                'p95_ms': percentile(ordered, 95) * 1000,
+                'p99_ms': percentile(ordered, 99) * 1000,
+            }
+        total = sum(self.requests.values())
+        return {
+            'uptime_s': uptime,
+            'requests': total,
+            'errors': self.errors,
+            'throughput_rps': total / max(uptime, 1e-9),
+            'batches': self.batches,
+            'mean_batch_size': self.batched_items / max(self.batches, 1),
+            'endpoints': endpoints,
+        }
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class MicroBatcher:
+    # 将并发请求合并为一个批次，一次ESIM前向服务多个客户端
+    def __init__(self, handler, metrics, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.handler = handler
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        # 模型只在单个线程中运行，事件循环保持响应
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            self.metrics.batches += 1
+            self.metrics.batched_items += len(items)
+            try:
+                results = await loop.run_in_executor(self.executor, self.handler, items)
+            except Exception as e:
+                logger.exception('batch failed')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class MatchService:
+    def __init__(self, model_path=matcher.MODEL_PATH, word_dict_path=matcher.WORD_DICT_PATH,
+                 reference_path=matcher.REFERENCE_PATH, cache_dir=matcher.CACHE_DIR, index_dir=retrieval.INDEX_DIR,
+                 candidate_k=retrieval.TOP_K, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 backend='eager', result_cache_size=matcher.RESULT_CACHE_SIZE,
+                 result_cache_ttl=matcher.RESULT_CACHE_TTL, blocking=True, store_dir=None, shards=0,
+                 threads_per_shard=1, cascade_path=None):
+        # 模型等资源在后台预热，服务先开始监听，预热完成前返回 503
+        self.matcher = matcher.AddressMatcher(model_path, word_dict_path, reference_path, cache_dir,
+                                              index_dir=index_dir, candidate_k=candidate_k, backend=backend,
+                                              result_cache_size=result_cache_size,
+                                              result_cache_ttl=result_cache_ttl, blocking=blocking,
+                                              store_dir=store_dir, shards=shards,
+                                              threads_per_shard=threads_per_shard, cascade_path=cascade_path)
+        self.metrics = Metrics()
+        self.match_batcher = MicroBatcher(self.match_items, self.metrics, max_batch_size, max_wait_ms)
+        self.score_batcher = MicroBatcher(self.score_items, self.metrics, max_batch_size, max_wait_ms)
+
+    def match_items(self, items):
+        # items: [(address, top_k), ...]
+        top_k = max(top_k for _, top_k in items)
+        results = self.matcher.match_batch([address for address, _ in items], top_k=top_k)
+        return [result[:k] for result, (_, k) in zip(results, items)]
+
+    def score_items(self, items):
+        # items: 每个请求的地址对列表，展平后一次前向
+        word_dict = self.matcher.word_dict
+        flat = [pair for pair_list in items for pair in pair_list]
+        pairs = list(zip(word_dict.encode_batch([a for a, _ in flat]).tolist(),
+                         word_dict.encode_batch([b for _, b in flat]).tolist()))
+        scores = matcher.score_pairs(self.matcher.model, pairs, self.matcher.device,
+                                     cascade=self.matcher.cascade).tolist()
+        results = []
+        offset = 0
+        for pair_list in items:
+            results.append(scores[offset:offset + len(pair_list)])
+            offset += len(pair_list)
+        return results
+
+    async def handle_match(self, body):
+        address = str(body.get('address', '')).strip()
+        if not address:
+            return 400, {'error': 'address is required'}
+        top_k = int(body.get('top_k', 1))
+        results = await self.match_batcher.submit((address, max(top_k, 1)))
+        threshold = self.matcher.threshold
+        return 200, {'address': address, 'threshold': threshold,
+                     'matches': [{'address': a, 'score': s, 'matched': s > threshold} for a, s in results]}
+
+    async def handle_score(self, body):
+        if 'pairs' in body:
+            pairs = [(str(a), str(b)) for a, b in body['pairs']]
+        elif 'address1' in body and 'address2' in body:
+            pairs = [(str(body['address1']), str(body['address2']))]
+        else:
+            return 400, {'error': 'expected "pairs" or "address1"/"address2"'}
+        scores = await self.score_batcher.submit(pairs) if pairs else []
+        threshold = self.matcher.threshold
+        return 200, {'scores': scores, 'threshold': threshold, 'matched': [s > threshold for s in scores]}
+
+    async def handle_reload(self, body):
+        # 在匹配线程中重新加载参考库，与正在处理的批次串行
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(self.match_batcher.executor, self.matcher.reload)
+        return 200, {'references': count, 'generation': self.matcher.generation,
+                     'reload_ms': self.matcher.timings['reload'] * 1000}
+
+    async def dispatch(self, method, path, body, query=''):
+        if path == '/metrics':
+            if 'format=prometheus' in query:
+                return 200, instrumentation.to_prometheus()
+            snapshot = self.metrics.snapshot()
+            snapshot['matcher'] = self.matcher.stats()
+            if instrumentation.enabled():
+                snapshot.update(instrumentation.snapshot())
+            return 200, snapshot
+        if path == '/health':
+            return (200 if self.matcher.ready else 503), {
+                'status': self.matcher.state,
+                'timings_ms': {name: t * 1000 for name, t in self.matcher.timings.items()},
+            }
+        routes = {'/match': self.handle_match, '/score': self.handle_score, '/reload': self.handle_reload}
+        if path not in routes:
+            return 404, {'error': 'not found'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        if not self.matcher.ready:
+            return 503, {'error': f'matcher is {self.matcher.state}'}
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return 400, {'error': 'invalid JSON'}
+        if not isinstance(payload, dict):
+            return 400, {'error': 'expected a JSON object'}
+        try:
+            return await routes[path](payload)
+        except (TypeError, ValueError) as e:
+            return 400, {'error': str(e)}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, path, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                start = time.perf_counter()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, {'error': 'request body too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        status, payload = await self.dispatch(method, path.split('?')[0], body,
+                                                              path.partition('?')[2])
+                    except Exception:
+                        logger.exception('request failed')
+                        status, payload = 500, {'error': 'internal error'}
+                    keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                if status >= 400:
+                    self.metrics.errors += 1
+                endpoint = path.split('?')[0]
+                if endpoint not in ('/match', '/score', '/reload', '/metrics', '/health'):
+                    endpoint = 'other'
+                self.metrics.observe(endpoint, time.perf_counter() - start)
+                if isinstance(payload, str):
+                    data, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json'
+                writer.write((f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+                              f'Content-Type: {content_type}; charset=utf-8\r\n'
+                              f'Content-Length: {len(data)}\r\n'
+                              f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode('latin-1')
+                             + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        self.matcher.start()
+        workers = [asyncio.create_task(self.match_batcher.run()), asyncio.create_task(self.score_batcher.run())]
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f'Serving on http://{host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.matcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HTTP address matching service')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--model', default=matcher.MODEL_PATH)
+    parser.add_argument('--word-dict', default=matcher.WORD_DICT_PATH)
+    parser.add_argument('--reference', default=matcher.REFERENCE_PATH)
+    parser.add_argument('--cache-dir', default=matcher.CACHE_DIR)
+    parser.add_argument('--index-dir', default=retrieval.INDEX_DIR)
+    parser.add_argument('--candidate-k', type=int, default=retrieval.TOP_K)
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS)
+    parser.add_argument('--backend', choices=BACKENDS, default='eager')
+    parser.add_argument('--store-dir', help='serve references from a reference_store directory (POST /reload)')
+    parser.add_argument('--no-blocking', action='store_true', help='do not restrict candidates to the district/street')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='score the reference set in this many processes sharing its encodings (CPU only)')
+    parser.add_argument('--threads-per-shard', type=int, default=1,
+                        help='torch threads per shard process; keep shards x threads <= cores')
+    parser.add_argument('--cascade', help='lexical early-exit cascade fitted by cascade.py (e.g. result/cascade.json)')
+    parser.add_argument('--result-cache-size', type=int, default=matcher.RESULT_CACHE_SIZE)
+    parser.add_argument('--result-cache-ttl', type=float, default=matcher.RESULT_CACHE_TTL, help='seconds')
+    parser.add_argument('--instrument', action='store_true',
+                        help='record per-stage timings, exposed on /metrics (?format=prometheus for text)')
+    args = parser.parse_args()
+
+    if args.instrument:
+        instrumentation.enable()
+
+    service = MatchService(args.model, args.word_dict, args.reference, args.cache_dir, args.index_dir,
+                           args.candidate_k, args.max_batch_size, args.max_wait_ms, args.backend,
+                           args.result_cache_size, args.result_cache_ttl, not args.no_blocking, args.store_dir,
+                           args.shards, args.threads_per_shard, args.cascade)
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
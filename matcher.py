@@ -0,0 +1,840 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from contextlib import contextmanager
+from itertools import islice
+import numpy as np
+import torch
+from define_esim import ESIM, BiEncoder, convert_model
+import instrumentation
+from normalize import normalize_address, ExactMatchIndex
+from vocabulary import Vocabulary, file_hash, vocab_hash, MAX_LEN
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = 'result/best_esim_model.pth'
+STUDENT_PATH = 'result/best_student_model.pth'
+WORD_DICT_PATH = 'data/dict/word_dict.json'
+REFERENCE_PATH = 'data/dataset/demo/unique_addresses.txt'
+CACHE_DIR = 'data/cache'
+BATCH_SIZE = 512
+MAX_BATCH_TOKENS = 65536
+DEFAULT_THRESHOLD = 0.5
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_TTL = 3600
+# 填充策略的标识，写入参考缓存的键：未做 masking 的 checkpoint 一律填充到 MAX_LEN，masked checkpoint 只填充到最长序列
+PADDING = f'unmasked-pad{MAX_LEN}'
+
+
+def address_to_index(address_text, word_dict, max_len=MAX_LEN):
+    return word_dict.encode(address_text, max_len)
+
+
+def padded_length(model, longest):
+    # 所有打分路径（参考缓存、/score、/match、级联）共用的填充长度。masked=False 的 checkpoint 中 LSTM 和池化
+    # 都会经过填充位置，分数随填充长度变化，因此统一填充到 MAX_LEN（与训练时一致），同一地址对在各路径上分数相同；
+    # 只有 masked checkpoint（train_esim.py --masked）的分数与填充无关，才按实际最长序列裁剪
+    return max(longest, 1) if getattr(model, 'masked', False) else MAX_LEN
+
+
+def load_word_dict(word_dict_path=WORD_DICT_PATH, cache_dir=CACHE_DIR, register=True):
+    # 编译后的词表缓存在 cache_dir 中，register 时同时注册为 jieba 用户词典
+    return Vocabulary.load(word_dict_path, cache_dir, register)
+
+
+def exported_model_path(model_path, backend):
+    return f'{os.path.splitext(model_path)[0]}.{backend}.pt'
+
+
+def read_threshold(model_path=MODEL_PATH):
+    # 训练时在验证集上选出的判定阈值，旧 checkpoint 没有该字段时沿用 0.5
+    checkpoint = torch.load(model_path, map_location='cpu', mmap=True)
+    if isinstance(checkpoint, dict):
+        return float(checkpoint.get('threshold', DEFAULT_THRESHOLD))
+    return DEFAULT_THRESHOLD
+
+
+def load_model(model_path=MODEL_PATH, device=None, backend='eager'):
+    if backend == 'int8':
+        device = torch.device('cpu')
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    # 优先加载 export_model.py 导出的脚本化模型（须比 checkpoint 新）
+    exported_path = exported_model_path(model_path, backend)
+    if backend != 'eager' and os.path.exists(exported_path) \
+            and os.path.getmtime(exported_path) >= os.path.getmtime(model_path):
+        model = torch.jit.load(exported_path, map_location=device)
+        # 早期导出的脚本模型只保留了 forward，缺少参考缓存需要的 encode/interact 时改为从 checkpoint 重新转换
+        if hasattr(model, 'encode') and hasattr(model, 'interact'):
+            model.eval()
+            return model, device
+        logger.warning(f'{exported_path} has no encode/interact, re-run export_model.py; scripting the checkpoint')
+
+    checkpoint = torch.load(model_path, map_location='cpu')
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        state_dict = checkpoint['model_state_dict']
+        # 前向模式随 checkpoint 保存；旧 checkpoint 没有该字段，使用原始前向
+        masked = checkpoint.get('masked', False)
+    else:
+        state_dict = checkpoint
+        masked = False
+
+    # 模型形状取自 checkpoint，在 meta 设备上构建以跳过随机初始化
+    vocab_size, embedding_dim = state_dict['embedding.weight'].shape
+    hidden_dim = state_dict['lstm.weight_hh_l0'].shape[1]
+    with torch.device('meta'):
+        model = ESIM(
+            vocab_size=vocab_size,
+            embedding_dim=embedding_dim,
+            embedding_matrix=None,
+            max_sequence_length=128,
+            hidden_dim=hidden_dim,
+            masked=masked
+        )
+    model.load_state_dict(state_dict, assign=True)
+    model.embedding.weight.requires_grad = False
+
+    model = convert_model(model.to(device), backend)
+    return model, device
+
+
+def load_student(student_path=STUDENT_PATH, device=None):
+    # distill_student.py 训练的双塔学生模型，形状同样取自 checkpoint
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    state_dict = torch.load(student_path, map_location='cpu')['model_state_dict']
+    vocab_size, embedding_dim = state_dict['embedding.weight'].shape
+    with torch.device('meta'):
+        model = BiEncoder(
+            vocab_size=vocab_size,
+            embedding_dim=embedding_dim,
+            hidden_dim=state_dict['lstm.weight_hh_l0'].shape[1],
+            output_dim=state_dict['projection.weight'].shape[0]
+        )
+    model.load_state_dict(state_dict, assign=True)
+    model.embedding.weight.requires_grad = False
+    return model.to(device).eval(), device
+
+
+def load_reference_addresses(reference_path=REFERENCE_PATH):
+    addresses = []
+    with open(reference_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            address = line.strip()
+            if address:
+                addresses.append(address)
+    return addresses
+
+
+def real_length(indices):
+    # 序列末尾的0均为填充
+    length = len(indices)
+    while length > 0 and indices[length - 1] == 0:
+        length -= 1
+    return length
+
+
+def reference_cache_path(model_path, word_dict_path, reference_path, cache_dir=CACHE_DIR, backend='eager'):
+    # 缓存以模型、词典和参考地址文件的哈希为键，任一变化都会重新构建；int8 后端的编码单独缓存
+    key = hashlib.sha1(''.join([
+        file_hash(model_path),
+        vocab_hash(word_dict_path),
+        file_hash(reference_path),
+        'int8' if backend == 'int8' else '',
+        PADDING,
+    ]).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f'reference_{key[:16]}.pt')
+
+
+def build_reference_cache(model, word_dict, addresses, device, max_len=None, batch_size=256):
+    # masked checkpoint 只填充到参考集中最长的实际序列，其余按 padded_length 填充到 MAX_LEN
+    sequences = word_dict.encode_batch(addresses, max_len=MAX_LEN)
+    if max_len is None:
+        used = (sequences != 0).any(axis=0).nonzero()[0]
+        max_len = padded_length(model, int(used[-1]) + 1 if len(used) else 1)
+    indices = torch.from_numpy(sequences[:, :max_len].copy())
+
+    encoded_chunks = []
+    with torch.no_grad():
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size].to(device)
+            encoded, _ = model.encode(batch)
+            encoded_chunks.append(encoded.cpu())
+
+    return {
+        'addresses': addresses,
+        'indices': indices,
+        'encoded': torch.cat(encoded_chunks),
+        'max_len': max_len,
+    }
+
+
+def load_reference_cache(model, word_dict, device, model_path=MODEL_PATH, word_dict_path=WORD_DICT_PATH,
+                         reference_path=REFERENCE_PATH, cache_dir=CACHE_DIR, backend='eager'):
+    cache_path = reference_cache_path(model_path, word_dict_path, reference_path, cache_dir, backend)
+    if os.path.exists(cache_path):
+        # 内存映射加载：多个工作进程共享页缓存中的同一份编码，而不是各自复制一份
+        cache = torch.load(cache_path, mmap=True)
+    else:
+        addresses = load_reference_addresses(reference_path)
+        cache = build_reference_cache(model, word_dict, addresses, device)
+        os.makedirs(cache_dir, exist_ok=True)
+        torch.save(cache, cache_path + '.tmp')
+        os.replace(cache_path + '.tmp', cache_path)
+
+    cache['encoded'] = cache['encoded'].to(device)
+    cache['mask'] = cache['indices'].to(device) != 0
+    return cache
+
+
+def chunk_size_for(seq_len, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS):
+    # Memory ceiling: a chunk never holds more than max_batch_tokens padded positions
+    return max(1, min(batch_size, max_batch_tokens // max(seq_len, 1)))
+
+
+def score_candidates(model, query_indices, candidate_indices, device, batch_size=BATCH_SIZE,
+                     max_batch_tokens=MAX_BATCH_TOKENS):
+    lengths = [padded_length(model, real_length(seq)) for seq in candidate_indices]
+    # Sort by length so that each chunk is padded only to its own longest sequence (masked checkpoints)
+    order = sorted(range(len(candidate_indices)), key=lambda i: lengths[i])
+    scores = torch.empty(len(candidate_indices))
+
+    with torch.no_grad():
+        query_tensor = pad_batch([query_indices], padded_length(model, real_length(query_indices))).to(device)
+        query_encoded, query_mask = model.encode(query_tensor)
+
+        start = 0
+        while start < len(order):
+            # lengths grow along order, so size the chunk by its last (longest) member
+            size = chunk_size_for(lengths[order[min(start + batch_size, len(order)) - 1]], batch_size,
+                                  max_batch_tokens)
+            chunk = order[start:start + size]
+            chunk_len = lengths[chunk[-1]]
+            batch = torch.zeros(len(chunk), chunk_len, dtype=torch.long)
+            for row, i in enumerate(chunk):
+                seq = candidate_indices[i][:chunk_len]
+                batch[row, :len(seq)] = torch.LongTensor(seq)
+            encoded, mask = model.encode(batch.to(device))
+            n = encoded.size(0)
+            output = model.interact(query_encoded.expand(n, -1, -1), query_mask.expand(n, -1), encoded, mask)
+            scores[torch.LongTensor(chunk)] = output.squeeze(-1).float().cpu()
+            start += size
+
+    return scores
+
+
+def score_cached(model, query, cache, word_dict, device, candidate_ids=None, batch_size=BATCH_SIZE,
+                 max_batch_tokens=MAX_BATCH_TOKENS):
+    query_indices = address_to_index(query, word_dict, max_len=cache['max_len'])
+    size = chunk_size_for(cache['max_len'], batch_size, max_batch_tokens)
+    if candidate_ids is not None:
+        candidate_ids = torch.as_tensor(candidate_ids, dtype=torch.long, device=cache['encoded'].device)
+    num_candidates = len(cache['addresses']) if candidate_ids is None else len(candidate_ids)
+    scores = []
+    with torch.no_grad():
+        # 查询地址只编码一次，参考地址使用缓存的BiLSTM编码
+        query_tensor = torch.LongTensor(query_indices).unsqueeze(0).to(device)
+        query_encoded, query_mask = model.encode(query_tensor)
+        for start in range(0, num_candidates, size):
+            if candidate_ids is None:
+                encoded = cache['encoded'][start:start + size]
+                mask = cache['mask'][start:start + size]
+            else:
+                # Re-rank only the retrieved candidates
+                encoded = cache['encoded'][candidate_ids[start:start + size]]
+                mask = cache['mask'][candidate_ids[start:start + size]]
+            n = encoded.size(0)
+            output = model.interact(query_encoded.expand(n, -1, -1), query_mask.expand(n, -1), encoded, mask)
+            scores.append(output.squeeze(-1))
+    if not scores:
+        return torch.empty(0)
+    return torch.cat(scores).cpu()
+
+
+def live_count(cache):
+    return len(cache['addresses']) - cache.get('dead', 0)
+
+
+def append_rows(buffer, view, rows, headroom):
+    # 在预留容量的缓冲区末尾写入新行，返回 (缓冲区, 更长的视图)；容量不足时多预留 headroom 行后复制一次。
+    # 已有的视图只覆盖原来的行，进行中的查询不受写入影响
+    start = len(view)
+    if buffer is None or start + len(rows) > len(buffer):
+        buffer = view.new_empty((start + len(rows) + headroom,) + tuple(view.shape[1:]))
+        buffer[:start] = view
+    buffer[start:start + len(rows)] = rows
+    return buffer, buffer[:start + len(rows)]
+
+
+class AppendOnlyList(Sequence):
+    # 参考库增量加载时的地址表：各次加载的视图共用一个底层 list，每个视图只看到创建时的前 size 项，
+    # 追加新地址时不复制已有的部分
+    def __init__(self, items, size=None):
+        self.items = items
+        self.size = len(items) if size is None else size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.items[i] for i in range(*position.indices(self.size))]
+        if position < 0:
+            position += self.size
+        if not 0 <= position < self.size:
+            raise IndexError('address index out of range')
+        return self.items[position]
+
+    def __iter__(self):
+        return islice(self.items, self.size)
+
+    def extended(self, values):
+        # 底层 list 末尾可能残留上次失败的更新追加的项，先截掉
+        del self.items[self.size:]
+        self.items.extend(values)
+        return AppendOnlyList(self.items)
+
+
+def pad_batch(sequences, length=None):
+    if length is None:
+        length = max(max((real_length(seq) for seq in sequences), default=1), 1)
+    batch = torch.zeros(len(sequences), length, dtype=torch.long)
+    for row, seq in enumerate(sequences):
+        seq = list(seq)[:length]
+        batch[row, :len(seq)] = torch.LongTensor(seq)
+    return batch
+
+
+def score_pairs(model, pairs, device, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS, cascade=None):
+    # pairs: [(premise_indices, hypothesis_indices), ...]，每块只填充到块内最长序列
+    if cascade is not None and pairs:
+        # 词法级联：确定的地址对直接取级联概率，只有不确定区间内的地址对跑 ESIM
+        probabilities = cascade.probability(pad_batch([a for a, _ in pairs]), pad_batch([b for _, b in pairs]))
+        uncertain = cascade.uncertain(probabilities)
+        positions = uncertain.nonzero().view(-1).tolist()
+        if positions:
+            probabilities[uncertain] = score_pairs(model, [pairs[i] for i in positions], device, batch_size,
+                                                   max_batch_tokens)
+        return probabilities
+    scores = []
+    start = 0
+    with torch.no_grad():
+        while start < len(pairs):
+            size = batch_size
+            while True:
+                chunk = pairs[start:start + size]
+                length = padded_length(model, max(max(real_length(a), real_length(b)) for a, b in chunk))
+                if size == 1 or size * length <= max_batch_tokens:
+                    break
+                size //= 2
+            premise = pad_batch([a for a, _ in chunk], length).to(device)
+            hypothesis = pad_batch([b for _, b in chunk], length).to(device)
+            scores.append(model(premise, hypothesis).squeeze(-1).float().cpu())
+            start += size
+    if not scores:
+        return torch.empty(0)
+    return torch.cat(scores)
+
+
+def retrieve(queries, cache, word_dict, index=None, candidate_k=None, blocks=None):
+    # 每个查询的候选行号；None 表示对全部参考地址打分
+    candidate_lists = []
+    live = cache['live'].numpy() if cache.get('dead') else None
+    live_rows = None
+    with instrumentation.stage('match.retrieve'):
+        for query in queries:
+            # 行政分块：候选只来自查询所在的 区/街道 块
+            rows = blocks.candidates_for(query) if blocks is not None else None
+            if live is not None:
+                # 参考库增量删除的行仍留在缓存和索引中，候选只取存活行
+                if rows is None and live_rows is None:
+                    live_rows = np.flatnonzero(live)
+                rows = live_rows if rows is None else rows[live[rows]]
+            if index is None:
+                candidate_ids = None if rows is None else torch.as_tensor(rows)
+            elif candidate_k is None:
+                candidate_ids = torch.as_tensor(index.search_address(query, word_dict, rows=rows)[0],
+                                                dtype=torch.long)
+            else:
+                candidate_ids = torch.as_tensor(index.search_address(query, word_dict, k=candidate_k, rows=rows)[0],
+                                                dtype=torch.long)
+            candidate_lists.append(candidate_ids)
+    return candidate_lists
+
+
+def score_candidate_lists(model, query_indices, candidate_lists, cache, device, batch_size=BATCH_SIZE,
+                          max_batch_tokens=MAX_BATCH_TOKENS):
+    # 所有 (查询, 候选) 对展平后按块与缓存编码交互，返回与 candidate_lists 顺序一致的分数
+    query_rows = torch.cat([torch.full((len(ids),), row, dtype=torch.long)
+                            for row, ids in enumerate(candidate_lists)])
+    reference_ids = torch.cat(candidate_lists)
+    size = chunk_size_for(cache['max_len'], batch_size, max_batch_tokens)
+    scores = []
+    with torch.no_grad():
+        with instrumentation.stage('match.tensor'):
+            query_tensor = torch.LongTensor(query_indices).to(device)
+        with instrumentation.stage('match.encode'):
+            query_encoded, query_mask = model.encode(query_tensor)
+        for start in range(0, len(reference_ids), size):
+            with instrumentation.stage('match.interact'):
+                rows = query_rows[start:start + size].to(device)
+                ids = reference_ids[start:start + size].to(cache['encoded'].device)
+                output = model.interact(query_encoded[rows], query_mask[rows], cache['encoded'][ids],
+                                        cache['mask'][ids])
+                scores.append(output.squeeze(-1).float().cpu())
+    return torch.cat(scores) if scores else torch.empty(0)
+
+
+def match_batch(model, queries, cache, word_dict, device, index=None, candidate_k=None, top_k=1,
+                batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS, blocks=None, scorer=None, cascade=None):
+    # 多个查询一起编码，所有 (查询, 候选) 对在同一批次中与缓存编码交互；
+    # scorer 为 ShardedScorer 时，候选足够多的批次交给各分片进程并行打分；
+    # cascade 先用词法特征直接判定确定的候选对，只有不确定的候选交给 ESIM
+    candidate_lists = retrieve(queries, cache, word_dict, index, candidate_k, blocks)
+    if not queries:
+        return []
+
+    num_references = len(cache['addresses'])
+    instrumentation.count('queries', len(queries))
+    with instrumentation.stage('match.tokenize'):
+        query_indices = word_dict.encode_batch(queries, max_len=cache['max_len']).tolist()
+
+    exits = None
+    if cascade is not None:
+        with instrumentation.stage('match.cascade'):
+            candidate_lists = [torch.arange(num_references) if ids is None else ids for ids in candidate_lists]
+            candidate_lists, exits = cascade.filter(query_indices, candidate_lists, cache['indices'], top_k)
+    num_pairs = sum(num_references if ids is None else len(ids) for ids in candidate_lists)
+    instrumentation.count('pairs_scored', num_pairs)
+
+    if num_pairs == 0:
+        top = [([], [])] * len(queries)
+    elif scorer is not None and num_pairs >= scorer.min_pairs:
+        with instrumentation.stage('match.shards'):
+            top = scorer.top_k(query_indices, candidate_lists, top_k, num_references)
+    else:
+        candidate_lists = [torch.arange(num_references) if ids is None else ids for ids in candidate_lists]
+        scores = score_candidate_lists(model, query_indices, candidate_lists, cache, device, batch_size,
+                                       max_batch_tokens)
+        top = []
+        offset = 0
+        with instrumentation.stage('match.topk'):
+            for candidate_ids in candidate_lists:
+                query_scores = scores[offset:offset + len(candidate_ids)]
+                offset += len(candidate_ids)
+                top_scores, positions = torch.topk(query_scores, min(top_k, len(query_scores)))
+                top.append((candidate_ids[positions].tolist(), top_scores.tolist()))
+    if exits is not None:
+        # 级联概率与 ESIM 分数不在同一尺度：只有被接受的候选与 ESIM 结果一起排序，
+        # 被拒绝的候选排在最后，仅在其余候选不足 top_k 个时补位
+        merged = []
+        for (rows, scores), ((accepted_rows, accepted_scores), (rejected_rows, rejected_scores)) in zip(top, exits):
+            rows, scores = rows + accepted_rows, torch.tensor(scores + accepted_scores)
+            top_scores, positions = torch.topk(scores, min(top_k, len(scores)))
+            rows = [rows[position] for position in positions.tolist()]
+            fill = top_k - len(rows)
+            merged.append((rows + rejected_rows[:fill], top_scores.tolist() + rejected_scores[:fill]))
+        top = merged
+    return [[(cache['addresses'][row], score) for row, score in zip(rows, scores)] for rows, scores in top]
+
+
+def match(model, query, cache, word_dict, device, index=None, candidate_k=None, top_k=1, blocks=None, scorer=None,
+          cascade=None):
+    # 先由索引召回候选（可选），再用ESIM打分，返回 [(地址, 分数), ...]
+    return match_batch(model, [query], cache, word_dict, device, index, candidate_k, top_k, blocks=blocks,
+                       scorer=scorer, cascade=cascade)[0]
+
+
+class ResultCache:
+    # 最近查询结果的 LRU 缓存，条目超过 ttl 秒后失效；maxsize 为 0 时不缓存
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or entry[0] > time.monotonic()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (expiry, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class AddressMatcher:
+    # 后台预热：依次加载词表、模型、jieba词典、参考缓存和召回索引，state 从 warming 变为 ready
+    def __init__(self, model_path=MODEL_PATH, word_dict_path=WORD_DICT_PATH, reference_path=REFERENCE_PATH,
+                 cache_dir=CACHE_DIR, prefilter='bm25', index_dir=None, candidate_k=None, device=None,
+                 backend='eager', exact_match=True, result_cache_size=RESULT_CACHE_SIZE,
+                 result_cache_ttl=RESULT_CACHE_TTL, blocking=True, store_dir=None, shards=0, threads_per_shard=1,
+                 cascade_path=None, student_path=STUDENT_PATH):
+        # store_dir 指向 reference_store 持久化参考库时，参考数据从库中加载，可在运行中 reload()
+        # shards > 0 时参考编码放入共享内存，由 shards 个进程各自对一个分片打分（仅 CPU）
+        # cascade_path 为 cascade.py fit 的输出时，确定的候选对由词法级联直接判定，不跑 ESIM
+        # prefilter='student' 时用蒸馏学生模型预计算的参考向量召回候选（student_path）
+        self.model_path = model_path
+        self.backend = backend
+        self.word_dict_path = word_dict_path
+        self.reference_path = reference_path
+        self.store_dir = store_dir
+        self.cache_dir = cache_dir
+        self.prefilter = prefilter
+        self.index_dir = index_dir
+        self.candidate_k = candidate_k
+        self.device = device
+        self.model = None
+        self.word_dict = None
+        self.cache = None
+        self.index = None
+        self.exact_match = exact_match
+        self.blocking = blocking
+        self.blocks = None
+        self.shards = shards
+        self.threads_per_shard = threads_per_shard
+        self.scorer = None
+        self.cascade_path = cascade_path
+        self.cascade = None
+        self.student_path = student_path
+        self.exact_index = None
+        self.exact_hits = 0
+        self.result_cache = ResultCache(result_cache_size, result_cache_ttl)
+        self.threshold = DEFAULT_THRESHOLD
+        self.state = 'idle'
+        self.error = None
+        self.timings = {}
+        self.generation = 0
+        self._ready = threading.Event()
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def start(self):
+        self.state = 'warming'
+        threading.Thread(target=self.warm_up, daemon=True).start()
+        return self
+
+    def warm_up(self):
+        self.state = 'warming'
+        start = time.perf_counter()
+        try:
+            self.word_dict = self._phase('vocab', load_word_dict, self.word_dict_path, self.cache_dir, False)
+            self.model, self.device = self._phase('model', load_model, self.model_path, self.device, self.backend)
+            self.threshold = read_threshold(self.model_path)
+            if instrumentation.enabled():
+                instrumentation.instrument_model(self.model)
+            self._phase('jieba', self.word_dict.register_jieba)
+            if self.cascade_path:
+                import cascade
+                self.cascade = self._phase('cascade', cascade.Cascade.load, self.word_dict, self.cascade_path)
+            self.cache, self.exact_index, self.blocks, self.index, self.scorer = self._load_references()
+            self.timings['total'] = time.perf_counter() - start
+            self.state = 'ready'
+            logger.info('Matcher ready: ' + ', '.join(f'{name} {t * 1000:.0f}ms' for name, t in self.timings.items()))
+        except Exception as e:
+            self.error = e
+            self.state = 'failed'
+            logger.exception('Matcher warm-up failed')
+        finally:
+            self._ready.set()
+        return self
+
+    def _phase(self, name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.timings[name] = time.perf_counter() - start
+        return result
+
+    def _load_references(self):
+        # 参考编码缓存及其派生结构：精确匹配表、行政分块、召回索引和分片打分进程
+        if self.store_dir:
+            cache, data = self._phase('reference_cache', self._load_store)
+        else:
+            cache = self._phase('reference_cache', load_reference_cache, self.model, self.word_dict, self.device,
+                                self.model_path, self.word_dict_path, self.reference_path, self.cache_dir,
+                                self.backend)
+            data = None
+        exact_index = blocks = index = scorer = None
+        if self.exact_match:
+            exact_index = self._phase('exact_index', ExactMatchIndex, cache['addresses'],
+                                      data['normalized'] if data else None)
+        if self.blocking:
+            blocks = self._phase('blocks', self._load_blocks, cache, data)
+        if self.prefilter:
+            index = self._phase('index', self._load_index, cache, data)
+        if self.shards:
+            scorer = self._phase('shards', self._start_scorer, cache)
+        return cache, exact_index, blocks, index, scorer
+
+    def _load_store(self):
+        import reference_store
+        store = reference_store.ReferenceStore(self.store_dir)
+        key = reference_store.store_key(self.model_path, self.word_dict_path, self.backend)
+        data = store.load(key)
+        cache = {'addresses': AppendOnlyList(data['addresses']), 'max_len': data['max_len'], 'dead': 0}
+        # 按行存放的数据放进预留了 COMPACT_RATIO 余量的缓冲区，reload() 把新增行原地写在末尾，分片进程也能直接看到
+        headroom = int(reference_store.COMPACT_RATIO * len(data['addresses']))
+        buffers = {}
+        for name, rows in self._row_data(data['indices'], data['encoded']):
+            buffers[name], cache[name] = append_rows(None, rows[:0], rows, headroom)
+        # 参考库的键、位置（代号与日志偏移）和 地址 -> 行号，reload() 据此只应用之后的增删
+        cache['store'] = {'key': key, 'generation': data['generation'], 'log_offset': data['log_offset'],
+                          'rows': {address: row for row, address in enumerate(data['addresses'])}, 'buffers': buffers}
+        return cache, data
+
+    def _row_data(self, indices, encoded):
+        # (名称, 行数据)：词编号、参考编码、padding 掩码和存活标记
+        return (('indices', indices), ('encoded', encoded.to(self.device)), ('mask', indices.to(self.device) != 0),
+                ('live', torch.ones(len(indices), dtype=torch.bool)))
+
+    def _update_store(self):
+        # 把上次加载之后日志中的新增段和删除应用到现有参考数据和索引上：新增行写进缓冲区预留的容量，各索引只更新
+        # 覆盖层或附加索引，删除的行只标记为失效，开销与增删的行数成正比（缓冲区扩容时复制一次）；
+        # 参考库压缩换代后返回 None，由调用方完整加载
+        import reference_store
+        store = reference_store.ReferenceStore(self.store_dir)
+        cache = self.cache
+        state = cache['store']
+        manifest = store.check_key(state['key'])
+        if manifest['generation'] != state['generation']:
+            return None
+        operations, log_offset = store.read_log(manifest, state['log_offset'])
+
+        start = len(cache['addresses'])
+        # 本次变化的 地址 -> 新行号（None 表示删除），以及失效的 行号 -> 地址
+        changes = {}
+        removed = {}
+        parts = []
+        for operation in operations:
+            if operation['op'] == 'add':
+                part = reference_store.read_part(store.segment_dir(manifest, operation['part']))
+                end = start + sum(len(p['addresses']) for p in parts)
+                rows = range(end, end + len(part['addresses']))
+                parts.append(part)
+            elif operation['op'] == 'remove':
+                part, rows = {'addresses': operation['addresses']}, [None] * len(operation['addresses'])
+            else:
+                continue
+            for address, row in zip(part['addresses'], rows):
+                previous = changes[address] if address in changes else state['rows'].get(address)
+                if previous is not None:
+                    removed[previous] = address
+                changes[address] = row
+
+        added = {name: [value for part in parts for value in part[name]]
+                 for name in ('addresses', 'normalized', 'admin', 'terms')}
+        cache = dict(cache, dead=cache['dead'] + len(removed))
+        buffers = dict(state['buffers'])
+        if parts:
+            cache['addresses'] = cache['addresses'].extended(added['addresses'])
+            headroom = int(reference_store.COMPACT_RATIO * start)
+            indices = torch.from_numpy(np.concatenate([part['indices'] for part in parts]))
+            encoded = torch.from_numpy(np.concatenate([part['encoded'] for part in parts]))
+            for name, rows in self._row_data(indices, encoded):
+                buffers[name], cache[name] = append_rows(buffers[name], cache[name], rows.to(cache[name].dtype),
+                                                         headroom)
+
+        exact_index = blocks = None
+        if self.exact_index is not None:
+            exact_index = self.exact_index.updated(added['normalized'], start, {
+                row: normalize_address(address) for row, address in removed.items()})
+        if self.blocks is not None:
+            blocks = self.blocks.extended(added['admin'], start) if parts else self.blocks
+        index = self._extend_index(self.index, added) if self.index is not None and parts else self.index
+        cache['store'] = dict(state, log_offset=log_offset, buffers=buffers)
+        # 新增行写在分片进程已映射的共享缓冲区里时沿用原进程，缓冲区扩容后才重启
+        scorer = self.scorer
+        if scorer is not None and not scorer.shares(buffers['encoded'], buffers['mask']):
+            scorer = self._start_scorer(cache)
+
+        # 以下原地修改与旧数据共用的结构，放在最后：删除的行直接在存活标记缓冲区中置为失效，
+        # 进行中的查询可能提前看不到这些行，但不会读到不完整的数据
+        if removed:
+            buffers['live'][list(removed)] = False
+        alive = state['rows']
+        for address, row in changes.items():
+            if row is None:
+                alive.pop(address, None)
+            else:
+                alive[address] = row
+        return cache, exact_index, blocks, index, scorer
+
+    def _extend_index(self, index, added):
+        if self.prefilter in ('student', 'dense'):
+            return index.extended(added['addresses'], self.word_dict)
+        return index.extended(added['terms'])
+
+    def _load_index(self, cache, data=None):
+        # 索引模块按需导入
+        if self.prefilter == 'student':
+            import dense_index
+            student, _ = load_student(self.student_path, torch.device('cpu'))
+            if data is not None:
+                return dense_index.StudentIndex.build(cache['addresses'], self.word_dict, student)
+            kwargs = {'student_dir': self.index_dir} if self.index_dir else {}
+            return dense_index.load_or_build_student_index(self.word_dict, cache['addresses'], student,
+                                                           self.student_path, self.word_dict_path,
+                                                           self.reference_path, **kwargs)
+        if self.prefilter == 'dense':
+            import dense_index
+            if data is not None:
+                # 参考库中没有保存稠密向量，按当前参考地址重新构建
+                return dense_index.DenseIndex.build(cache['addresses'], self.word_dict,
+                                                    dense_index.load_embedding_matrix())
+            kwargs = {'dense_dir': self.index_dir} if self.index_dir else {}
+            return dense_index.load_or_build_dense_index(self.word_dict, cache['addresses'],
+                                                         self.word_dict_path, self.reference_path, **kwargs)
+        import retrieval
+        if data is not None:
+            # 参考库保存了每条地址的词项，直接构造倒排表，无需重新分词
+            return retrieval.InvertedIndex.from_terms(data['terms'], self.word_dict.size,
+                                                      data['use_ngrams'])
+        kwargs = {'index_dir': self.index_dir} if self.index_dir else {}
+        return retrieval.load_or_build_index(self.word_dict, cache['addresses'], self.word_dict_path,
+                                             self.reference_path, **kwargs)
+
+    def _load_blocks(self, cache, data=None):
+        import blocking
+        if data is not None:
+            return blocking.BlockIndex(data['admin'])
+        return blocking.load_block_index(cache['addresses'], self.reference_path, self.cache_dir,
+                                         word_dict_path=self.word_dict_path)
+
+    def _start_scorer(self, cache):
+        if cache['encoded'].device.type != 'cpu':
+            logger.warning('Sharded scoring runs on CPU only, scoring on %s in-process', cache['encoded'].device)
+            return None
+        import sharded_scoring
+        if 'store' in cache:
+            # 分片进程映射整个缓冲区，之后追加的行无需重启即可打分
+            buffers = cache['store']['buffers']
+            cache = dict(cache, encoded=buffers['encoded'], mask=buffers['mask'])
+        return sharded_scoring.ShardedScorer(self.model_path, cache, self.shards, self.threads_per_shard,
+                                             self.backend)
+
+    def reload(self):
+        # 在后台构建新的参考数据后一次性替换，进行中的查询继续使用旧数据；
+        # 参考库未换代时只应用日志中的增量，压缩后才完整加载
+        with self._reload_lock:
+            start = time.perf_counter()
+            references = None
+            if self.store_dir and self.cache is not None and 'store' in self.cache:
+                references = self._update_store()
+            if references is None:
+                references = self._load_references()
+            with self._swap_lock:
+                previous = self.scorer
+                self.cache, self.exact_index, self.blocks, self.index, self.scorer = references
+                self.generation += 1
+            self.result_cache.clear()
+            if previous is not None and previous is not self.scorer:
+                previous.close()
+            self.timings['reload'] = time.perf_counter() - start
+        logger.info(f"Reloaded {live_count(self.cache)} reference addresses in "
+                    f"{self.timings['reload'] * 1000:.0f}ms")
+        return live_count(self.cache)
+
+    @contextmanager
+    def _references(self):
+        # 取当前一代参考数据的快照；分片进程在快照使用期间不会被 reload() 关闭
+        with self._swap_lock:
+            references = self.cache, self.exact_index, self.blocks, self.index, self.scorer, self.generation
+            if self.scorer is not None:
+                self.scorer.acquire()
+        try:
+            yield references
+        finally:
+            if references[4] is not None:
+                references[4].release()
+
+    def close(self):
+        if self.scorer is not None:
+            self.scorer.close()
+            self.scorer = None
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def wait_ready(self, timeout=None):
+        self._ready.wait(timeout)
+        if self.state == 'failed':
+            raise RuntimeError('matcher warm-up failed') from self.error
+        return self.ready
+
+    def match_batch(self, queries, top_k=1):
+        # 依次尝试：结果缓存 -> 归一化精确匹配（分数 1.0）-> ESIM；只有未命中的查询才跑模型
+        with instrumentation.stage('match.total'), self._references() as references:
+            cache, exact_index, blocks, index, scorer, generation = references
+            results = [None] * len(queries)
+            keys = [(normalize_address(query), top_k, generation) for query in queries]
+            pending = {}
+            for i, key in enumerate(keys):
+                cached = self.result_cache.get(key)
+                if cached is not None:
+                    results[i] = cached
+                    instrumentation.count('result_cache_hits')
+                    continue
+                row = exact_index.get(key[0]) if exact_index is not None else None
+                if row is not None and top_k == 1:
+                    self.exact_hits += 1
+                    instrumentation.count('exact_hits')
+                    results[i] = [(cache['addresses'][row], 1.0)]
+                    self.result_cache.put(key, results[i])
+                    continue
+                pending.setdefault(key, []).append(i)
+
+            if pending:
+                misses = [queries[positions[0]] for positions in pending.values()]
+                scored = match_batch(self.model, misses, cache, self.word_dict, self.device, index=index,
+                                     candidate_k=self.candidate_k, top_k=top_k, blocks=blocks, scorer=scorer,
+                                     cascade=self.cascade)
+                for (key, positions), result in zip(pending.items(), scored):
+                    row = exact_index.get(key[0]) if exact_index is not None else None
+                    if row is not None:
+                        # top_k > 1 时精确匹配排在首位，其余为 ESIM 结果
+                        exact = cache['addresses'][row]
+                        result = [(exact, 1.0)] + [item for item in result if item[0] != exact][:top_k - 1]
+                    self.result_cache.put(key, result)
+                    for i in positions:
+                        results[i] = result
+            return results
+
+    def stats(self):
+        stats = {'references': live_count(self.cache) if self.cache else 0, 'generation': self.generation,
+                 'exact_hits': self.exact_hits, 'result_cache': self.result_cache.stats()}
+        if self.cascade is not None:
+            stats['cascade'] = self.cascade.stats()
+        return stats
+
+    def match(self, query, top_k=1):
+        return self.match_batch([query], top_k)[0]
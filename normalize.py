@@ -0,0 +1,75 @@
+import re
+import unicodedata
+
+# 查询和参考地址中常见的冗余前缀，按顺序反复剥离
+PREFIXES = ('中国', '广东省', '广东', '深圳市')
+DASHES = re.compile(r'[‐‑‒–—―−~～]')
+
+
+def normalize_address(address_text):
+    # NFKC 把全角数字/字母/符号转成半角；去掉空白和标点（连字符保留，区分 3-1号 与 31号）；字母统一大写
+    text = unicodedata.normalize('NFKC', address_text)
+    text = DASHES.sub('-', text)
+    text = ''.join(ch for ch in text
+                   if ch == '-' or not (ch.isspace() or unicodedata.category(ch)[0] in 'PSZC')).upper()
+    stripped = True
+    while stripped:
+        stripped = False
+        for prefix in PREFIXES:
+            if text.startswith(prefix) and len(text) > len(prefix):
+                text = text[len(prefix):]
+                stripped = True
+    return text
+
+
+class ExactMatchIndex:
+    # 归一化地址 -> 参考地址行号的哈希表，完全一致的查询 O(1) 命中
+    def __init__(self, addresses, keys=None):
+        # keys 为预先归一化好的地址（参考库保存的结果），省去重复归一化
+        self.rows = {}
+        # 归一化后重复的其余行，首行被删除时依次顶替
+        self.shadowed = {}
+        for row, key in enumerate(keys if keys is not None else map(normalize_address, addresses)):
+            if self.rows.setdefault(key, row) != row:
+                self.shadowed.setdefault(key, []).append(row)
+
+        # 增量更新只写覆盖层（键 -> 行号，None 表示已删除），基础表与原索引共用，压缩后重新构建时才并入
+        self.overlay = {}
+        self.overlay_shadowed = {}
+
+    def get(self, key):
+        return self.overlay[key] if key in self.overlay else self.rows.get(key)
+
+    def updated(self, keys, start, removed):
+        # 返回新索引：追加从 start 开始、归一化键为 keys 的行，再删除 removed（行号 -> 归一化键）；原索引不变。
+        # 只复制覆盖层，开销与压缩以来改动的键数成正比
+        index = ExactMatchIndex([])
+        index.rows, index.shadowed = self.rows, self.shadowed
+        index.overlay = dict(self.overlay)
+        index.overlay_shadowed = {key: list(rows) for key, rows in self.overlay_shadowed.items()}
+
+        def entry(key):
+            if key not in index.overlay:
+                index.overlay[key] = self.rows.get(key)
+                index.overlay_shadowed[key] = list(self.shadowed.get(key, []))
+            return index.overlay_shadowed[key]
+
+        for row, key in enumerate(keys, start):
+            shadowed = entry(key)
+            if index.overlay[key] is None:
+                index.overlay[key] = row
+            else:
+                shadowed.append(row)
+        for row, key in removed.items():
+            shadowed = entry(key)
+            if index.overlay[key] == row:
+                index.overlay[key] = shadowed.pop(0) if shadowed else None
+            elif row in shadowed:
+                shadowed.remove(row)
+        return index
+
+    def lookup(self, address_text):
+        return self.get(normalize_address(address_text))
+
+    def __len__(self):
+        return len(self.rows) + sum((row is not None) - (key in self.rows) for key, row in self.overlay.items())
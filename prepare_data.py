@@ -1,32 +1,17 @@
-import jieba
-import json
+from binary_dataset import write_split
+from tokenizer_pool import TokenCache, Throughput, tokenize_stream
+from vocabulary import Vocabulary, WORD_DICT_PATH
 
 
-def load_dict(filename):
-    with open(filename, 'r', encoding='utf-8') as f:
-        dictionary = json.load(f)
-    return dictionary
+def index_words(words, vocab):
+    # 未登录词编号为 0，与线上 address_to_index 一致；词表本身不被修改
+    return vocab.ids(word for word in words if word != '')
 
-def tokenize_and_index(text, dictionary):
-    words = jieba.lcut(text)
-    indexed_words = []
-    for word in words:
-        if word != '':
-            if word not in dictionary:
-                dictionary[word] = len(indexed_words) + 1
-            indexed_words.append(dictionary[word])
-    return indexed_words
+def tokenize_and_index(text, vocab):
+    return index_words(vocab.tokenize(text), vocab)
 
-dictionary = load_dict('data/dict/word_dict.json')
-
-# 读取数据
-input_dir = ['train', 'test', 'valid']
-
-for input in input_dir:
+def prepare_split(input, vocab, cache, workers=None):
     input_file = 'data/dataset/' + input + '/address.txt'
-    output_file1 = 'data/dataset/' + input + '/addr1_tokenized.txt'
-    output_file2 = 'data/dataset/' + input + '/addr2_tokenized.txt'
-    output_file3 = 'data/dataset/' + input + '/labels.txt'
     with open(input_file, 'r', encoding='utf-8') as f:
         addr1 = []
         addr2 = []
@@ -40,13 +25,43 @@ for input in input_dir:
                 addr2.append(columns[1])
                 labels.append(columns[2])
 
+    # 两侧地址交错送入分词进程池，重复出现的地址只分词一次
+    stats = Throughput('prepare_data/' + input)
+    tokens = tokenize_stream((text for pair in zip(addr1, addr2) for text in pair), workers, cache, stats=stats,
+                             word_dict_path=vocab.path)
+
     with open ('data/dataset/' + input + '/addr1_tokenized.txt', 'w', encoding='utf-8') as f1, \
          open('data/dataset/' + input + '/addr2_tokenized.txt', 'w', encoding='utf-8') as f2, \
          open('data/dataset/' + input + '/labels.txt', 'w', encoding='utf-8') as f3:
+        addr1_sequences = []
+        addr2_sequences = []
         for i in range(len(addr1)):
-            addr1_tokens = tokenize_and_index(addr1[i], dictionary)
-            addr2_tokens = tokenize_and_index(addr2[i], dictionary)
+            addr1_tokens = index_words(next(tokens), vocab)
+            addr2_tokens = index_words(next(tokens), vocab)
+            addr1_sequences.append(addr1_tokens)
+            addr2_sequences.append(addr2_tokens)
 
             f1.write(' '.join(map(str, addr1_tokens)) + '\n')
             f2.write(' '.join(map(str, addr2_tokens)) + '\n')
-            f3.write(labels[i] + '\n')
\ No newline at end of file
+            f3.write(labels[i] + '\n')
+    tokens.close()
+
+    # 同时写出可内存映射的二进制格式，供 TextMatchDataset.from_binary 使用
+    write_split('data/dataset/' + input, addr1_sequences, addr2_sequences, labels)
+
+
+def main():
+    # 词表注册为 jieba 用户词典后切分结果不同，分词缓存按词表分命名空间
+    vocab = Vocabulary.load(WORD_DICT_PATH)
+    cache = TokenCache(namespace=vocab.namespace)
+
+    # 读取数据
+    input_dir = ['train', 'test', 'valid']
+
+    for input in input_dir:
+        prepare_split(input, vocab, cache)
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import numpy as np
+import torch
+from binary_dataset import flatten
+from blocking import admin_path, parse_admin
+from matcher import build_reference_cache, file_hash, load_model, load_reference_addresses, load_word_dict, \
+    real_length, vocab_hash, MODEL_PATH, PADDING, WORD_DICT_PATH, REFERENCE_PATH
+from normalize import normalize_address
+from retrieval import address_to_terms
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STORE_DIR = 'data/reference_store'
+# 日志中的增删条数超过基线行数的该比例时自动压缩
+COMPACT_RATIO = 0.2
+
+
+def store_key(model_path=MODEL_PATH, word_dict_path=WORD_DICT_PATH, backend='eager'):
+    # 缓存的编码只对同一模型、词典（int8 后端单独）有效
+    return hashlib.sha1(''.join([
+        file_hash(model_path),
+        vocab_hash(word_dict_path),
+        'int8' if backend == 'int8' else '',
+        PADDING,
+    ]).encode('utf-8')).hexdigest()
+
+
+def encode_rows(model, word_dict, addresses, device, max_len=None, use_ngrams=True):
+    # 一次计算参考地址的全部派生数据：token id、BiLSTM 编码、BM25 词项、行政前缀和归一化键
+    cache = build_reference_cache(model, word_dict, addresses, device, max_len=max_len) if addresses else None
+    vocab_size = word_dict.size
+    return {
+        'addresses': list(addresses),
+        'indices': cache['indices'].numpy() if cache else None,
+        'encoded': cache['encoded'].float().numpy() if cache else None,
+        'max_len': cache['max_len'] if cache else max_len,
+        'terms': [address_to_terms(address, word_dict, vocab_size, use_ngrams) for address in addresses],
+        'admin': [admin_path(parse_admin(address)) for address in addresses],
+        'normalized': [normalize_address(address) for address in addresses],
+    }
+
+
+def live_name(manifest):
+    # 早期版本的 manifest 没有记录旁路文件名
+    return manifest['live'] if 'live' in manifest else f"live-{manifest['generation']:06d}.sqlite"
+
+
+def write_part(part_dir, rows):
+    # 基线和增量段使用同一目录格式；先写临时目录再改名，读者不会看到写了一半的段
+    tmp_dir = part_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in ('addresses', 'normalized'):
+        with open(os.path.join(tmp_dir, f'{name}.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(value + '\n' for value in rows[name])
+    with open(os.path.join(tmp_dir, 'admin.json'), 'w', encoding='utf-8') as f:
+        json.dump(rows['admin'], f, ensure_ascii=False)
+    terms_tokens, terms_offsets = flatten(rows['terms'])
+    np.save(os.path.join(tmp_dir, 'terms_tokens.npy'), terms_tokens)
+    np.save(os.path.join(tmp_dir, 'terms_offsets.npy'), terms_offsets)
+    np.save(os.path.join(tmp_dir, 'indices.npy'), rows['indices'])
+    np.save(os.path.join(tmp_dir, 'encoded.npy'), rows['encoded'])
+    os.replace(tmp_dir, part_dir)
+
+
+def read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def read_part(part_dir):
+    # 编码矩阵以内存映射方式打开，只有存活的行会被复制
+    terms_offsets = np.load(os.path.join(part_dir, 'terms_offsets.npy'))
+    with open(os.path.join(part_dir, 'admin.json'), 'r', encoding='utf-8') as f:
+        admin = [tuple(path) for path in json.load(f)]
+    return {
+        'addresses': read_lines(os.path.join(part_dir, 'addresses.txt')),
+        'normalized': read_lines(os.path.join(part_dir, 'normalized.txt')),
+        'admin': admin,
+        'terms': np.split(np.load(os.path.join(part_dir, 'terms_tokens.npy')), terms_offsets[1:-1]),
+        'indices': np.load(os.path.join(part_dir, 'indices.npy'), mmap_mode='r'),
+        'encoded': np.load(os.path.join(part_dir, 'encoded.npy'), mmap_mode='r'),
+    }
+
+
+class LiveMap:
+    # 存活地址 -> (段号, 行号) 的持久化映射（sqlite 旁路文件，每代一个）；log_offset 为已应用到的日志字节偏移，
+    # 增删只改动涉及的行，不需要重放基线和日志
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS live '
+                          '(address TEXT PRIMARY KEY, part INTEGER NOT NULL, row INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS parts (id INTEGER PRIMARY KEY, name TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS state (log_offset INTEGER NOT NULL, pending INTEGER NOT NULL)')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # 立即取得写锁，多个进程同时补放日志时不会重复应用同一段
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def reset(self, base_name, addresses):
+        with self.transaction():
+            self.conn.execute('DELETE FROM live')
+            self.conn.execute('DELETE FROM parts')
+            self.conn.execute('DELETE FROM state')
+            self.conn.execute('INSERT INTO parts VALUES (0, ?)', (base_name,))
+            self.conn.executemany('INSERT OR REPLACE INTO live VALUES (?, 0, ?)',
+                                  ((address, row) for row, address in enumerate(addresses)))
+            self.conn.execute('INSERT INTO state VALUES (0, 0)')
+
+    def state(self):
+        return self.conn.execute('SELECT log_offset, pending FROM state').fetchone()
+
+    def set_state(self, log_offset, pending):
+        self.conn.execute('UPDATE state SET log_offset = ?, pending = ?', (log_offset, pending))
+
+    def add_part(self, name, addresses):
+        part = self.conn.execute('INSERT INTO parts (name) VALUES (?)', (name,)).lastrowid
+        self.conn.executemany('INSERT OR REPLACE INTO live VALUES (?, ?, ?)',
+                              ((address, part, row) for row, address in enumerate(addresses)))
+
+    def remove(self, addresses):
+        self.conn.executemany('DELETE FROM live WHERE address = ?', ((address,) for address in addresses))
+
+    def alive(self, addresses):
+        found = set()
+        items = list(addresses)
+        for start in range(0, len(items), 500):
+            batch = items[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            found.update(address for address, in self.conn.execute(
+                f'SELECT address FROM live WHERE address IN ({placeholders})', batch))
+        return found
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM live').fetchone()[0]
+
+    def addresses(self):
+        return [address for address, in self.conn.execute('SELECT address FROM live ORDER BY part, row')]
+
+    def snapshot(self):
+        # 在同一个读事务中取日志偏移、段名和存活行，三者彼此一致
+        self.conn.execute('BEGIN')
+        try:
+            log_offset = self.state()[0]
+            parts = dict(self.conn.execute('SELECT id, name FROM parts'))
+            rows = self.conn.execute('SELECT part, row FROM live ORDER BY part, row').fetchall()
+        finally:
+            self.conn.execute('COMMIT')
+        return log_offset, parts, rows
+
+    def close(self):
+        self.conn.close()
+
+
+class ReferenceStore:
+    # 持久化参考库：一个基线段 + 仅追加的操作日志（add 指向增量段，remove 列出地址），定期压缩为新基线
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+
+    def path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def exists(self):
+        return os.path.exists(self.path('manifest.json'))
+
+    def manifest(self):
+        with open(self.path('manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        with open(self.path('manifest.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.path('manifest.json.tmp'), self.path('manifest.json'))
+
+    def check_key(self, key):
+        manifest = self.manifest()
+        if manifest['key'] != key:
+            raise ValueError(f'reference store {self.store_dir} was encoded with a different model or word dict; '
+                             f'run "python reference_store.py rebuild"')
+        return manifest
+
+    def create(self, model, word_dict, addresses, device, key, use_ngrams=True):
+        os.makedirs(self.store_dir, exist_ok=True)
+        rows = encode_rows(model, word_dict, list(dict.fromkeys(addresses)), device, use_ngrams=use_ngrams)
+        generation = self.manifest()['generation'] + 1 if self.exists() else 0
+        self._write_generation(generation, rows, key, rows['max_len'], use_ngrams)
+
+    def _write_generation(self, generation, rows, key, max_len, use_ngrams):
+        names = {
+            'base': f'base-{generation:06d}',
+            'log': f'log-{generation:06d}.jsonl',
+            'segments': f'segments-{generation:06d}',
+            'live': f'live-{generation:06d}.sqlite',
+        }
+        write_part(self.path(names['base']), rows)
+        open(self.path(names['log']), 'w').close()
+        os.makedirs(self.path(names['segments']), exist_ok=True)
+        self._write_live(names, rows['addresses'])
+        old = self.manifest() if self.exists() else None
+        # 替换 manifest 是唯一的提交点，之后才删除旧一代的文件
+        self.write_manifest(dict(names, generation=generation, key=key, max_len=int(max_len),
+                                 use_ngrams=use_ngrams, base_rows=len(rows['addresses'])))
+        if old is not None:
+            for name in ('base', 'segments'):
+                shutil.rmtree(self.path(old[name]), ignore_errors=True)
+            for path in (self.path(old['log']), self.path(live_name(old))):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _write_live(self, manifest, addresses):
+        path = self.path(live_name(manifest))
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+        live_map = LiveMap(path + '.tmp')
+        live_map.reset(manifest['base'], addresses)
+        live_map.close()
+        os.replace(path + '.tmp', path)
+
+    def read_log(self, manifest, offset=0):
+        # 从字节偏移 offset 起读取日志，返回 (操作列表, 读到的偏移)；末尾没有换行的行可能仍在写入，留到下次读取
+        operations = []
+        with open(self.path(manifest['log']), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                # 中断时写了一半的行视为未提交
+                try:
+                    operations.append(json.loads(line))
+                except ValueError:
+                    continue
+        return operations, offset
+
+    def append_log(self, manifest, operation):
+        with open(self.path(manifest['log']), 'a+b') as f:
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write((json.dumps(operation, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def segment_dir(self, manifest, name):
+        return os.path.join(self.path(manifest['segments']), name)
+
+    def live(self, manifest):
+        # 打开本代的存活映射并补放日志中尚未应用的操作（其他进程写入或中断前未应用的部分）；
+        # 旧版本的库没有旁路文件时由基线和完整日志建立一次
+        path = self.path(live_name(manifest))
+        if not os.path.exists(path):
+            self._write_live(manifest, read_lines(os.path.join(self.path(manifest['base']), 'addresses.txt')))
+        live_map = LiveMap(path)
+        with live_map.transaction():
+            log_offset, pending = live_map.state()
+            operations, log_offset = self.read_log(manifest, log_offset)
+            for operation in operations:
+                if operation['op'] == 'add':
+                    live_map.add_part(operation['part'], read_lines(
+                        os.path.join(self.segment_dir(manifest, operation['part']), 'addresses.txt')))
+                elif operation['op'] == 'remove':
+                    live_map.remove(operation['addresses'])
+                pending += operation.get('count', len(operation.get('addresses', [])))
+            live_map.set_state(log_offset, pending)
+        return live_map
+
+    def addresses(self):
+        live_map = self.live(self.manifest())
+        try:
+            return live_map.addresses()
+        finally:
+            live_map.close()
+
+    def count(self):
+        live_map = self.live(self.manifest())
+        try:
+            return live_map.count()
+        finally:
+            live_map.close()
+
+    def load(self, key=None):
+        # 物化当前存活的参考数据：只复制存活行，不需要分词或模型前向；
+        # log_offset 为对应的日志位置，之后的增删可由调用方增量应用
+        manifest = self.check_key(key) if key is not None else self.manifest()
+        live_map = self.live(manifest)
+        try:
+            log_offset, names, alive = live_map.snapshot()
+        finally:
+            live_map.close()
+        keep = {}
+        for part_id, row in alive:
+            keep.setdefault(part_id, []).append(row)
+
+        data = {name: [] for name in ('addresses', 'normalized', 'admin', 'terms', 'indices', 'encoded')}
+        for part_id, rows in sorted(keep.items()):
+            part_dir = self.path(manifest['base']) if part_id == 0 else self.segment_dir(manifest, names[part_id])
+            part = read_part(part_dir)
+            for name in ('addresses', 'normalized', 'admin', 'terms'):
+                data[name].extend(part[name][row] for row in rows)
+            rows = np.asarray(rows, dtype=np.int64)
+            data['indices'].append(np.asarray(part['indices'][rows]))
+            data['encoded'].append(np.asarray(part['encoded'][rows]))
+        max_len = manifest['max_len']
+        data['indices'] = torch.from_numpy(np.concatenate(data['indices'])) if data['indices'] \
+            else torch.zeros(0, max_len, dtype=torch.long)
+        data['encoded'] = torch.from_numpy(np.concatenate(data['encoded'])) if data['encoded'] else None
+        data['max_len'] = max_len
+        data['use_ngrams'] = manifest['use_ngrams']
+        data['generation'] = manifest['generation']
+        data['log_offset'] = log_offset
+        return data
+
+    def pending_rows(self, manifest):
+        live_map = self.live(manifest)
+        try:
+            return live_map.state()[1]
+        finally:
+            live_map.close()
+
+    def add(self, model, word_dict, addresses, device):
+        # 只对新增地址分词和编码，耗时与增量成正比
+        manifest = self.manifest()
+        live_map = self.live(manifest)
+        try:
+            candidates = [address for address in dict.fromkeys(addresses) if address]
+            alive = live_map.alive(candidates)
+            new = [address for address in candidates if address not in alive]
+            if not new:
+                return 0
+            rows = encode_rows(model, word_dict, new, device, manifest['max_len'], manifest['use_ngrams'])
+            truncated = sum(1 for seq in rows['indices'] if real_length(seq) >= manifest['max_len'])
+            if truncated:
+                logger.warning(f'{truncated} added addresses reach the stored max_len {manifest["max_len"]} and may '
+                               f'be truncated; run "python reference_store.py rebuild" to re-encode with a longer '
+                               f'max_len')
+            name = f'{live_map.state()[0]:010d}-{os.getpid()}'
+            write_part(self.segment_dir(manifest, name), rows)
+            self.append_log(manifest, {'op': 'add', 'part': name, 'count': len(new)})
+        finally:
+            live_map.close()
+        # 日志写入后即已提交，映射由补放日志更新，与其他进程的写入走同一条路径
+        self.live(manifest).close()
+        return len(new)
+
+    def remove(self, addresses):
+        manifest = self.manifest()
+        live_map = self.live(manifest)
+        try:
+            alive = live_map.alive(addresses)
+        finally:
+            live_map.close()
+        removed = [address for address in dict.fromkeys(addresses) if address in alive]
+        if removed:
+            self.append_log(manifest, {'op': 'remove', 'addresses': removed})
+            self.live(manifest).close()
+        return len(removed)
+
+    def needs_compaction(self, ratio=COMPACT_RATIO):
+        manifest = self.manifest()
+        return self.pending_rows(manifest) > ratio * max(manifest['base_rows'], 1)
+
+    def compact(self, model=None, word_dict=None, device=None, key=None):
+        # 合并基线与日志为新的基线；传入模型时全部重新编码（模型更新或需要更长的 max_len）
+        manifest = self.manifest()
+        if model is not None:
+            addresses = self.addresses()
+            rows = encode_rows(model, word_dict, addresses, device, use_ngrams=manifest['use_ngrams'])
+            self._write_generation(manifest['generation'] + 1, rows, key, rows['max_len'], manifest['use_ngrams'])
+            return len(addresses)
+        data = self.load()
+        rows = {name: data[name] for name in ('addresses', 'normalized', 'admin', 'terms')}
+        rows['indices'] = data['indices'].numpy()
+        rows['encoded'] = data['encoded'].numpy() if data['encoded'] is not None \
+            else np.zeros((0, manifest['max_len'], 0), dtype=np.float32)
+        self._write_generation(manifest['generation'] + 1, rows, manifest['key'], manifest['max_len'],
+                               manifest['use_ngrams'])
+        return len(rows['addresses'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent, incrementally updated reference address store')
+    parser.add_argument('command', choices=['init', 'add', 'remove', 'compact', 'rebuild', 'export', 'stats'])
+    parser.add_argument('file', nargs='?', help='addresses, one per line (init/add/remove) or output (export)')
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--word-dict', default=WORD_DICT_PATH)
+    parser.add_argument('--backend', choices=['eager', 'int8'], default='eager',
+                        help='int8 encodings differ from fp32 and need their own store')
+    parser.add_argument('--no-auto-compact', action='store_true')
+    args = parser.parse_args()
+
+    store = ReferenceStore(args.store_dir)
+    device = torch.device('cpu') if args.backend == 'int8' else None
+
+    def model_and_dict():
+        model, model_device = load_model(args.model, device, args.backend)
+        return model, load_word_dict(args.word_dict), model_device, store_key(args.model, args.word_dict,
+                                                                              args.backend)
+
+    if args.command == 'init':
+        model, word_dict, model_device, key = model_and_dict()
+        store.create(model, word_dict, load_reference_addresses(args.file or REFERENCE_PATH), model_device, key)
+    elif args.command == 'add':
+        model, word_dict, model_device, key = model_and_dict()
+        store.check_key(key)
+        logger.info(f'Added {store.add(model, word_dict, load_reference_addresses(args.file), model_device)} '
+                    f'addresses')
+    elif args.command == 'remove':
+        logger.info(f'Removed {store.remove(load_reference_addresses(args.file))} addresses')
+    elif args.command == 'compact':
+        store.compact()
+    elif args.command == 'rebuild':
+        model, word_dict, model_device, key = model_and_dict()
+        store.compact(model, word_dict, model_device, key)
+    elif args.command == 'export':
+        # 导出当前参考地址（排序），替代 generate_demo_dataset 的整体重建
+        with open(args.file or REFERENCE_PATH, 'w', encoding='utf-8') as f:
+            f.writelines(address + '\n' for address in sorted(store.addresses()))
+
+    if args.command in ('add', 'remove') and not args.no_auto_compact and store.needs_compaction():
+        logger.info('Log exceeds the compaction threshold, compacting')
+        store.compact()
+    if store.exists():
+        manifest = store.manifest()
+        logger.info(f"Generation {manifest['generation']}: {store.count()} addresses, "
+                    f"{manifest['base_rows']} in base, {store.pending_rows(manifest)} pending in log")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import argparse
+import copy
+import os
+import time
+import zlib
+import numpy as np
+from matcher import load_word_dict, load_reference_addresses, file_hash, vocab_hash, WORD_DICT_PATH, REFERENCE_PATH
+
+INDEX_DIR = 'data/index'
+TOP_K = 200
+NGRAM_BUCKETS = 1 << 18
+
+
+class InvertedIndex:
+    def __init__(self, term_offsets, postings_docs, postings_tf, doc_len, vocab_size, use_ngrams=True,
+                 k1=1.2, b=0.75, key=''):
+        self.key = key
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.vocab_size = vocab_size
+        self.use_ngrams = use_ngrams
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(doc_len)
+        self.avg_doc_len = float(doc_len.mean()) if self.num_docs else 0.0
+        df = np.diff(term_offsets).astype(np.float32)
+        self.idf = np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # 增量追加的文档单独建一个小索引，查询时与基础索引一起打分，压缩后重新构建时才并入
+        self.delta = None
+        self.delta_terms = []
+
+    @classmethod
+    def build(cls, addresses, word_dict, use_ngrams=True):
+        vocab_size = word_dict.size
+        term_lists = [address_to_terms(address, word_dict, vocab_size, use_ngrams) for address in addresses]
+        return cls.from_terms(term_lists, vocab_size, use_ngrams)
+
+    @classmethod
+    def from_terms(cls, term_lists, vocab_size, use_ngrams=True):
+        # term_lists: 每个文档的词项 id 列表（可由参考库预先保存，无需重新分词）
+        num_docs = len(term_lists)
+        num_terms = vocab_size + (NGRAM_BUCKETS if use_ngrams else 0)
+        doc_len = np.asarray([len(terms) for terms in term_lists], dtype=np.float32)
+        term_ids = np.concatenate([np.asarray(terms, dtype=np.int64) for terms in term_lists]
+                                  + [np.zeros(0, dtype=np.int64)])
+        doc_ids = np.repeat(np.arange(num_docs, dtype=np.int64), doc_len.astype(np.int64))
+        # 按 (term, doc) 合并重复项得到词频，再按 term 排序构造 CSR 形式的倒排表
+        keys, tf = np.unique(term_ids * num_docs + doc_ids, return_counts=True)
+        terms = keys // max(num_docs, 1)
+        term_offsets = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=num_terms), out=term_offsets[1:])
+        postings_docs = (keys % max(num_docs, 1)).astype(np.int32)
+        return cls(term_offsets, postings_docs, tf.astype(np.float32), doc_len, vocab_size, use_ngrams)
+
+    def extended(self, term_lists):
+        # 返回追加了新文档的索引：基础倒排与原索引共用，只对压缩以来追加的文档重建附加索引，开销与追加的文档数成正比；
+        # 原索引保持不变，进行中的查询可以继续使用
+        index = copy.copy(self)
+        index.delta_terms = self.delta_terms + list(term_lists)
+        index.delta = InvertedIndex.from_terms(index.delta_terms, self.vocab_size, self.use_ngrams)
+        index.num_docs = len(self.doc_len) + index.delta.num_docs
+        # 与整体构建时 doc_len.mean() 的 float32 计算一致
+        index.avg_doc_len = float(np.float32(self.doc_len.sum() + index.delta.doc_len.sum()) / index.num_docs)
+        return index
+
+    def term_idf(self, term):
+        if self.delta is None:
+            return self.idf[term]
+        df = np.float32(self.term_offsets[term + 1] - self.term_offsets[term]
+                        + self.delta.term_offsets[term + 1] - self.delta.term_offsets[term])
+        return np.float32(np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5)))
+
+    def save(self, index_dir=INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        tmp_path = os.path.join(index_dir, 'bm25.tmp.npz')
+        np.savez(tmp_path,
+                 term_offsets=self.term_offsets,
+                 postings_docs=self.postings_docs,
+                 postings_tf=self.postings_tf,
+                 doc_len=self.doc_len,
+                 params=np.array([self.vocab_size, int(self.use_ngrams), self.k1, self.b]),
+                 key=np.array(self.key))
+        os.replace(tmp_path, os.path.join(index_dir, 'bm25.npz'))
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        data = np.load(os.path.join(index_dir, 'bm25.npz'))
+        vocab_size, use_ngrams, k1, b = data['params']
+        return cls(data['term_offsets'], data['postings_docs'], data['postings_tf'], data['doc_len'],
+                   int(vocab_size), bool(use_ngrams), float(k1), float(b), str(data['key']))
+
+    def search(self, query_terms, k=TOP_K, rows=None):
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        terms, counts = np.unique(np.asarray(query_terms, dtype=np.int64), return_counts=True)
+        segments = [(self, 0)] if self.delta is None else [(self, 0), (self.delta, len(self.doc_len))]
+        for term, count in zip(terms, counts):
+            idf = self.term_idf(term)
+            for index, offset in segments:
+                start, end = index.term_offsets[term], index.term_offsets[term + 1]
+                if start == end:
+                    continue
+                docs = index.postings_docs[start:end]
+                tf = index.postings_tf[start:end]
+                norm = self.k1 * (1 - self.b + self.b * index.doc_len[docs] / self.avg_doc_len)
+                scores[docs + offset] += count * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return top_k(scores, k, rows)
+
+    def search_address(self, address, word_dict, k=TOP_K, rows=None):
+        return self.search(address_to_terms(address, word_dict, self.vocab_size, self.use_ngrams), k, rows)
+
+
+def top_k(scores, k, rows=None):
+    # rows 不为 None 时只在这些文档（如行政分块）中取前 k 个
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = scores[rows]
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), scores[:0]
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return (top if rows is None else rows[top]), scores[top]
+
+
+def address_to_terms(address_text, word_dict, vocab_size, use_ngrams=True):
+    terms = []
+    for word in word_dict.tokenize(address_text):
+        word = word.strip()
+        if not word:
+            continue
+        index = word_dict.get(word)
+        if index is not None:
+            terms.append(index)
+        elif use_ngrams:
+            # 未登录词退化为字符二元组，哈希到词表之后的桶中
+            grams = [word] if len(word) < 2 else [word[i:i + 2] for i in range(len(word) - 1)]
+            for gram in grams:
+                terms.append(vocab_size + zlib.crc32(gram.encode('utf-8')) % NGRAM_BUCKETS)
+    return terms
+
+
+def index_key(word_dict_path, reference_path, use_ngrams=True):
+    return f"{vocab_hash(word_dict_path)}:{file_hash(reference_path)}:{int(use_ngrams)}"
+
+
+def load_or_build_index(word_dict, addresses, word_dict_path=WORD_DICT_PATH, reference_path=REFERENCE_PATH,
+                        index_dir=INDEX_DIR, use_ngrams=True):
+    key = index_key(word_dict_path, reference_path, use_ngrams)
+    if os.path.exists(os.path.join(index_dir, 'bm25.npz')):
+        index = InvertedIndex.load(index_dir)
+        if index.key == key:
+            return index
+    index = InvertedIndex.build(addresses, word_dict, use_ngrams)
+    index.key = key
+    index.save(index_dir)
+    return index
+
+
+def recall_report(index, word_dict, addresses, pairs_path, ks=(1, 5, 10, 20, 50, 100, 200, 500)):
+    position = {address: i for i, address in enumerate(addresses)}
+    queries = []
+    with open(pairs_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            columns = line.strip().split('\t')
+            if len(columns) == 3 and columns[2] == '1' and columns[1] in position:
+                queries.append((columns[0], position[columns[1]]))
+
+    hits = np.zeros(len(ks))
+    start = time.perf_counter()
+    for query, target in queries:
+        top, _ = index.search_address(query, word_dict, k=max(ks))
+        rank = np.flatnonzero(top == target)
+        if len(rank):
+            hits += rank[0] < np.array(ks)
+    elapsed = time.perf_counter() - start
+
+    print(f"Queries: {len(queries)}, reference addresses: {index.num_docs}")
+    print(f"Mean search latency: {elapsed / max(len(queries), 1) * 1000:.2f} ms")
+    for k, hit in zip(ks, hits):
+        print(f"Recall@{k}: {hit / max(len(queries), 1):.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the BM25 candidate index and report recall@K')
+    parser.add_argument('--reference', default=REFERENCE_PATH)
+    parser.add_argument('--word-dict', default=WORD_DICT_PATH)
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    parser.add_argument('--no-ngrams', action='store_true')
+    parser.add_argument('--pairs', default='data/dataset/test/address.txt')
+    args = parser.parse_args()
+
+    word_dict = load_word_dict(args.word_dict)
+    addresses = load_reference_addresses(args.reference)
+    start = time.perf_counter()
+    index = InvertedIndex.build(addresses, word_dict, use_ngrams=not args.no_ngrams)
+    index.key = index_key(args.word_dict, args.reference, not args.no_ngrams)
+    index.save(args.index_dir)
+    print(f"Built index over {index.num_docs} addresses in {time.perf_counter() - start:.2f}s")
+    recall_report(index, word_dict, addresses, args.pairs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import logging
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import torch.multiprocessing
+import matcher
+
+logger = logging.getLogger(__name__)
+
+# 候选对少于此数时在调用进程内打分，进程间通信的开销大于并行收益
+MIN_PAIRS = 4096
+THREADS_PER_SHARD = 1
+
+# 每个分片进程持有的模型与共享参考编码
+_shard = {}
+
+
+def init_shard(model_path, backend, encoded, mask, max_len, shard, num_shards, num_threads):
+    # encoded/mask 位于共享内存中，子进程直接映射父进程的存储，不复制数据
+    torch.set_num_threads(num_threads)
+    model, _ = matcher.load_model(model_path, torch.device('cpu'), backend)
+    _shard.update(model=model, cache={'encoded': encoded, 'mask': mask, 'max_len': max_len}, shard=shard,
+                  num_shards=num_shards)
+
+
+def ping():
+    return os.getpid()
+
+
+def shard_rows(candidate_ids, num_rows):
+    # 参考地址按行号取模分配到各分片；参考文件按区排序，连续切分会让同一块的候选集中在一个分片
+    shard, num_shards = _shard['shard'], _shard['num_shards']
+    if candidate_ids is None:
+        return torch.arange(shard, num_rows, num_shards)
+    candidate_ids = torch.from_numpy(candidate_ids)
+    return candidate_ids[candidate_ids % num_shards == shard]
+
+
+def score_shard(query_indices, candidate_lists, top_k, num_rows, batch_size, max_batch_tokens):
+    # 返回每个查询在本分片内的 top_k (行号, 分数)，由主进程合并；共享编码可能带有预留容量，只有前 num_rows 行有效
+    candidate_lists = [shard_rows(ids, num_rows) for ids in candidate_lists]
+    scores = matcher.score_candidate_lists(_shard['model'], query_indices, candidate_lists, _shard['cache'],
+                                           torch.device('cpu'), batch_size, max_batch_tokens)
+    results = []
+    offset = 0
+    for candidate_ids in candidate_lists:
+        query_scores = scores[offset:offset + len(candidate_ids)]
+        offset += len(candidate_ids)
+        top_scores, positions = torch.topk(query_scores, min(top_k, len(query_scores)))
+        results.append((candidate_ids[positions].tolist(), top_scores.tolist()))
+    return results
+
+
+class ShardedScorer:
+    # 参考集按行号切成 num_shards 个分片，每个分片一个常驻进程；一次查询由所有分片并行打分后合并 top_k
+    def __init__(self, model_path, cache, num_shards, threads_per_shard=THREADS_PER_SHARD, backend='eager',
+                 min_pairs=MIN_PAIRS, batch_size=matcher.BATCH_SIZE, max_batch_tokens=matcher.MAX_BATCH_TOKENS):
+        self.num_shards = num_shards
+        self.min_pairs = min_pairs
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        # 编码只移入共享内存一次，各分片进程通过句柄访问同一份存储
+        encoded = self.encoded = cache['encoded'].share_memory_()
+        mask = self.mask = cache['mask'].share_memory_()
+        context = torch.multiprocessing.get_context('spawn')
+        self.executors = [
+            ProcessPoolExecutor(1, mp_context=context, initializer=init_shard,
+                                initargs=(model_path, backend, encoded, mask, cache['max_len'], shard, num_shards,
+                                          threads_per_shard))
+            for shard in range(num_shards)
+        ]
+        # 等待所有分片加载完模型，预热完成后第一条查询不再付出启动开销
+        self.pids = [future.result() for future in [executor.submit(ping) for executor in self.executors]]
+        self._active = 0
+        self._closed = False
+        self._idle = threading.Condition()
+
+    def shares(self, encoded, mask):
+        # 分片进程是否映射着这两块存储：参考库增量写在同一缓冲区时无需重启分片进程
+        return (encoded.untyped_storage().data_ptr() == self.encoded.untyped_storage().data_ptr()
+                and mask.untyped_storage().data_ptr() == self.mask.untyped_storage().data_ptr())
+
+    def top_k(self, query_indices, candidate_lists, top_k, num_rows=None):
+        # candidate_lists 中的 None 表示对前 num_rows 行全量打分，各分片自行展开，避免传输百万级行号
+        num_rows = len(self.encoded) if num_rows is None else num_rows
+        candidate_lists = [None if ids is None else np.asarray(ids, dtype=np.int64) for ids in candidate_lists]
+        futures = [executor.submit(score_shard, query_indices, candidate_lists, top_k, num_rows, self.batch_size,
+                                   self.max_batch_tokens) for executor in self.executors]
+        shard_results = [future.result() for future in futures]
+        merged = []
+        for per_query in zip(*shard_results):
+            rows = [row for shard_ids, _ in per_query for row in shard_ids]
+            scores = torch.tensor([score for _, shard_scores in per_query for score in shard_scores])
+            top_scores, positions = torch.topk(scores, min(top_k, len(scores)))
+            merged.append(([rows[position] for position in positions.tolist()], top_scores.tolist()))
+        return merged
+
+    def acquire(self):
+        with self._idle:
+            if self._closed:
+                raise RuntimeError('sharded scorer is closed')
+            self._active += 1
+
+    def release(self):
+        with self._idle:
+            self._active -= 1
+            self._idle.notify_all()
+
+    def close(self):
+        # 等正在进行的查询完成后再关闭分片进程
+        with self._idle:
+            self._closed = True
+            self._idle.wait_for(lambda: self._active == 0)
+        for executor in self.executors:
+            executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure full-scan query latency against the number of shards')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads-per-shard', type=int, default=THREADS_PER_SHARD)
+    parser.add_argument('--model', default=matcher.MODEL_PATH)
+    parser.add_argument('--word-dict', default=matcher.WORD_DICT_PATH)
+    parser.add_argument('--reference', default=matcher.REFERENCE_PATH)
+    parser.add_argument('--cache-dir', default=matcher.CACHE_DIR)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from benchmark import load_queries
+    queries = load_queries(count=args.queries)
+    for num_shards in args.shards:
+        # 不做召回和分块，每条查询对全部参考地址打分
+        address_matcher = matcher.AddressMatcher(args.model, args.word_dict, args.reference, args.cache_dir,
+                                                 prefilter=None, exact_match=False, result_cache_size=0,
+                                                 blocking=False, shards=num_shards,
+                                                 threads_per_shard=args.threads_per_shard).warm_up()
+        address_matcher.wait_ready()
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            address_matcher.match(query)
+            latencies.append(time.perf_counter() - start)
+        address_matcher.close()
+        print(f"{num_shards:3d} shards x {args.threads_per_shard} threads: "
+              f"p50 {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms "
+              f"over {len(address_matcher.cache['addresses'])} references")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import contextlib
+import resource
+import sys
+import time
+
+
+def peak_rss_mb():
+    # ru_maxrss 在 Linux 上以 KB 计，在 macOS 上以字节计
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def children_peak_rss_mb():
+    # 分词等阶段在子进程中完成，RUSAGE_CHILDREN 给出已回收子进程中最大的那个峰值
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def reset_peak_rss():
+    # Linux 上向 clear_refs 写 5 会把 VmHWM 重置为当前 RSS，使每个阶段的峰值互不累积
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def stage_peak_rss_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+@contextlib.contextmanager
+def report(name):
+    # 打印一个阶段的耗时和峰值内存；无法重置峰值的平台上报告的是进程启动以来的峰值
+    per_stage = reset_peak_rss()
+    children_before = children_peak_rss_mb()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    label = 'peak RSS' if per_stage else 'process peak RSS'
+    # 子进程峰值是进程生命周期内的最大值，只在本阶段内被刷新时才报告
+    children_peak = children_peak_rss_mb()
+    children = f", largest child {children_peak:.0f} MB" if children_peak > children_before else ''
+    print(f"[{name}] {elapsed:.1f}s, {label} {stage_peak_rss_mb():.0f} MB{children}")
@@ -0,0 +1,63 @@
+import pytest
+import torch
+from cascade import Cascade
+from define_esim import ESIM
+import matcher
+from test_models import REFERENCES, tiny_vocabulary
+
+
+class FixedCascade(Cascade):
+    # 每个参考行的级联概率预先给定，按参考行的词编号查表，与查询无关
+    def __init__(self, reference_indices, probabilities, low=0.2, high=0.8):
+        super().__init__(torch.zeros(1), 0.0, low, high, None)
+        self.table = {tuple(row.tolist()): p for row, p in zip(reference_indices, probabilities)}
+
+    def probability(self, a, b):
+        return torch.tensor([self.table[tuple(row.tolist())] for row in b])
+
+
+def test_filter_splits_candidates_by_band():
+    reference_indices = torch.arange(1, 11).unsqueeze(1)
+    probabilities = [0.9, 0.1, 0.5, 0.95, 0.05, 0.3, 0.85, 0.15, 0.8, 0.2]
+    cascade = FixedCascade(reference_indices, probabilities)
+    candidate_lists = [torch.arange(0, 6), torch.arange(6, 10)]
+    remaining, exits = cascade.filter([[1, 2], [3, 4]], candidate_lists, reference_indices, top_k=2)
+
+    # low/high 本身属于不确定区间，交给 ESIM
+    assert [ids.tolist() for ids in remaining] == [[2, 5], [8, 9]]
+    (accepted, rejected), (accepted_2, rejected_2) = exits
+    assert accepted == ([3, 0], pytest.approx([0.95, 0.9]))
+    assert rejected == ([1, 4], pytest.approx([0.1, 0.05]))
+    assert accepted_2 == ([6], pytest.approx([0.85]))
+    assert rejected_2 == ([7], pytest.approx([0.15]))
+    assert cascade.stats() == {'pairs': 10, 'early_exits': 6, 'exit_rate': 0.6}
+
+
+@pytest.fixture(scope='module')
+def scored():
+    word_dict = tiny_vocabulary()
+    torch.manual_seed(0)
+    model = ESIM(vocab_size=word_dict.size, embedding_dim=16, embedding_matrix=None, max_sequence_length=128,
+                 hidden_dim=8, masked=True).eval()
+    cache = matcher.build_reference_cache(model, word_dict, REFERENCES, torch.device('cpu'))
+    cache['mask'] = cache['indices'] != 0
+    query = '南山区后海大道2322号南粤明珠大厦'
+    esim = matcher.score_cached(model, query, cache, word_dict, torch.device('cpu')).tolist()
+    return model, word_dict, cache, query, esim
+
+
+@pytest.mark.parametrize('top_k', [1, 3, 4, 5, 6])
+def test_exits_rank_with_esim_and_rejections_only_fill(scored, top_k):
+    model, word_dict, cache, query, esim = scored
+    # 0 号提前接受，1、2 号提前拒绝，其余交给 ESIM；拒绝概率高于所有 ESIM 分数，排在最后只因为它们被拒绝
+    assert max(esim) < 0.6
+    probabilities = [0.995, 0.6, 0.7, 0.95, 0.95, 0.95]
+    cascade = FixedCascade(cache['indices'], probabilities, low=0.9, high=0.99)
+    result = matcher.match_batch(model, [query], cache, word_dict, torch.device('cpu'), top_k=top_k,
+                                 cascade=cascade)[0]
+
+    # 被接受的候选按级联概率与 ESIM 分数一起排序；被拒绝的候选排在最后，只在其余候选不足 top_k 个时补位
+    ranked = sorted([(0, 0.995)] + [(row, esim[row]) for row in (3, 4, 5)], key=lambda item: -item[1])
+    expected = (ranked + [(2, 0.7), (1, 0.6)])[:top_k]
+    assert [address for address, _ in result] == [REFERENCES[row] for row, _ in expected]
+    assert [score for _, score in result] == pytest.approx([score for _, score in expected], abs=1e-6)
@@ -1,8 +1,11 @@
 import torch
 from torch.utils.data import DataLoader
 import logging
-from train_esim import TextMatchDataset, evaluate, load_combined_embeddings
-from define_esim import ESIM
+import time
+from train_esim import load_dataset, BucketBatchSampler, collate_batch, evaluate, load_combined_embeddings
+from define_esim import ESIM, BACKENDS, convert_model
+from matcher import load_student, chunk_size_for, STUDENT_PATH
+import argparse
 
 
 # Configure logging
@@ -10,57 +13,120 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def test_model():
+def log_results(name, precision, recall, f1, best, elapsed, num_pairs):
+    logger.info(f'{name} Precision: {precision:.4f}')
+    logger.info(f'{name} Recall: {recall:.4f}')
+    logger.info(f'{name} F1 Score: {f1:.4f}')
+    logger.info(f"{name} Best Threshold: {best['threshold']:.2f} "
+                f"(P {best['precision']:.4f}, R {best['recall']:.4f}, F1 {best['f1']:.4f})")
+    logger.info(f'{name} Throughput: {num_pairs / max(elapsed, 1e-9):.0f} pairs/s')
+
+
+def query_latency(esim, student, dataset, device, num_queries=20):
+    # 一条查询对全部参考地址打分的耗时：ESIM 即使缓存了参考编码也要逐对交互，学生模型只需一次矩阵乘法
+    references = {}
+    for i in range(len(dataset)):
+        sequence = dataset[i]['addr2']
+        references.setdefault(tuple(sequence.tolist()), sequence)
+    references = collate_batch([{'addr1': seq, 'addr2': seq, 'label': 0.0} for seq in references.values()])['addr1']
+    queries = collate_batch([dataset[i] for i in range(min(num_queries, len(dataset)))])['addr1']
+    references, queries = references.to(device), queries.to(device)
+
+    with torch.inference_mode():
+        reference_encoded, reference_mask = esim.encode(references)
+        reference_vectors = student.embed(references)
+        size = chunk_size_for(references.size(1))
+        start = time.perf_counter()
+        for query in queries:
+            query_encoded, query_mask = esim.encode(query.unsqueeze(0))
+            for offset in range(0, len(references), size):
+                encoded = reference_encoded[offset:offset + size]
+                n = encoded.size(0)
+                esim.interact(query_encoded.expand(n, -1, -1), query_mask.expand(n, -1), encoded,
+                              reference_mask[offset:offset + size])
+        esim_time = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        for query in queries:
+            student.score_matrix(student.embed(query.unsqueeze(0)), reference_vectors)
+        student_time = (time.perf_counter() - start) / len(queries)
+    return len(references), esim_time, student_time
+
+
+def test_model(backend='eager', student_path=None):
     # Configuration
-    BATCH_SIZE = 32
+    BATCH_SIZE = 512
     MAX_LEN = 128
-    DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # int8 动态量化只支持CPU
+    DEVICE = torch.device('cuda' if torch.cuda.is_available() and backend != 'int8' else 'cpu')
     MODEL_PATH = 'result/best_esim_model.pth'
 
     # Load test dataset
-    test_dataset = TextMatchDataset(
-        'data/dataset/test/addr1_tokenized.txt',
-        'data/dataset/test/addr2_tokenized.txt',
-        'data/dataset/test/labels.txt',
-        max_len=MAX_LEN
+    test_dataset = load_dataset('data/dataset/test', max_len=MAX_LEN)
+    test_loader = DataLoader(
+        test_dataset,
+        batch_sampler=BucketBatchSampler(test_dataset.lengths, BATCH_SIZE, shuffle=False),
+        collate_fn=collate_batch
     )
-    test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=True)
 
     # Load word embeddings
-    embedding_matrix, word_to_idx = load_combined_embeddings(
+    embedding_matrix, _ = load_combined_embeddings(
         'model/word2vec.model',
         'GloVe/vectors.txt',
         'data/vocab/intersection_vocab.txt'
     )
-    vocab_size = len(word_to_idx) + 1  # +1 为填充符
+    vocab_size = embedding_matrix.shape[0]  # 含填充符0
     embedding_dim = embedding_matrix.shape[1]
 
-    # Initialize model
+    # Initialize model in the forward mode it was trained with
+    checkpoint = torch.load(MODEL_PATH)
     model = ESIM(
         vocab_size=vocab_size,
         embedding_dim=embedding_dim,
         embedding_matrix=embedding_matrix,
-        max_sequence_length=MAX_LEN
+        max_sequence_length=MAX_LEN,
+        masked=checkpoint.get('masked', False)
     ).to(DEVICE)
 
     # Load trained model weights
-    checkpoint = torch.load(MODEL_PATH)
     model.load_state_dict(checkpoint['model_state_dict'])
     logger.info(f"Loaded model from epoch {checkpoint['epoch']} with best F1: {checkpoint['best_f1']:.4f}")
+    model = convert_model(model, backend)
+    logger.info(f'Inference backend: {backend}')
 
-    with torch.no_grad():
+    # Evaluate model on test set
+    start = time.perf_counter()
+    test_precision, test_recall, test_f1, test_best = evaluate(model, test_loader, DEVICE)
+    elapsed = time.perf_counter() - start
 
-        # Evaluate model on test set
-        test_precision, test_recall, test_f1 = evaluate(model, test_loader, DEVICE)
+    # Print results
+    logger.info('-' * 50)
+    logger.info('Test Results:')
+    log_results('ESIM', test_precision, test_recall, test_f1, test_best, elapsed, len(test_dataset))
+    if 'threshold' in checkpoint:
+        logger.info(f"Checkpoint Threshold: {checkpoint['threshold']:.2f}")
+    logger.info('-' * 50)
 
-        # Print results
-        logger.info('-' * 50)
-        logger.info('Test Results:')
-        logger.info(f'Precision: {test_precision:.4f}')
-        logger.info(f'Recall: {test_recall:.4f}')
-        logger.info(f'F1 Score: {test_f1:.4f}')
+    if student_path:
+        # 蒸馏学生模型：同一测试集上的精度、成对吞吐量，以及单条查询对全部参考地址打分的耗时
+        student, _ = load_student(student_path, DEVICE)
+        start = time.perf_counter()
+        student_precision, student_recall, student_f1, student_best = evaluate(student, test_loader, DEVICE)
+        elapsed = time.perf_counter() - start
+        log_results('Student', student_precision, student_recall, student_f1, student_best, elapsed,
+                    len(test_dataset))
+        logger.info(f'Student F1 vs ESIM: {student_f1 - test_f1:+.4f}')
+        if backend == 'eager':
+            num_references, esim_time, student_time = query_latency(model, student, test_dataset, DEVICE)
+            logger.info(f'One query against {num_references} references: ESIM (cached encodings) '
+                        f'{esim_time * 1000:.1f} ms, student (precomputed vectors) {student_time * 1000:.1f} ms '
+                        f'({esim_time / max(student_time, 1e-9):.0f}x)')
         logger.info('-' * 50)
 
 
 if __name__ == '__main__':
-    test_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=BACKENDS, default='eager')
+    parser.add_argument('--student', nargs='?', const=STUDENT_PATH,
+                        help='also evaluate the distilled bi-encoder and compare it with ESIM')
+    args = parser.parse_args()
+    test_model(args.backend, args.student)
\ No newline at end of file
@@ -0,0 +1,81 @@
+import pytest
+import torch
+from define_esim import ESIM
+import matcher
+
+VOCAB_SIZE = 50
+
+
+def tiny_esim(masked=False, seed=0):
+    torch.manual_seed(seed)
+    return ESIM(vocab_size=VOCAB_SIZE, embedding_dim=16, embedding_matrix=None, max_sequence_length=32, hidden_dim=8,
+                masked=masked).eval()
+
+
+def save_checkpoint(model, path):
+    torch.save({'model_state_dict': model.state_dict(), 'masked': model.masked}, path)
+    return str(path)
+
+
+def sample_pairs(seed=1):
+    # 长度各不相同的地址对，包含长度为 1 和两侧一样长的情况
+    generator = torch.Generator().manual_seed(seed)
+    premise = torch.randint(1, VOCAB_SIZE, (6, 12), generator=generator)
+    hypothesis = torch.randint(1, VOCAB_SIZE, (6, 9), generator=generator)
+    for row, (premise_length, hypothesis_length) in enumerate([(12, 9), (5, 3), (8, 9), (1, 1), (12, 2), (7, 6)]):
+        premise[row, premise_length:] = 0
+        hypothesis[row, hypothesis_length:] = 0
+    return premise, hypothesis
+
+
+@pytest.mark.parametrize('backend,tolerance', [('torchscript', 1e-6), ('int8', 2e-2)])
+@pytest.mark.parametrize('masked', [False, True])
+def test_converted_backends_match_eager(tmp_path, backend, tolerance, masked):
+    model_path = save_checkpoint(tiny_esim(masked), tmp_path / 'model.pth')
+    eager, _ = matcher.load_model(model_path, torch.device('cpu'), 'eager')
+    converted, _ = matcher.load_model(model_path, torch.device('cpu'), backend)
+    premise, hypothesis = sample_pairs()
+    with torch.no_grad():
+        expected = eager(premise, hypothesis)
+        assert torch.allclose(converted(premise, hypothesis), expected, atol=tolerance)
+        # 参考编码缓存走 encode/interact，脚本化后这两个方法必须保留且与 forward 一致
+        premise_encoded, premise_mask = converted.encode(premise)
+        hypothesis_encoded, hypothesis_mask = converted.encode(hypothesis)
+        scores = converted.interact(premise_encoded, premise_mask, hypothesis_encoded, hypothesis_mask)
+        assert torch.allclose(scores, expected, atol=tolerance)
+
+
+REFERENCES = ['南山区粤海街道后海大道2322号南粤明珠', '南山区南山大道1109号华联花园公寓8栋', '福田区华强北路1002号赛格广场',
+              '宝安区新安街道建安一路99号', '南山区科技园科苑路15号科兴科学园A栋', '罗湖区东门北路1001号']
+
+
+def tiny_vocabulary():
+    import jieba
+    from vocabulary import Vocabulary
+    words = sorted({word for address in REFERENCES for word in jieba.lcut(address)})
+    return Vocabulary(words)
+
+
+@pytest.mark.parametrize('masked', [False, True])
+def test_scoring_paths_agree(masked):
+    # /match（参考编码缓存）、/score（score_candidates）和 score_pairs 对同一地址对给出相同分数
+    word_dict = tiny_vocabulary()
+    torch.manual_seed(0)
+    model = ESIM(vocab_size=word_dict.size, embedding_dim=16, embedding_matrix=None, max_sequence_length=128,
+                 hidden_dim=8, masked=masked).eval()
+    device = torch.device('cpu')
+    query = '南山区后海大道2322号南粤明珠大厦'
+    cache = matcher.build_reference_cache(model, word_dict, REFERENCES, device)
+    cache['mask'] = cache['indices'] != 0
+
+    cached = matcher.score_cached(model, query, cache, word_dict, device)
+    query_indices = matcher.address_to_index(query, word_dict)
+    reference_indices = [matcher.address_to_index(address, word_dict) for address in REFERENCES]
+    candidates = matcher.score_candidates(model, query_indices, reference_indices, device, batch_size=4)
+    pairs = matcher.score_pairs(model, [(query_indices, indices) for indices in reference_indices], device,
+                                batch_size=4)
+    batched = matcher.match_batch(model, [query], cache, word_dict, device, top_k=len(REFERENCES))[0]
+    assert torch.allclose(candidates, cached, atol=1e-6)
+    assert torch.allclose(pairs, cached, atol=1e-6)
+    assert torch.allclose(torch.tensor([score for _, score in sorted(batched, key=lambda item: REFERENCES.index(
+        item[0]))]), cached, atol=1e-6)
@@ -0,0 +1,83 @@
+import json
+import pytest
+import torch
+from define_esim import ESIM
+import matcher
+import reference_store
+from test_models import REFERENCES, save_checkpoint, tiny_vocabulary
+
+ADDED = ['南山区桃园路2号田厦国际中心', '福田区深南大道6008号特区报业大厦']
+QUERIES = ['南山区后海大道南粤明珠大厦', '福田区深南大道报业大厦', '宝安区建安一路99号', '南山区桃园路2号田厦国际中心']
+
+
+@pytest.fixture
+def store_setup(tmp_path):
+    # 小词表 + masked 小模型，参考库初始只含前四条地址
+    word_dict = tiny_vocabulary()
+    word_dict_path = tmp_path / 'word_dict.json'
+    word_dict_path.write_text(json.dumps({word: i for i, word in enumerate(word_dict.words, 1)}, ensure_ascii=False),
+                              encoding='utf-8')
+    torch.manual_seed(0)
+    model = ESIM(vocab_size=word_dict.size, embedding_dim=16, embedding_matrix=None, max_sequence_length=128,
+                 hidden_dim=8, masked=True).eval()
+    model_path = save_checkpoint(model, tmp_path / 'model.pth')
+    store = reference_store.ReferenceStore(str(tmp_path / 'store'))
+    key = reference_store.store_key(model_path, str(word_dict_path))
+    store.create(model, word_dict, REFERENCES[:4], torch.device('cpu'), key)
+
+    def make_matcher():
+        return matcher.AddressMatcher(model_path, str(word_dict_path), cache_dir=str(tmp_path / 'cache'),
+                                      store_dir=store.store_dir, result_cache_size=0,
+                                      device=torch.device('cpu')).warm_up()
+
+    return store, model, word_dict, make_matcher
+
+
+def results(address_matcher):
+    return [{address: score for address, score in result}
+            for result in address_matcher.match_batch(QUERIES, top_k=len(REFERENCES) + len(ADDED))]
+
+
+def assert_same(incremental, fresh):
+    assert incremental.state == fresh.state == 'ready'
+    assert matcher.live_count(incremental.cache) == matcher.live_count(fresh.cache)
+    for got, expected in zip(results(incremental), results(fresh)):
+        assert got.keys() == expected.keys()
+        assert [got[address] for address in expected] == pytest.approx(list(expected.values()), abs=1e-6)
+
+
+def test_store_add_remove_and_compact(store_setup):
+    store, model, word_dict, _ = store_setup
+    assert store.count() == 4
+    assert store.add(model, word_dict, REFERENCES[2:] + ADDED, torch.device('cpu')) == 4
+    assert store.remove([REFERENCES[0], '不存在的地址']) == 1
+    assert sorted(store.addresses()) == sorted(REFERENCES[1:] + ADDED)
+    store.compact()
+    assert store.manifest()['generation'] == 1
+    assert store.pending_rows(store.manifest()) == 0
+    assert sorted(store.load()['addresses']) == sorted(REFERENCES[1:] + ADDED)
+
+
+def test_incremental_reload_equals_fresh_load(store_setup):
+    store, model, word_dict, make_matcher = store_setup
+    address_matcher = make_matcher()
+    base_cache = address_matcher.cache
+
+    store.add(model, word_dict, REFERENCES[4:] + ADDED[:1], torch.device('cpu'))
+    assert address_matcher.reload() == 7
+    assert address_matcher.cache['store']['generation'] == base_cache['store']['generation']
+    # 旧数据保持不变，进行中的查询继续看到原来的参考地址
+    assert len(base_cache['addresses']) == 4
+    assert_same(address_matcher, make_matcher())
+
+    store.remove([REFERENCES[1], ADDED[0]])
+    store.add(model, word_dict, ADDED[1:] + [REFERENCES[1]], torch.device('cpu'))
+    assert address_matcher.reload() == 7
+    assert address_matcher.exact_index.lookup(ADDED[0]) is None
+    assert address_matcher.cache['addresses'][address_matcher.exact_index.lookup(REFERENCES[1])] == REFERENCES[1]
+    assert_same(address_matcher, make_matcher())
+
+    store.compact()
+    assert address_matcher.reload() == 7
+    assert address_matcher.cache['dead'] == 0
+    assert_same(address_matcher, make_matcher())
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import torch
+from sklearn.metrics import f1_score, precision_score, recall_score
+from torch.utils.data import DataLoader
+from train_esim import BucketBatchSampler, collate_batch, evaluate, threshold_metrics
+
+
+def reference_metrics(scores, labels, threshold):
+    # 逐个阈值直接计算，作为向量化扫描的对照
+    predicted = (scores.double() > threshold).numpy()
+    labels = labels.numpy()
+    return (precision_score(labels, predicted, zero_division=0), recall_score(labels, predicted, zero_division=0),
+            f1_score(labels, predicted, zero_division=0))
+
+
+def sample_scores(seed=0, size=500):
+    generator = torch.Generator().manual_seed(seed)
+    labels = (torch.rand(size, generator=generator) < 0.3).double()
+    scores = (0.3 * labels + 0.7 * torch.rand(size, generator=generator, dtype=torch.float64)).clamp(max=0.98)
+    # 恰好落在阈值上的分数不算预测为正（score > 阈值）
+    scores[:20] = torch.arange(20, dtype=torch.float64) / 20
+    return scores, labels
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_threshold_sweep_matches_per_threshold(seed):
+    scores, labels = sample_scores(seed)
+    thresholds, precision, recall, f1 = threshold_metrics(scores, labels)
+    for i, threshold in enumerate(thresholds.tolist()):
+        expected = reference_metrics(scores, labels, threshold)
+        assert (precision[i].item(), recall[i].item(), f1[i].item()) == pytest.approx(expected, abs=1e-12)
+
+
+def test_threshold_sweep_without_positives():
+    scores, _ = sample_scores()
+    labels = torch.zeros_like(scores)
+    _, precision, recall, f1 = threshold_metrics(scores, labels)
+    assert precision.abs().sum() == recall.abs().sum() == f1.abs().sum() == 0
+
+
+class FixedScores(torch.nn.Module):
+    # 分数取自 addr1 的第一个编号，与批次的组成和填充无关
+    def forward(self, text1, text2):
+        return text1[:, :1].float() / 1000
+
+
+def test_evaluate_matches_per_threshold():
+    rng = np.random.default_rng(0)
+    ids = rng.integers(1, 1000, 300)
+    labels = (rng.random(300) < ids / 1000).astype(np.float32)
+    lengths = rng.integers(1, 12, 300)
+    dataset = [{'addr1': np.concatenate([[score_id], np.ones(length - 1, dtype=np.int64)]),
+                'addr2': np.ones(length, dtype=np.int64), 'label': label}
+               for score_id, length, label in zip(ids, lengths, labels)]
+    # 按长度分桶后批次顺序与数据集顺序不同，指标不应受影响
+    loader = DataLoader(dataset, batch_sampler=BucketBatchSampler(lengths, 32, shuffle=False),
+                        collate_fn=collate_batch)
+    precision, recall, f1, best = evaluate(FixedScores(), loader, torch.device('cpu'))
+
+    scores = torch.from_numpy(ids).float() / 1000
+    labels = torch.from_numpy(labels)
+    assert (precision, recall, f1) == pytest.approx(reference_metrics(scores, labels, 0.5), abs=1e-12)
+    grid = [reference_metrics(scores, labels, threshold / 100) for threshold in range(1, 100)]
+    position = max(range(len(grid)), key=lambda i: (grid[i][2], -i))
+    assert best['threshold'] == pytest.approx((position + 1) / 100)
+    assert (best['precision'], best['recall'], best['f1']) == pytest.approx(grid[position], abs=1e-12)
+
+
+def test_bucket_batches_cover_every_index_once():
+    lengths = np.random.default_rng(0).integers(1, 60, 1000)
+    np.random.seed(0)
+    sampler = BucketBatchSampler(lengths, batch_size=32, bucket_batches=4)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(lengths)))
+    assert all(len(batch) <= 32 for batch in batches)
+    # 批次切自按长度排序的桶，批内长度有序
+    assert all(np.all(np.diff(lengths[batch]) >= 0) for batch in batches)
+
+
+def test_bucket_batches_do_not_overlap_within_a_bucket():
+    lengths = np.random.default_rng(1).integers(1, 60, 500)
+    np.random.seed(1)
+    # 整个数据集只有一个桶时，各批次的长度区间互不重叠
+    batches = sorted(list(BucketBatchSampler(lengths, batch_size=20, bucket_batches=100)),
+                     key=lambda batch: (lengths[batch].min(), lengths[batch].max()))
+    for previous, batch in zip(batches, batches[1:]):
+        assert lengths[previous].max() <= lengths[batch].min()
+
+
+def test_evaluation_batches_are_globally_sorted():
+    lengths = np.random.default_rng(2).integers(1, 60, 100)
+    batches = list(BucketBatchSampler(lengths, batch_size=16, shuffle=False))
+    assert [index for batch in batches for index in batch] == np.argsort(lengths, kind='stable').tolist()
+
+
+def test_collate_pads_each_side_to_the_batch_maximum():
+    batch = [{'addr1': np.array([3, 4, 5]), 'addr2': np.array([7]), 'label': 1},
+             {'addr1': np.array([6]), 'addr2': np.array([8, 9]), 'label': 0}]
+    collated = collate_batch(batch)
+    assert collated['addr1'].tolist() == [[3, 4, 5], [6, 0, 0]]
+    assert collated['addr2'].tolist() == [[7, 0], [8, 9]]
+    assert collated['label'].tolist() == [[1.0], [0.0]]
+    assert collated['addr1'].dtype == torch.int64
+    empty = collate_batch([{'addr1': np.zeros(0, dtype=np.int64), 'addr2': np.array([1]), 'label': 0}])
+    assert empty['addr1'].shape == (1, 1)
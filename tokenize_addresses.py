@@ -1,13 +1,15 @@
 from collections import Counter
 
-import jieba
+from stage_report import report
+from tokenizer_pool import TokenCache, Throughput, read_lines, tokenize_stream
 
-def tokenize_address(corpus, token):
-    with open(corpus, 'r', encoding='utf-8') as f:
-        with open(token, 'w', encoding='utf-8') as t:
-            for line in f:
-                t.write(' '.join(jieba.cut(line)))
-                t.write('\n')
+def tokenize_address(corpus, token, workers=None, cache=None):
+    # 流式读写，整个语料无需一次性载入内存
+    stats = Throughput('tokenize_addresses')
+    with open(token, 'w', encoding='utf-8') as t:
+        for words in tokenize_stream(read_lines(corpus), workers, cache, stats=stats):
+            t.write(' '.join(word for word in words if word.strip()))
+            t.write('\n')
 
 
 def build_vocab(corpus, vocab_file, min_freq=1):
@@ -22,5 +24,10 @@ def build_vocab(corpus, vocab_file, min_freq=1):
             if freq >= min_freq:
                 vf.write(f"{word}\t{freq}\n")
 
-tokenize_address('data/corpus/shenzhen_corpus.txt', 'data/token/tokenized_addresses.txt')
-build_vocab('data/token/tokenized_addresses.txt', 'data/vocab/vocab.txt', min_freq=1)
\ No newline at end of file
+if __name__ == '__main__':
+    cache = TokenCache()
+    with report('tokenize_addresses'):
+        tokenize_address('data/corpus/shenzhen_corpus.txt', 'data/token/tokenized_addresses.txt', cache=cache)
+    cache.close()
+    with report('build_vocab'):
+        build_vocab('data/token/tokenized_addresses.txt', 'data/vocab/vocab.txt', min_freq=1)
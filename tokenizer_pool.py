@@ -0,0 +1,142 @@
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import time
+import jieba
+
+CACHE_PATH = 'data/cache/tokens.sqlite'
+CHUNK_LINES = 10000
+SEPARATOR = '\x1f'
+
+
+class TokenCache:
+    # 内容寻址的分词缓存：键为 (命名空间, 地址文本) 的哈希，值为分词结果
+    def __init__(self, path=CACHE_PATH, namespace='jieba'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.namespace = namespace
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tokens (key BLOB PRIMARY KEY, words TEXT NOT NULL)')
+
+    def key(self, text):
+        return hashlib.sha1(f'{self.namespace}\0{text}'.encode('utf-8')).digest()
+
+    def get_many(self, texts):
+        found = {}
+        keys = {self.key(text): text for text in texts}
+        items = list(keys)
+        for start in range(0, len(items), 500):
+            batch = items[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            for key, words in self.conn.execute(f'SELECT key, words FROM tokens WHERE key IN ({placeholders})',
+                                                batch):
+                found[keys[key]] = words.split(SEPARATOR) if words else []
+        return found
+
+    def put_many(self, tokenized):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO tokens VALUES (?, ?)',
+                                  [(self.key(text), SEPARATOR.join(words)) for text, words in tokenized.items()])
+
+    def close(self):
+        self.conn.close()
+
+
+class Throughput:
+    def __init__(self, name, report_every=100000):
+        self.name = name
+        self.report_every = report_every
+        self.lines = 0
+        self.hits = 0
+        self.start = time.perf_counter()
+        self.next_report = report_every
+
+    def update(self, lines, hits):
+        self.lines += lines
+        self.hits += hits
+        if self.lines >= self.next_report:
+            self.report()
+            self.next_report += self.report_every
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        print(f"[{self.name}] {self.lines} lines in {elapsed:.1f}s, "
+              f"{self.lines / max(elapsed, 1e-9):.0f} lines/s, cache hit rate {self.hits / max(self.lines, 1):.1%}")
+
+
+def init_worker(word_dict_path=None):
+    # 给定词表时注册为 jieba 用户词典，spawn 启动的子进程不会继承父进程的注册
+    jieba.initialize()
+    if word_dict_path:
+        from vocabulary import Vocabulary
+        Vocabulary.load(word_dict_path)
+
+
+def cut(text):
+    return jieba.lcut(text)
+
+
+class TokenizerPool:
+    # 进程池按需创建，全部命中缓存时不付出启动开销
+    def __init__(self, workers=None, word_dict_path=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.word_dict_path = word_dict_path
+        self.pool = None
+        self.initialized = False
+
+    def map(self, texts):
+        if self.workers <= 1 or len(texts) < self.workers * 100:
+            if not self.initialized:
+                init_worker(self.word_dict_path)
+                self.initialized = True
+            return [cut(text) for text in texts]
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self.word_dict_path,))
+        return self.pool.map(cut, texts, chunksize=max(1, len(texts) // (self.workers * 4)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def tokenize_stream(lines, workers=None, cache=None, chunk_lines=CHUNK_LINES, stats=None, word_dict_path=None):
+    # 按块流式分词：块内去重，先查缓存，未命中的交给进程池，结果按输入顺序产出
+    pool = TokenizerPool(workers, word_dict_path)
+    try:
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                yield from tokenize_chunk(chunk, pool, cache, stats)
+                chunk = []
+        if chunk:
+            yield from tokenize_chunk(chunk, pool, cache, stats)
+    finally:
+        pool.close()
+        if stats is not None:
+            stats.report()
+
+
+def tokenize_chunk(chunk, pool, cache, stats):
+    unique = list(dict.fromkeys(chunk))
+    tokenized = cache.get_many(unique) if cache is not None else {}
+    hits = sum(1 for text in chunk if text in tokenized)
+    missing = [text for text in unique if text not in tokenized]
+    if missing:
+        computed = dict(zip(missing, pool.map(missing)))
+        if cache is not None:
+            cache.put_many(computed)
+        tokenized.update(computed)
+    if stats is not None:
+        stats.update(len(chunk), hits)
+    return [tokenized[text] for text in chunk]
+
+
+def read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.strip()
@@ -1,148 +1,357 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
 import numpy as np
 import gensim.models.word2vec
-from sklearn.metrics import precision_score, recall_score, f1_score
+import argparse
+import json
 import logging
+import os
+import time
 import matplotlib.pyplot as plt
 from define_esim import ESIM
+from binary_dataset import has_binary, load_split
+from stage_report import peak_rss_mb
+from vocabulary import Vocabulary, file_hash
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDING_PATH = 'model/combined_embeddings.npy'
+PLOT_PATH = 'result/diagram.png'
+
 
 class TextMatchDataset(Dataset):
     def __init__(self, text1_path, text2_path, label_path, max_len=128):
         self.max_len = max_len
-        self.text1_data = self._load_text_data(text1_path)
-        self.text2_data = self._load_text_data(text2_path)
+        self.split_dir = None
+        self.text1_data, self.text1_offsets = self._load_text_data(text1_path)
+        self.text2_data, self.text2_offsets = self._load_text_data(text2_path)
         with open(label_path, 'r') as f:
             self.labels = np.array([float(line.strip()) for line in f])
+        self._init_lengths()
+
+    @classmethod
+    def from_binary(cls, split_dir, max_len=128):
+        # 以内存映射方式打开 prepare_data 生成的二进制数据，几乎不需要加载时间
+        dataset = cls.__new__(cls)
+        dataset.max_len = max_len
+        dataset.split_dir = split_dir
+        dataset._open_binary()
+        dataset._init_lengths()
+        return dataset
+
+    def _open_binary(self):
+        arrays = load_split(self.split_dir)
+        self.text1_data, self.text1_offsets = arrays['addr1_tokens'], arrays['addr1_offsets']
+        self.text2_data, self.text2_offsets = arrays['addr2_tokens'], arrays['addr2_offsets']
+        self.labels = arrays['labels']
+
+    def _init_lengths(self):
+        # 每对样本的长度取两侧较长者，用于按长度分桶
+        self.lengths = np.minimum(np.maximum(np.diff(self.text1_offsets), np.diff(self.text2_offsets)), self.max_len)
 
     def _load_text_data(self, file_path):
-        sequences = []
+        # 变长存储：所有序列首尾相接放在一个数组中，offsets 记录每条序列的起止位置
+        tokens = []
+        offsets = [0]
         with open(file_path, 'r') as f:
             for line in f:
-                nums = [int(x) for x in line.strip().split()]
-                if len(nums) > self.max_len:
-                    nums = nums[:self.max_len]
-                else:
-                    nums = nums + [0] * (self.max_len - len(nums))
-                sequences.append(nums)
-        return np.array(sequences, dtype=np.int64)
+                nums = [int(x) for x in line.strip().split()][:self.max_len]
+                tokens.extend(nums)
+                offsets.append(len(tokens))
+        return np.array(tokens, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+    def __getstate__(self):
+        # 多进程 DataLoader 只传递路径，子进程重新映射同一文件，共享页缓存
+        state = self.__dict__.copy()
+        if self.split_dir is not None:
+            for name in ('text1_data', 'text1_offsets', 'text2_data', 'text2_offsets', 'labels', 'lengths'):
+                state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.split_dir is not None:
+            self._open_binary()
+            self._init_lengths()
 
     def __len__(self):
         return len(self.labels)
 
     def __getitem__(self, idx):
+        start1, start2 = self.text1_offsets[idx], self.text2_offsets[idx]
         return {
-            'addr1': torch.LongTensor(self.text1_data[idx]),
-            'addr2': torch.LongTensor(self.text2_data[idx]),
-            'label': torch.FloatTensor([self.labels[idx]])
+            'addr1': self.text1_data[start1:min(self.text1_offsets[idx + 1], start1 + self.max_len)],
+            'addr2': self.text2_data[start2:min(self.text2_offsets[idx + 1], start2 + self.max_len)],
+            'label': float(self.labels[idx])
         }
 
 
-def load_combined_embeddings(w2v_path, glove_path, vocab_file):
-    # 加载Word2Vec模型
-    w2v_model = gensim.models.Word2Vec.load(w2v_path)
+def load_dataset(split_dir, max_len=128):
+    if has_binary(split_dir):
+        return TextMatchDataset.from_binary(split_dir, max_len=max_len)
+    return TextMatchDataset(
+        os.path.join(split_dir, 'addr1_tokenized.txt'),
+        os.path.join(split_dir, 'addr2_tokenized.txt'),
+        os.path.join(split_dir, 'labels.txt'),
+        max_len=max_len
+    )
 
-    # 加载GloVe向量
-    glove_vectors = {}
-    vector_size = None
-    with open(glove_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            tokens = line.strip().split()
-            word = tokens[0]
-            vector = np.array([float(x) for x in tokens[1:]], dtype=np.float32)
-            if vector_size is None:
-                vector_size = len(vector)
-            glove_vectors[word] = vector
 
-    # 读取交集词表
-    with open(vocab_file, 'r', encoding='utf-8') as f:
-        vocab = [line.strip() for line in f]
+def collate_batch(batch):
+    # 动态填充：每个批次只填充到批内最长的序列
+    def pad(sequences):
+        padded = np.zeros((len(sequences), max(max(len(seq) for seq in sequences), 1)), dtype=np.int64)
+        for i, seq in enumerate(sequences):
+            padded[i, :len(seq)] = seq
+        return torch.from_numpy(padded)
 
-    # 初始化合并后的嵌入矩阵
-    embedding_dim = w2v_model.vector_size + vector_size
-    embedding_matrix = np.zeros((len(vocab) + 1, embedding_dim))  # +1 为填充符0
+    return {
+        'addr1': pad([item['addr1'] for item in batch]),
+        'addr2': pad([item['addr2'] for item in batch]),
+        'label': torch.FloatTensor([[item['label']] for item in batch])
+    }
 
-    # 合并词向量
-    word_to_idx = {}
-    for i, word in enumerate(vocab, 1):  # 从1开始，0留给填充符
-        if word in w2v_model.wv and word in glove_vectors:
-            w2v_vector = w2v_model.wv[word]
-            glove_vector = glove_vectors[word]
-            embedding_matrix[i] = np.concatenate([w2v_vector, glove_vector])
-            word_to_idx[word] = i
 
-    return embedding_matrix, word_to_idx
+class BucketBatchSampler(Sampler):
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_batches=100):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_batches
+
+    def __iter__(self):
+        if not self.shuffle:
+            # 评估时全局按长度排序，填充最少
+            order = np.argsort(self.lengths, kind='stable')
+            batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        else:
+            # 训练时先打乱，再在每个桶内按长度排序切分批次，最后打乱批次顺序
+            order = np.random.permutation(len(self.lengths))
+            batches = []
+            for start in range(0, len(order), self.bucket_size):
+                bucket = order[start:start + self.bucket_size]
+                bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+                batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+            np.random.shuffle(batches)
+        for batch in batches:
+            yield batch.tolist()
 
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
 
-def evaluate(model, data_loader, device):
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def embedding_sources(w2v_path, glove_path, vocab_file):
+    # gensim 会把大数组另存为 <模型名>.*.npy，一并纳入指纹
+    w2v_dir = os.path.dirname(w2v_path) or '.'
+    w2v_files = [w2v_path] + sorted(
+        os.path.join(w2v_dir, name) for name in os.listdir(w2v_dir)
+        if name.startswith(os.path.basename(w2v_path) + '.') and name.endswith('.npy')
+    )
+    return w2v_files + [glove_path, vocab_file]
+
+
+def build_combined_embeddings(w2v_path, glove_path, vocab_file, output_path=EMBEDDING_PATH):
+    # 读取交集词表
+    with open(vocab_file, 'r', encoding='utf-8') as f:
+        vocab = [line.strip() for line in f]
+    word_to_row = {word: i for i, word in enumerate(vocab, 1)}  # 从1开始，0留给填充符
+
+    # 以内存映射方式加载Word2Vec的大数组
+    w2v_model = gensim.models.Word2Vec.load(w2v_path, mmap='r')
+    with open(glove_path, 'r', encoding='utf-8') as f:
+        glove_size = len(f.readline().rstrip().split(' ')) - 1
+    embedding_dim = w2v_model.vector_size + glove_size
+
+    # 直接写入磁盘上的 float32 矩阵，峰值内存与 GloVe 文件大小无关
+    tmp_path = output_path[:-len('.npy')] + '.tmp.npy'
+    embedding_matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                                 shape=(len(vocab) + 1, embedding_dim))
+    embedding_matrix[:] = 0
+    found = np.zeros(len(vocab) + 1, dtype=bool)
+    with open(glove_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            word, _, rest = line.rstrip().partition(' ')
+            row = word_to_row.get(word)
+            if row is None or word not in w2v_model.wv:
+                continue
+            embedding_matrix[row, :w2v_model.vector_size] = w2v_model.wv[word]
+            embedding_matrix[row, w2v_model.vector_size:] = np.array(rest.split(' '), dtype=np.float32)
+            found[row] = True
+    embedding_matrix.flush()
+    del embedding_matrix
+    os.replace(tmp_path, output_path)
+
+    sources = embedding_sources(w2v_path, glove_path, vocab_file)
+    manifest = {
+        'vocab_hash': file_hash(vocab_file),
+        'sources': {path: dict(file_fingerprint(path), sha1=file_hash(path)) for path in sources},
+        'shape': [len(vocab) + 1, embedding_dim],
+        'missing': [word for word, row in word_to_row.items() if not found[row]],
+    }
+    with open(output_path + '.manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def embeddings_up_to_date(w2v_path, glove_path, vocab_file, output_path=EMBEDDING_PATH):
+    manifest_path = output_path + '.manifest.json'
+    if not (os.path.exists(output_path) and os.path.exists(manifest_path)):
+        return False
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    sources = embedding_sources(w2v_path, glove_path, vocab_file)
+    if sorted(sources) != sorted(manifest['sources']):
+        return False
+    for path in sources:
+        recorded = manifest['sources'][path]
+        # 大小和修改时间未变时跳过哈希计算，否则再比较内容哈希
+        if file_fingerprint(path) != {'size': recorded['size'], 'mtime': recorded['mtime']} \
+                and file_hash(path) != recorded['sha1']:
+            return False
+    return manifest['vocab_hash'] == file_hash(vocab_file)
+
+
+def load_combined_embeddings(w2v_path, glove_path, vocab_file, output_path=EMBEDDING_PATH):
+    if not embeddings_up_to_date(w2v_path, glove_path, vocab_file, output_path):
+        logger.info(f'Building embedding matrix {output_path}')
+        build_combined_embeddings(w2v_path, glove_path, vocab_file, output_path)
+
+    # 矩阵第 i 行对应交集词表第 i 个词，与 generate_dict 生成的 word_dict.json 编号一致；缺失词的行为零向量
+    with open(vocab_file, 'r', encoding='utf-8') as f:
+        vocab = Vocabulary(line.strip() for line in f)
+
+    embedding_matrix = np.load(output_path, mmap_mode='r')
+    return embedding_matrix, vocab
+
+
+def threshold_metrics(scores, labels, thresholds=None):
+    # 一次向量化计算所有阈值下的 precision/recall/F1（预测为正：score > 阈值）
+    if thresholds is None:
+        thresholds = torch.arange(1, 100, dtype=torch.float64) / 100
+    scores = scores.double()
+    sorted_scores, order = torch.sort(scores)
+    sorted_labels = labels.double()[order]
+    # suffix[i] = 排序后位置 i 及之后的正样本数
+    suffix = torch.cat([sorted_labels.flip(0).cumsum(0).flip(0), sorted_labels.new_zeros(1)])
+    first_positive = torch.searchsorted(sorted_scores, thresholds.to(scores.device), right=True)
+    true_positives = suffix[first_positive]
+    predicted_positives = (len(scores) - first_positive).double()
+    positives = sorted_labels.sum()
+    precision = torch.where(predicted_positives > 0, true_positives / predicted_positives.clamp(min=1),
+                            torch.zeros_like(true_positives))
+    recall = true_positives / positives.clamp(min=1)
+    f1 = 2 * true_positives / (predicted_positives + positives).clamp(min=1)
+    return thresholds, precision.cpu(), recall.cpu(), f1.cpu()
+
+
+def evaluate(model, data_loader, device, thresholds=None):
     model.eval()
-    predictions = []
-    true_labels = []
+    num_samples = len(data_loader.dataset)
+    scores = torch.empty(num_samples, device=device)
+    true_labels = torch.empty(num_samples, device=device)
 
-    with torch.no_grad():
+    offset = 0
+    with torch.inference_mode():
         for batch in data_loader:
-            text1 = batch['addr1'].to(device)
-            text2 = batch['addr2'].to(device)
-            labels = batch['label'].to(device)
+            text1 = batch['addr1'].to(device, non_blocking=True)
+            text2 = batch['addr2'].to(device, non_blocking=True)
+            labels = batch['label'].to(device, non_blocking=True)
 
             outputs = model(text1, text2)
-            predictions.extend((outputs > 0.5).float().cpu().numpy())
-            true_labels.extend(labels.cpu().numpy())
-
-    # Calculate metrics
-    precision = precision_score(true_labels, predictions)
-    recall = recall_score(true_labels, predictions)
-    f1 = f1_score(true_labels, predictions)
+            scores[offset:offset + len(outputs)] = outputs.view(-1)
+            true_labels[offset:offset + len(outputs)] = labels.view(-1)
+            offset += len(outputs)
+
+    # Calculate metrics for the whole threshold grid in one pass
+    thresholds, precision, recall, f1 = threshold_metrics(scores[:offset], true_labels[:offset], thresholds)
+    best = int(torch.argmax(f1))
+    default = int(torch.argmin((thresholds - 0.5).abs()))
+    best_threshold = {
+        'threshold': float(thresholds[best]),
+        'precision': float(precision[best]),
+        'recall': float(recall[best]),
+        'f1': float(f1[best]),
+    }
 
-    return precision, recall, f1
+    return float(precision[default]), float(recall[default]), float(f1[default]), best_threshold
 
-def train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs, device, save_path):
+def train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs, device, save_path,
+                accumulation_steps=1, autocast_dtype=None, plot_path=PLOT_PATH):
     best_f1 = 0
     # Initialize history dictionary to store metrics
     history = {
         'loss': [],
         'precision': [],
         'recall': [],
-        'f1': []
+        'f1': [],
+        'epoch_time': [],
+        'samples_per_sec': [],
+        'data_time': [],
+        'compute_time': [],
+        'peak_rss_mb': []
     }
 
     for epoch in range(num_epochs):
         model.train()
         total_loss = 0
-        for batch in train_loader:
-            text1 = batch['addr1'].to(device)
-            text2 = batch['addr2'].to(device)
-            labels = batch['label'].to(device)
-
-            optimizer.zero_grad()
-            outputs = model(text1, text2)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
+        num_samples = 0
+        data_time = 0
+        epoch_start = time.perf_counter()
+        optimizer.zero_grad()
+        # 区分等待数据的时间和前向/反向计算的时间
+        batch_start = time.perf_counter()
+        for step, batch in enumerate(train_loader, 1):
+            data_time += time.perf_counter() - batch_start
+            text1 = batch['addr1'].to(device, non_blocking=True)
+            text2 = batch['addr2'].to(device, non_blocking=True)
+            labels = batch['label'].to(device, non_blocking=True)
+
+            with torch.autocast(device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                outputs = model(text1, text2)
+            loss = criterion(outputs.float(), labels)
+            # 梯度累积：每 accumulation_steps 个批次更新一次参数
+            (loss / accumulation_steps).backward()
+            if step % accumulation_steps == 0 or step == len(train_loader):
+                optimizer.step()
+                optimizer.zero_grad()
 
             total_loss += loss.item()
+            num_samples += len(labels)
+            batch_start = time.perf_counter()
 
         avg_loss = total_loss / len(train_loader)
-        val_precision, val_recall, val_f1 = evaluate(model, val_loader, device)
+        epoch_time = time.perf_counter() - epoch_start
+        val_precision, val_recall, val_f1, val_best = evaluate(model, val_loader, device)
 
         # Store metrics in history
         history['loss'].append(avg_loss)
         history['precision'].append(val_precision)
         history['recall'].append(val_recall)
         history['f1'].append(val_f1)
+        history['epoch_time'].append(epoch_time)
+        history['samples_per_sec'].append(num_samples / max(epoch_time, 1e-9))
+        history['data_time'].append(data_time)
+        history['compute_time'].append(epoch_time - data_time)
+        history['peak_rss_mb'].append(peak_rss_mb())
 
         # Log all metrics
         logger.info(f'Epoch [{epoch + 1}/{num_epochs}]')
         logger.info(f'Training Loss: {avg_loss:.4f}')
+        logger.info(f"Epoch Time: {epoch_time:.1f}s ({history['samples_per_sec'][-1]:.0f} samples/s, "
+                    f"data wait {data_time:.1f}s, compute {epoch_time - data_time:.1f}s)")
+        logger.info(f"Peak RSS: {history['peak_rss_mb'][-1]:.0f} MB")
         logger.info(f'Validation Precision: {val_precision:.4f}')
         logger.info(f'Validation Recall: {val_recall:.4f}')
         logger.info(f'Validation F1: {val_f1:.4f}')
+        logger.info(f"Best Threshold: {val_best['threshold']:.2f} (F1 {val_best['f1']:.4f})")
 
         # Save model if F1 score improves
         if val_f1 > best_f1:
@@ -154,17 +363,20 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, num_epoch
                 'best_f1': best_f1,
                 'precision': val_precision,
                 'recall': val_recall,
+                'threshold': val_best['threshold'],
+                'threshold_f1': val_best['f1'],
+                'masked': getattr(model, 'masked', False),
             }, save_path)
             logger.info("best model found and saved")
 
         logger.info('-' * 50)
 
     # Plot training history
-    plot_training_history(history, num_epochs)
+    plot_training_history(history, num_epochs, plot_path)
 
     return history
 
-def plot_training_history(history, num_epochs):
+def plot_training_history(history, num_epochs, plot_path=PLOT_PATH):
     plt.figure(figsize=(10, 6))
     epochs = range(1, num_epochs + 1)
 
@@ -181,46 +393,71 @@ def plot_training_history(history, num_epochs):
     plt.grid(True)
 
     # Save the plot
-    plt.savefig('result/diagram.png')
+    os.makedirs(os.path.dirname(plot_path) or '.', exist_ok=True)
+    plt.savefig(plot_path)
     plt.close()
 
 
+def make_loader(dataset, batch_sampler, num_workers=0, prefetch_factor=2):
+    # 多进程加载时保持工作进程常驻并预取批次；数据集在工作进程中重新打开内存映射
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {'num_workers': num_workers, 'persistent_workers': True, 'prefetch_factor': prefetch_factor}
+    return DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=collate_batch,
+                      pin_memory=torch.cuda.is_available(), **kwargs)
+
+
 # 训练主函数
 def main():
+    parser = argparse.ArgumentParser(description='Train the ESIM address matcher')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--accumulation-steps', type=int, default=1,
+                        help='effective batch size is batch size x accumulation steps')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--prefetch-factor', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast for the forward pass')
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--masked', action='store_true',
+                        help='packed-sequence LSTMs with masked attention and pooling (recorded in the checkpoint)')
+    args = parser.parse_args()
+
     # Configuration
-    BATCH_SIZE = 32
-    NUM_EPOCHS = 50
+    BATCH_SIZE = args.batch_size
+    EVAL_BATCH_SIZE = 512
+    NUM_EPOCHS = args.epochs
     LEARNING_RATE = 0.0001
     MAX_LEN = 128
     DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-    logger.info(f'Using device: {DEVICE}')
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    logger.info(f'Using device: {DEVICE}, {torch.get_num_threads()} threads')
 
     # Load datasets
-    train_dataset = TextMatchDataset(
-        'data/dataset/train/addr1_tokenized.txt',
-        'data/dataset/train/addr2_tokenized.txt',
-        'data/dataset/train/labels.txt',
-        max_len=MAX_LEN
+    train_dataset = load_dataset('data/dataset/train', max_len=MAX_LEN)
+    val_dataset = load_dataset('data/dataset/valid', max_len=MAX_LEN)
+
+    train_loader = make_loader(
+        train_dataset,
+        BucketBatchSampler(train_dataset.lengths, BATCH_SIZE, shuffle=True),
+        args.workers,
+        args.prefetch_factor
     )
-
-    val_dataset = TextMatchDataset(
-        'data/dataset/valid/addr1_tokenized.txt',
-        'data/dataset/valid/addr2_tokenized.txt',
-        'data/dataset/valid/labels.txt',
-        max_len=MAX_LEN
+    val_loader = make_loader(
+        val_dataset,
+        BucketBatchSampler(val_dataset.lengths, EVAL_BATCH_SIZE, shuffle=False),
+        args.workers,
+        args.prefetch_factor
     )
 
-    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE)
-
     # Load word embeddings
-    embedding_matrix, word_to_idx = load_combined_embeddings(
+    embedding_matrix, _ = load_combined_embeddings(
         'model/word2vec.model',
         'GloVe/vectors.txt',
         'data/vocab/intersection_vocab.txt'
     )
-    vocab_size = len(word_to_idx) + 1  # +1 为填充符
+    vocab_size = embedding_matrix.shape[0]  # 含填充符0
     embedding_dim = embedding_matrix.shape[1]
 
     # Initialize model (only once)
@@ -228,7 +465,8 @@ def main():
         vocab_size=vocab_size,
         embedding_dim=embedding_dim,
         embedding_matrix=embedding_matrix,
-        max_sequence_length=MAX_LEN
+        max_sequence_length=MAX_LEN,
+        masked=args.masked
     ).to(DEVICE)
 
     # Loss and optimizer
@@ -244,7 +482,9 @@ def main():
         optimizer=optimizer,
         num_epochs=NUM_EPOCHS,
         device=DEVICE,
-        save_path='result/best_esim_model.pth'
+        save_path='result/best_esim_model.pth',
+        accumulation_steps=args.accumulation_steps,
+        autocast_dtype=torch.bfloat16 if args.bf16 else None
     )
 
     logger.info("Training completed. Training history plot saved as 'result.png'")
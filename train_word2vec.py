@@ -1,21 +1,73 @@
-import mittens
+import argparse
+import logging
+import os
 import gensim
-import numpy as np
-from collections import Counter
+from stage_report import report
 
+TOKEN_FILE = 'data/token/tokenized_addresses.txt'
+MODEL_FILE = 'model/word2vec.model'
 
-def load_corpus(token_file):
-    sentences = []
-    with open(token_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            sentences.append(line.strip().split())
-    return sentences
 
+class TokenCorpus:
+    # 每次迭代重新打开分词文件逐行产出，gensim 建词表和每个 epoch 各扫一遍，内存与语料大小无关
+    def __init__(self, token_file):
+        self.token_file = token_file
 
-def train_word2vec(token_file, vector_size, window_size, min_count, model_file):
-    sentences = load_corpus(token_file)
-    model = gensim.models.Word2Vec(sentences, vector_size=vector_size, window=window_size, min_count=min_count)
+    def __iter__(self):
+        with open(self.token_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                tokens = line.split()
+                if tokens:
+                    yield tokens
+
+
+def vocab_path(model_file):
+    return os.path.splitext(model_file)[0] + '.vocab.txt'
+
+
+def write_vocab(model, vocab_file):
+    # 与 data/vocab/vocab.txt 同格式（词\t频次），供交集词表计算时免去加载整个模型
+    tmp_file = vocab_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for word in model.wv.index_to_key:
+            f.write(f"{word}\t{model.wv.get_vecattr(word, 'count')}\n")
+    os.replace(tmp_file, vocab_file)
+
+
+def train_word2vec(token_file, vector_size, window_size, min_count, model_file, workers=None, epochs=5,
+                   corpus_file=False):
+    # corpus_file 模式由各 worker 直接按偏移读取文件，不经过单线程的句子分发，核数多时扩展性更好
+    workers = workers or os.cpu_count()
+    options = dict(vector_size=vector_size, window=window_size, min_count=min_count, workers=workers, epochs=epochs)
+    if corpus_file:
+        model = gensim.models.Word2Vec(corpus_file=token_file, **options)
+    else:
+        model = gensim.models.Word2Vec(TokenCorpus(token_file), **options)
+    os.makedirs(os.path.dirname(model_file) or '.', exist_ok=True)
     model.save(model_file)
+    write_vocab(model, vocab_path(model_file))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train word2vec on the tokenized address corpus')
+    parser.add_argument('--tokens', default=TOKEN_FILE)
+    parser.add_argument('--output', default=MODEL_FILE)
+    parser.add_argument('--vector-size', type=int, default=100)
+    parser.add_argument('--window', type=int, default=5)
+    parser.add_argument('--min-count', type=int, default=1)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help='training threads, defaults to all cores')
+    parser.add_argument('--corpus-file', action='store_true',
+                        help="let gensim's workers read the token file directly instead of streaming sentences")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with report('train_word2vec'):
+        model = train_word2vec(args.tokens, args.vector_size, args.window, args.min_count, args.output,
+                               args.workers, args.epochs, args.corpus_file)
+    print(f"Word2Vec vocabulary {len(model.wv)} words, saved to {args.output} and {vocab_path(args.output)}")
 
 
-train_word2vec('data/token/tokenized_addresses.txt', 100, 5, 1, 'model/word2vec.model')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
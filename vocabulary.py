@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+from itertools import chain, repeat
+import jieba
+import numpy as np
+
+WORD_DICT_PATH = 'data/dict/word_dict.json'
+CACHE_DIR = 'data/cache'
+MAX_LEN = 128
+# 分词方式的标识，写入参考缓存、索引等的键；分词行为改变时修改，旧缓存随之失效
+TOKENIZER = 'jieba+vocab-admin'
+# 行政区划后缀；后缀出现在词中间的词（如 区福永）是 HMM 跨越行政边界切出的，注册后会破坏 区/街道 的切分
+ADMIN_SUFFIXES = ('区', '市', '县', '街道', '镇')
+
+# 已注册进 jieba 的词表签名，同一进程内只注册一次
+_registered = set()
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def vocab_hash(word_dict_path):
+    # 词表注册进 jieba 后切分结果随之改变，缓存键同时记录词表内容和分词方式
+    return f'{file_hash(word_dict_path)}:{TOKENIZER}'
+
+
+class Vocabulary:
+    # 词 -> 编号，编号从 1 开始，0 同时表示填充和未登录词；
+    # freqs 为注册进 jieba 的词频，0 表示 jieba 自带词典已收录该词
+    def __init__(self, words, freqs=None, signature='', path=None):
+        self.words = list(words)
+        self.path = path
+        self.word_to_id = {word: index for index, word in enumerate(self.words, 1) if word}
+        self.freqs = freqs
+        self.signature = signature or hashlib.sha1('\n'.join(self.words).encode('utf-8')).hexdigest()[:16]
+        self.size = len(self.words) + 1
+
+    @classmethod
+    def from_json(cls, word_dict_path):
+        with open(word_dict_path, 'r', encoding='utf-8') as f:
+            word_dict = json.load(f)
+        words = [''] * max(word_dict.values(), default=0)
+        for word, index in word_dict.items():
+            words[index - 1] = word
+        return cls(words)
+
+    @classmethod
+    def load(cls, word_dict_path=WORD_DICT_PATH, cache_dir=CACHE_DIR, register=True):
+        # 编译结果以源文件的大小和修改时间为签名缓存为 npz，之后加载只需解码一个字节数组
+        stat = os.stat(word_dict_path)
+        signature = f'{stat.st_size} {stat.st_mtime_ns} {TOKENIZER}'
+        name = hashlib.sha1(os.path.abspath(word_dict_path).encode('utf-8')).hexdigest()[:8]
+        compiled_path = os.path.join(cache_dir, f'vocab_{name}.npz')
+        vocab = None
+        if os.path.exists(compiled_path):
+            vocab = cls.read(compiled_path, signature)
+        if vocab is None:
+            vocab = cls.from_json(word_dict_path)
+            vocab.compile()
+            if all('\n' not in word for word in vocab.words):
+                vocab.save(compiled_path, signature)
+        vocab.path = word_dict_path
+        if register:
+            vocab.register_jieba()
+        return vocab
+
+    @classmethod
+    def read(cls, compiled_path, signature=None):
+        with np.load(compiled_path, allow_pickle=False) as data:
+            if signature is not None and str(data['source']) != signature:
+                return None
+            words = data['words'].tobytes().decode('utf-8').split('\n') if data['words'].size else []
+            return cls(words, data['freqs'], str(data['signature']))
+
+    def save(self, compiled_path, source=''):
+        os.makedirs(os.path.dirname(compiled_path) or '.', exist_ok=True)
+        tmp_path = compiled_path[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_path, words=np.frombuffer('\n'.join(self.words).encode('utf-8'), dtype=np.uint8),
+                 freqs=self.freqs, signature=np.array(self.signature), source=np.array(source))
+        os.replace(tmp_path, compiled_path)
+
+    def compile(self):
+        # jieba 词典未收录的词（多为 HMM 新词发现切出的词）按 suggest_freq 求出能整体切出的词频；
+        # 跨越行政区划后缀的词不注册
+        jieba.initialize()
+        known = jieba.dt.FREQ
+        self.freqs = np.fromiter((0 if known.get(word) or crosses_admin(word) else jieba.suggest_freq(word, False)
+                                  for word in self.words), dtype=np.int64, count=len(self.words))
+        return self
+
+    def register_jieba(self):
+        # 把词表注册为 jieba 用户词典，训练数据与线上查询的切分一致，不依赖 HMM 在上下文中的猜测
+        if self.signature in _registered:
+            return
+        if self.freqs is None:
+            self.compile()
+        jieba.initialize()
+        for word, freq in zip(self.words, self.freqs.tolist()):
+            if freq:
+                jieba.add_word(word, freq)
+        _registered.add(self.signature)
+
+    @property
+    def namespace(self):
+        # 分词缓存的命名空间，与未注册词表的 jieba 结果分开
+        return f'{TOKENIZER}:{self.signature}'
+
+    def __len__(self):
+        return len(self.word_to_id)
+
+    def __contains__(self, word):
+        return word in self.word_to_id
+
+    def __getitem__(self, word):
+        return self.word_to_id[word]
+
+    def get(self, word, default=None):
+        return self.word_to_id.get(word, default)
+
+    def items(self):
+        return self.word_to_id.items()
+
+    def tokenize(self, text):
+        return jieba.lcut(text)
+
+    def ids(self, tokens):
+        return list(map(self.word_to_id.get, tokens, repeat(0)))
+
+    def encode(self, text, max_len=MAX_LEN):
+        indices = self.ids(jieba.cut(text))[:max_len]
+        indices.extend([0] * (max_len - len(indices)))
+        return indices
+
+    def encode_ragged(self, texts, max_len=None):
+        # 返回扁平的 int64 编号数组和长度为 len(texts) + 1 的偏移数组，第 i 条为 ids[offsets[i]:offsets[i + 1]]
+        token_lists = [jieba.lcut(text) for text in texts]
+        lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+        ids = np.fromiter(map(self.word_to_id.get, chain.from_iterable(token_lists), repeat(0)), dtype=np.int64,
+                          count=int(lengths.sum()))
+        if max_len is not None and len(lengths) and lengths.max() > max_len:
+            keep = positions(lengths) < max_len
+            ids = ids[keep]
+            lengths = np.minimum(lengths, max_len)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return ids, offsets
+
+    def encode_batch(self, texts, max_len=MAX_LEN, trim=False):
+        # 返回 (len(texts), max_len) 的 int64 矩阵，0 填充；trim=True 时只填充到批内最长序列
+        ids, offsets = self.encode_ragged(texts, max_len)
+        lengths = np.diff(offsets)
+        width = max(int(lengths.max(initial=0)), 1) if trim else max_len
+        batch = np.zeros((len(texts), width), dtype=np.int64)
+        batch[np.repeat(np.arange(len(texts)), lengths), positions(lengths)] = ids
+        return batch
+
+
+def crosses_admin(word):
+    return any(suffix in word[:-len(suffix)] for suffix in ADMIN_SUFFIXES)
+
+
+def positions(lengths):
+    # 扁平数组中每个元素在所属序列内的位置
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(int(lengths.sum())) - np.repeat(starts, lengths)